@@ -1,3 +1,14 @@
+from .async_database import AsyncDatabase
+from .async_generic_table import AsyncGenericTable
+from .batch import BatchError
 from .database import Database
 from .generic_table import GenericTable
+from .indexes import Constraint, Index
+from .instrumentation import Instrumentation, QueryEvent
+from .partitioning import Partition, Partitioning
 from .postgres import Postgres
+from .result_cache import ResultCache, get_result_cache
+from .result_cache import invalidate_results
+from .rows import Row, RowCursor, row_value
+from .schema_cache import IndexInfo, TableSchema, invalidate_schemas
+from .pool import ConnectionPool, close_pools, get_pool
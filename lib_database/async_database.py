@@ -0,0 +1,133 @@
+import logging
+from itertools import count
+
+from .postgres import Postgres
+
+
+_cursor_ids = count()
+
+
+class AsyncDatabase(Postgres):
+    """Asyncio counterpart of Database, built on psycopg 3
+
+    Every query checks out its own connection from a pool, so queries
+    from many tasks run concurrently. Needs the optional psycopg and
+    psycopg_pool packages. Use with async with, or await open/close.
+    """
+
+    def __init__(self,
+                 conf_section=None,
+                 pool=None,
+                 min_size: int = 1,
+                 max_size: int = 10):
+        """Saves settings. Connections are made in open
+
+        pool can be another AsyncDatabase's pool, so that several
+        tables share connections. That pool is not closed by close.
+        conf_section defaults to Postgres.default_conf_section"""
+
+        self._conf_section = conf_section or self.default_conf_section
+        self._pool = pool
+        self._owns_pool = pool is None
+        self._min_size = min_size
+        self._max_size = max_size
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    @property
+    def pool(self):
+        return self._pool
+
+    async def open(self):
+        """Opens the connection pool (if one wasn't passed in)"""
+
+        if self._pool is None:
+            # Optional dependencies, only needed for asyncio
+            from psycopg.rows import dict_row
+            from psycopg_pool import AsyncConnectionPool
+
+            creds = self._get_db_creds(self._conf_section)
+            creds["dbname"] = creds.pop("database")
+            self._pool = AsyncConnectionPool(
+                kwargs={**creds, "autocommit": True, "row_factory": dict_row},
+                min_size=self._min_size,
+                max_size=self._max_size,
+                open=False)
+            await self._pool.open()
+            logging.debug("Async database connected")
+        return self
+
+    async def close(self):
+        """Closes the pool if this object made it"""
+
+        if self._owns_pool and self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def execute(self, sql: str, data: iter = []) -> list:
+        """Executes a query. Returns [] if no results."""
+
+        assert (isinstance(data, list)
+                or isinstance(data, tuple)), "Data must be list/tuple"
+        async with self._pool.connection() as conn:
+            cursor = await conn.execute(sql, data)
+            if cursor.description is None:
+                return []
+            return await cursor.fetchall()
+
+    async def execute_iter(self,
+                           sql: str,
+                           data: iter = [],
+                           itersize: int = 2000,
+                           batch: bool = False):
+        """Lazily yields rows from a server side cursor
+
+        Async version of Database.execute_iter. The connection is held
+        in a transaction until the generator finishes or is closed."""
+
+        async with self._pool.connection() as conn:
+            async with conn.transaction():
+                name = f"lib_database_{next(_cursor_ids)}"
+                async with conn.cursor(name=name) as cursor:
+                    cursor.itersize = itersize
+                    await cursor.execute(sql, data)
+                    if batch:
+                        rows = await cursor.fetchmany(itersize)
+                        while rows:
+                            yield rows
+                            rows = await cursor.fetchmany(itersize)
+                    else:
+                        async for row in cursor:
+                            yield row
+
+    async def copy_in(self, sql: str, chunks):
+        """Sends an iterable (or async iterable) of bytes to COPY FROM
+
+        Returns the number of bytes sent"""
+
+        num_bytes = 0
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                async with cursor.copy(sql) as copy:
+                    if hasattr(chunks, "__aiter__"):
+                        async for chunk in chunks:
+                            await copy.write(chunk)
+                            num_bytes += len(chunk)
+                    else:
+                        for chunk in chunks:
+                            await copy.write(chunk)
+                            num_bytes += len(chunk)
+        return num_bytes
+
+    async def copy_out(self, sql: str, data: iter = []):
+        """Yields bytes chunks from a COPY TO STDOUT"""
+
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                async with cursor.copy(sql, data or None) as copy:
+                    async for chunk in copy:
+                        yield bytes(chunk)
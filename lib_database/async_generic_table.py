@@ -0,0 +1,194 @@
+import logging
+
+import numpy as np
+
+from .async_database import AsyncDatabase
+from .binary_copy import encode_columns
+from .copy_buffer import encode_text_rows, peek_columns
+
+
+class AsyncGenericTable(AsyncDatabase):
+    """Asyncio counterpart of GenericTable
+
+    Subclasses have the same name and id_col attrs, and create_table,
+    except that create_table is async and awaits self.execute:
+
+    class Table(AsyncGenericTable):
+        name = "table"
+        id_col = None
+
+        async def create_table(self):
+            await self.execute("CREATE TABLE IF NOT EXISTS ...")
+
+    async with Table(clear=True) as table:
+        await table.insert({"col": 1})
+    """
+
+    def __init__(self, clear=False, **kwargs):
+        """Validates name subclass attr. Tables are made in open"""
+
+        assert hasattr(self, "name"), "Subclass MUST have a table name attr"
+        id_col_err = "Subclass must have an id_col attr, even if it's None"
+        assert hasattr(self, "id_col"), id_col_err
+
+        super(AsyncGenericTable, self).__init__(**kwargs)
+        self._clear = clear
+
+    async def open(self):
+        """Connects, clears the table if needed, and creates it"""
+
+        await super(AsyncGenericTable, self).open()
+        if self._clear:
+            await self.clear_table()
+        await self.create_table()
+        return self
+
+    async def clear_table(self):
+        """Clears the table"""
+
+        logging.debug(f"Dropping {self.name} Table")
+        await self.execute(f"DROP TABLE IF EXISTS {self.name} CASCADE")
+        logging.debug(f"{self.name} Table dropped")
+
+    async def insert(self, data: dict):
+        """Inserts a dictionary into the database, and returns id_col"""
+
+        assert isinstance(data, dict)
+
+        data = {k: (v.tolist() if isinstance(v, np.ndarray)
+                    else list(v) if isinstance(v, tuple) else v)
+                for k, v in data.items()}
+        if data:
+            sql = (f"INSERT INTO {self.name} ({','.join(data.keys())})"
+                   f" VALUES ({', '.join(['%s'] * len(data))})")
+        else:
+            sql = f"INSERT INTO {self.name} DEFAULT VALUES"
+
+        if self.id_col:
+            sql += f" RETURNING {self.id_col};"
+
+        result = await self.execute(sql, tuple(data.values()))
+
+        # Return the new ID
+        if self.id_col:
+            return result[0][self.id_col]
+
+    async def get_all(self) -> list:
+        """Gets all rows from table"""
+
+        return await self.execute(f"SELECT * FROM {self.name}")
+
+    def iter_all(self, itersize: int = 2000, batch: bool = False):
+        """Lazily yields all rows from table. See execute_iter"""
+
+        return self.execute_iter(f"SELECT * FROM {self.name}",
+                                 itersize=itersize,
+                                 batch=batch)
+
+    async def get_count(self, sql: str = None, data: list = []) -> int:
+        """Gets count from table"""
+
+        if data:
+            assert sql
+
+        sql = sql if sql else f"SELECT COUNT(*) FROM {self.name}"
+
+        assert "count" in sql.lower(), "This is not a count query"
+
+        return (await self.execute(sql, data))[0]["count"]
+
+    async def bulk_insert(self,
+                          rows,
+                          columns: list = None,
+                          batch_size: int = 1000) -> int:
+        """Streams rows into the table with COPY FROM STDIN
+
+        rows can be an iterable or async iterable of dicts, or of
+        sequences ordered like columns. See GenericTable.bulk_insert_stream
+        """
+
+        if hasattr(rows, "__aiter__"):
+            rows, columns = await _apeek_columns(rows, columns)
+            chunks = _aencode_text_rows(rows, columns, batch_size)
+        else:
+            rows, columns = peek_columns(rows, columns)
+            chunks = encode_text_rows(rows, columns, batch_size)
+        if not columns:
+            return 0
+        sql = f"COPY {self.name} ({','.join(columns)}) FROM STDIN"
+        return await self.copy_in(sql, chunks)
+
+    async def bulk_insert_columns(self,
+                                  columns: dict,
+                                  chunk_rows: int = 65536) -> int:
+        """Inserts a dict of {column: array} with a binary COPY
+
+        See GenericTable.bulk_insert_columns"""
+
+        chunks = encode_columns(columns, await self.column_types, chunk_rows)
+        sql = (f"COPY {self.name} ({','.join(columns)}) "
+               "FROM STDIN WITH (FORMAT binary)")
+        return await self.copy_in(sql, chunks)
+
+    def iter_copy_to(self,
+                     query: str = None,
+                     data: iter = [],
+                     fmt: str = "text",
+                     header: bool = False):
+        """Yields bytes chunks of the table (or a query) from COPY TO"""
+
+        source = f"({query})" if query else self.name
+        options = f"FORMAT {fmt}" + (", HEADER" if header else "")
+        return self.copy_out(f"COPY {source} TO STDOUT WITH ({options})",
+                             data)
+
+    @property
+    async def columns(self) -> list:
+        """Returns the columns of the table. Must be awaited"""
+
+        return list(await self.column_types)
+
+    @property
+    async def column_types(self) -> dict:
+        """Returns {column: udt_name} for the table. Must be awaited"""
+
+        sql = """SELECT column_name, udt_name FROM information_schema.columns
+              WHERE table_schema = 'public' AND table_name = %s
+                ORDER BY ordinal_position;
+              """
+
+        return {x["column_name"]: x["udt_name"]
+                for x in await self.execute(sql, [self.name])}
+
+
+async def _apeek_columns(rows, columns=None):
+    """Async version of peek_columns"""
+
+    rows = rows.__aiter__()
+    if columns is not None:
+        return rows, list(columns)
+    try:
+        first = await rows.__anext__()
+    except StopAsyncIteration:
+        return rows, []
+    assert isinstance(first, dict), "Columns are required for non dict rows"
+
+    async def chained():
+        yield first
+        async for row in rows:
+            yield row
+    return chained(), list(first.keys())
+
+
+async def _aencode_text_rows(rows, columns: list, batch_size: int):
+    """Async version of encode_text_rows"""
+
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            for chunk in encode_text_rows(batch, columns, batch_size):
+                yield chunk
+            batch = []
+    for chunk in encode_text_rows(batch, columns, batch_size):
+        yield chunk
@@ -0,0 +1,145 @@
+from contextlib import nullcontext
+import logging
+import re
+
+import psycopg2
+
+from .result_cache import invalidate_results_for_sql
+from .schema_cache import invalidate_for_sql
+from .statement_cache import first_word
+
+
+# Statements whose rows execute_batch collects
+_RETURNS_ROWS = {"SELECT", "WITH", "VALUES", "SHOW", "EXPLAIN", "TABLE"}
+_RETURNING = re.compile(r"\bRETURNING\b", re.IGNORECASE)
+
+
+class BatchError(psycopg2.Error):
+    """A statement of execute_batch failed
+
+    index, sql and params are those of the failed statement, and the
+    error postgres raised is the __cause__"""
+
+    def __init__(self, index: int, sql: str, params, error):
+        super(BatchError, self).__init__(
+            f"Statement {index} of the batch failed: {error}\n{sql}")
+        self.index = index
+        self.sql = sql
+        self.params = params
+        self.error = error
+
+
+def execute_batch(self,
+                  statements: list,
+                  transaction: bool = True,
+                  page_size: int = 100,
+                  collect_results: bool = True):
+    """Executes many statements with few round trips
+
+    statements is a list of (sql, params) or sql strings. Each page of
+    up to page_size statements has its params filled in, and is sent as
+    one multi statement query.
+
+    If transaction, every statement runs in one transaction (or the
+    current one), otherwise each page commits as it goes.
+
+    If collect_results, a list with the rows of each statement ([] for
+    those without) is returned. Statements that return rows (SELECT,
+    RETURNING...) end a page, since only the last statement of a query
+    returns rows.
+
+    If a statement fails, its page is rolled back and rerun a
+    statement at a time, in a transaction that is always rolled back,
+    to find it. A BatchError with its index is raised, or the original
+    error if the rerun succeeds. Either way none of that page is
+    applied.
+
+    Pages are sent straight to the cursor, so they skip the
+    instrumentation and statement_cache of the connection.
+    """
+
+    statements = [(x, []) if isinstance(x, str) else x for x in statements]
+    pages = _pages(statements, page_size, collect_results)
+    results = [] if collect_results else None
+
+    with self.transaction() if transaction else nullcontext():
+        for start, stop in pages:
+            rows = _execute_page(self, statements, start, stop)
+            if collect_results:
+                results.extend([[]] * (stop - start - 1) + [rows])
+    return results
+
+
+def _pages(statements: list, page_size: int, collect_results: bool):
+    """Returns [(start, stop)] indexes of the statements in each page"""
+
+    pages = []
+    start = 0
+    for i, (sql, _) in enumerate(statements):
+        if (i + 1 - start >= page_size
+                or (collect_results and _returns_rows(sql))
+                or i == len(statements) - 1):
+            pages.append((start, i + 1))
+            start = i + 1
+    return pages
+
+
+def _returns_rows(sql: str) -> bool:
+    return (first_word(sql) in _RETURNS_ROWS
+            or _RETURNING.search(sql) is not None)
+
+
+def _execute_page(self, statements: list, start: int, stop: int) -> list:
+    """Runs statements[start:stop] as one query. Returns the last's rows
+
+    Inside a transaction a savepoint is set, so that after a failure
+    the statements can be rerun one at a time from the same state"""
+
+    cursor = self._cursor
+    in_transaction = not self._conn.autocommit
+    sqls = [cursor.mogrify(sql, params).decode().strip().rstrip(";")
+            for sql, params in statements[start:stop]]
+    try:
+        if in_transaction:
+            cursor.execute("SAVEPOINT lib_database_batch")
+        # No params, since they are filled in already
+        cursor.execute(";\n".join(sqls))
+        rows = cursor.fetchall() if cursor.description else []
+        if in_transaction:
+            cursor.execute("RELEASE SAVEPOINT lib_database_batch")
+    # Such as a lost connection or a cancel, so no point in rerunning
+    except psycopg2.OperationalError:
+        raise
+    except psycopg2.Error:
+        if in_transaction:
+            cursor.execute("ROLLBACK TO SAVEPOINT lib_database_batch")
+        _raise_failed(self, statements, start, sqls, in_transaction)
+        raise
+    for sql in sqls:
+        invalidate_for_sql(self._database, sql)
+        self._wrote(invalidate_results_for_sql(self._database, sql))
+    return rows
+
+
+def _raise_failed(self, statements, start, sqls, in_transaction: bool):
+    """Reruns a failed page a statement at a time, raising at the error
+
+    The page was rolled back as a whole, and the rerun is rolled back
+    too (to the savepoint, or a transaction of its own without one),
+    so a rerun that succeeds doesn't leave the page applied. Then the
+    caller raises the original error"""
+
+    rollback = ("ROLLBACK TO SAVEPOINT lib_database_batch" if in_transaction
+                else "ROLLBACK")
+    if not in_transaction:
+        self._cursor.execute("BEGIN")
+    try:
+        for i, sql in enumerate(sqls):
+            try:
+                self._cursor.execute(sql)
+            except psycopg2.Error as e:
+                index = start + i
+                logging.error(f"Statement {index} of the batch failed: {sql}")
+                raise BatchError(index, sql, statements[index][1], e) from e
+    finally:
+        self._cursor.execute(rollback)
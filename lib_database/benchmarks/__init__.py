@@ -0,0 +1,5 @@
+"""Benchmarks, each run as a module such as
+python3 -m lib_database.benchmarks.suite
+
+Nothing is imported here, so that running them with -m doesn't import
+them twice"""
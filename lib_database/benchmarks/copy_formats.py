@@ -0,0 +1,87 @@
+"""Compares the TSV, streaming text and binary COPY paths
+
+Run against a local database with:
+python3 -m lib_database.benchmarks.copy_formats
+"""
+
+import logging
+import os
+import time
+
+import numpy as np
+
+from lib_utils import file_funcs
+
+from ..generic_table import GenericTable
+
+
+class CopyBenchTable(GenericTable):
+    """Table with int, float, text, bool and array columns"""
+
+    name = "lib_database_copy_bench"
+    id_col = None
+
+    def create_table(self):
+        sql = f"""CREATE TABLE IF NOT EXISTS {self.name} (
+                int_col BIGINT,
+                float_col DOUBLE PRECISION,
+                text_col TEXT,
+                bool_col BOOLEAN,
+                array_col DOUBLE PRECISION[]
+              );"""
+        self.execute(sql)
+
+
+def get_rows(num_rows: int, array_len: int = 16) -> list:
+    """Returns rows of random data for the bench table"""
+
+    rng = np.random.default_rng(0)
+    return [{"int_col": i,
+             "float_col": float(rng.random()),
+             "text_col": f"row number {i}",
+             "bool_col": bool(i % 2),
+             "array_col": rng.random(array_len)}
+            for i in range(num_rows)]
+
+
+def benchmark_copy_formats(num_rows: int = 100000, **kwargs) -> dict:
+    """Returns {path: {rows_per_sec, seconds, bytes}} for each COPY path
+
+    kwargs are passed to the table (such as conf_section)"""
+
+    rows = get_rows(num_rows)
+    results = {}
+    with CopyBenchTable(clear=True, **kwargs) as table:
+        # The TSV path can't write numpy arrays, so give it lists
+        tsv_rows = [{**x, "array_col": "{" + ",".join(
+                        str(y) for y in x["array_col"]) + "}"}
+                    for x in rows]
+
+        def tsv():
+            with file_funcs.temp_path(path_append=".tsv") as path:
+                file_funcs.write_dicts_to_tsv(tsv_rows, path)
+                num_bytes = os.path.getsize(path)
+                table.bulk_insert_tsv(path)
+            return num_bytes
+
+        for path, func in [("tsv", tsv),
+                           ("text_stream",
+                            lambda: table.bulk_insert_stream(rows)),
+                           ("binary", lambda: table.bulk_insert_binary(rows))]:
+            table.execute(f"TRUNCATE {table.name}")
+            start = time.perf_counter()
+            num_bytes = func()
+            seconds = time.perf_counter() - start
+            assert table.get_count() == num_rows
+            results[path] = {"rows_per_sec": num_rows / seconds,
+                             "seconds": seconds,
+                             "bytes": num_bytes}
+            logging.info(f"{path}: {results[path]}")
+        table.clear_table()
+    return results
+
+
+if __name__ == "__main__":
+    for path, result in benchmark_copy_formats().items():
+        print(f"{path:>12}: {result['rows_per_sec']:>12,.0f} rows/sec "
+              f"{result['bytes']:>14,} bytes")
@@ -0,0 +1,53 @@
+"""Compares per call latency of execute with and without prepared statements
+
+Run against a local database with:
+python3 -m lib_database.benchmarks.prepared_statements
+"""
+
+import logging
+import time
+
+from ..database import Database
+
+
+SETUP_SQL = """DROP TABLE IF EXISTS lib_database_prepared_bench;
+            CREATE TABLE lib_database_prepared_bench AS
+                SELECT x AS id, x %% 100 AS grp, md5(x::text) AS val
+                FROM generate_series(1, 10000) x;
+            CREATE INDEX ON lib_database_prepared_bench (id);
+            ANALYZE lib_database_prepared_bench;"""
+
+# A query shape that is cheap to run but not to plan
+QUERY = """SELECT a.id, a.val, b.val AS other_val, COUNT(*) OVER () AS count
+        FROM lib_database_prepared_bench a
+        JOIN lib_database_prepared_bench b ON b.id = a.id + 1
+        LEFT JOIN lib_database_prepared_bench c ON c.id = a.id + 2
+        WHERE a.id = %s AND a.grp = %s"""
+
+
+def benchmark_prepared_statements(num_calls: int = 10000, **kwargs) -> dict:
+    """Returns {mode: {usec_per_call, calls_per_sec}} for execute
+
+    kwargs are passed to Database (such as conf_section)"""
+
+    results = {}
+    with Database(**kwargs) as db:
+        db.execute(SETUP_SQL)
+    for mode, capacity in [("unprepared", 0), ("prepared", 256)]:
+        with Database(prepared_statements=capacity, **kwargs) as db:
+            start = time.perf_counter()
+            for i in range(num_calls):
+                db.execute(QUERY, [i % 10000, i % 100])
+            seconds = time.perf_counter() - start
+        results[mode] = {"usec_per_call": seconds / num_calls * 1e6,
+                         "calls_per_sec": num_calls / seconds}
+        logging.info(f"{mode}: {results[mode]}")
+    with Database(**kwargs) as db:
+        db.execute("DROP TABLE lib_database_prepared_bench")
+    return results
+
+
+if __name__ == "__main__":
+    for mode, result in benchmark_prepared_statements().items():
+        print(f"{mode:>10}: {result['usec_per_call']:>8.1f} usec/call "
+              f"{result['calls_per_sec']:>10,.0f} calls/sec")
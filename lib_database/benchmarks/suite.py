@@ -0,0 +1,312 @@
+"""Measures rows/sec and peak RSS of the ingest and query paths
+
+Runs every operation against tables of each column type and width,
+for each row count, and writes the results as JSON so that runs from
+different versions can be compared. Run against a local database with:
+python3 -m lib_database.benchmarks.suite --rows 1000 100000 --output a.json
+python3 -m lib_database.benchmarks.suite --compare a.json b.json
+
+Peak RSS is of this process only, sampled in a thread, so memory used
+by the postgres server is not included.
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import platform
+import sys
+from threading import Event, Thread
+import time
+
+import numpy as np
+import psutil
+
+from lib_utils import file_funcs
+
+from ..generic_table import GenericTable
+
+
+# Length of each numpy array in array columns
+ARRAY_LEN = 16
+
+
+def _ints(rng, n):
+    return [int(x) for x in rng.integers(0, 2 ** 40, n)]
+
+
+def _texts(rng, n):
+    return [f"value {x:032x}" for x in rng.integers(0, 2 ** 62, n)]
+
+
+def _timestamps(rng, n):
+    return [datetime(2020, 1, 1) + timedelta(seconds=int(x))
+            for x in rng.integers(0, 10 ** 8, n)]
+
+
+# {type: (sql type, func of (rng, num_rows) that returns a column)}
+COLUMN_TYPES = {
+    "int": ("BIGINT", _ints),
+    "float": ("DOUBLE PRECISION", lambda rng, n: rng.random(n).tolist()),
+    "text": ("TEXT", _texts),
+    "bool": ("BOOLEAN", lambda rng, n: (rng.random(n) > .5).tolist()),
+    "timestamp": ("TIMESTAMP", _timestamps),
+    "array": ("DOUBLE PRECISION[]",
+              lambda rng, n: list(rng.random((n, ARRAY_LEN)))),
+}
+
+
+class BenchTable(GenericTable):
+    """Table of width columns col_0... of one type from COLUMN_TYPES
+
+    mixed cycles through the types"""
+
+    name = "lib_database_bench"
+    id_col = None
+
+    def __init__(self, col_type: str, width: int, **kwargs):
+        types = list(COLUMN_TYPES) if col_type == "mixed" else [col_type]
+        self.bench_types = {f"col_{i}": types[i % len(types)]
+                            for i in range(width)}
+        super(BenchTable, self).__init__(**kwargs)
+
+    def create_table(self):
+        cols = ", ".join(f"{col} {COLUMN_TYPES[col_type][0]}"
+                         for col, col_type in self.bench_types.items())
+        self.execute(f"CREATE TABLE IF NOT EXISTS {self.name} ({cols});")
+
+    def get_rows(self, num_rows: int, seed: int = 0) -> list:
+        """Returns num_rows dicts of random data for the table"""
+
+        rng = np.random.default_rng(seed)
+        columns = {col: COLUMN_TYPES[col_type][1](rng, num_rows)
+                   for col, col_type in self.bench_types.items()}
+        return [dict(zip(columns, values))
+                for values in zip(*columns.values())]
+
+
+class PeakRSS:
+    """Samples the RSS of this process in a thread while in the with"""
+
+    def __init__(self, interval: float = .005):
+        self.interval = interval
+        self._process = psutil.Process()
+        self._stop = Event()
+        self.start_rss = self.peak_rss = 0
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = self._process.memory_info().rss
+        self._stop.clear()
+        self._thread = Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._stop.set()
+        self._thread.join()
+        self._update()
+
+    @property
+    def growth(self) -> int:
+        return self.peak_rss - self.start_rss
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._update()
+
+    def _update(self):
+        self.peak_rss = max(self.peak_rss, self._process.memory_info().rss)
+
+
+def _tsv_rows(rows: list) -> list:
+    """Returns rows with arrays as postgres literals, for TSV writers"""
+
+    return [{k: ("{" + ",".join(str(x) for x in v) + "}"
+                 if isinstance(v, np.ndarray) else v)
+             for k, v in row.items()}
+            for row in rows]
+
+
+def _insert(table, rows, path):
+    for row in rows:
+        # insert converts arrays in place, which other operations see
+        table.insert(dict(row))
+
+
+def _load(table, rows, path):
+    table.bulk_insert_stream(rows)
+    table.execute(f"ANALYZE {table.name}")
+
+
+def _write_tsv(table, rows, path):
+    file_funcs.write_dicts_to_tsv(_tsv_rows(rows), path)
+
+
+def _convert_arrays(table, rows, path):
+    return _tsv_rows(rows)
+
+
+# {operation: (untimed setup, timed func)}, both of (table, rows, path)
+# where path is a temporary .tsv path. If setup returns rows, func is
+# given those instead, so converting them isn't timed
+OPERATIONS = {
+    "insert": (None, _insert),
+    "bulk_insert": (_convert_arrays,
+                    lambda t, rows, path: t.bulk_insert(rows)),
+    "bulk_insert_tsv": (_write_tsv,
+                        lambda t, rows, path: t.bulk_insert_tsv(path)),
+    "bulk_insert_stream": (None, lambda t, rows, path: t.bulk_insert_stream(
+        rows)),
+    "bulk_insert_binary": (None, lambda t, rows, path: t.bulk_insert_binary(
+        rows)),
+    "get_all": (_load, lambda t, rows, path: t.get_all()),
+    "get_count": (_load, lambda t, rows, path: t.get_count()),
+    "copy_to_tsv": (_load, lambda t, rows, path: t.copy_to_tsv(path)),
+}
+
+
+def run_benchmarks(row_counts: list = [1000, 100000],
+                   col_types: list = list(COLUMN_TYPES) + ["mixed"],
+                   widths: list = [4, 32],
+                   operations: list = list(OPERATIONS),
+                   max_insert_rows: int = 10000,
+                   **kwargs) -> dict:
+    """Returns {"meta": {...}, "results": [{...}]} for every combination
+
+    insert runs on at most max_insert_rows rows, since it makes one
+    round trip per row. kwargs are passed to the table (conf_section)
+    """
+
+    meta = None
+    results = []
+    for col_type in col_types:
+        for width in widths:
+            with BenchTable(col_type, width, clear=True, **kwargs) as table:
+                meta = _meta(table)
+                for num_rows in row_counts:
+                    rows = table.get_rows(num_rows)
+                    for operation in operations:
+                        op_rows = (rows[:max_insert_rows]
+                                   if operation == "insert" else rows)
+                        results.append(_run_one(table,
+                                                operation,
+                                                op_rows,
+                                                col_type,
+                                                width))
+                    del rows
+                table.clear_table()
+    return {"meta": meta, "results": results}
+
+
+def _run_one(table, operation: str, rows: list, col_type: str, width: int):
+    """Times one operation and returns its result dict"""
+
+    setup, func = OPERATIONS[operation]
+    table.execute(f"TRUNCATE {table.name}")
+    with file_funcs.temp_path(path_append=".tsv") as path:
+        func_rows = setup(table, rows, path) if setup else None
+        if func_rows is None:
+            func_rows = rows
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            func(table, func_rows, path)
+            seconds = time.perf_counter() - start
+
+    result = {"operation": operation,
+              "type": col_type,
+              "width": width,
+              "rows": len(rows),
+              "seconds": seconds,
+              "rows_per_sec": len(rows) / seconds if seconds else 0.0,
+              "peak_rss_bytes": rss.peak_rss,
+              "rss_growth_bytes": rss.growth}
+    logging.info(result)
+    return result
+
+
+def _meta(table) -> dict:
+    """Returns what the results depend on, to compare runs by"""
+
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+        lib_version = version("lib_database")
+    except (ImportError, PackageNotFoundError):
+        lib_version = None
+    server = table.execute("SHOW server_version")[0]["server_version"]
+    return {"lib_database": lib_version,
+            "postgres": server,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "ram_bytes": psutil.virtual_memory().total,
+            "time": datetime.now().isoformat()}
+
+
+def compare_results(old: dict, new: dict) -> list:
+    """Returns the ratio of new/old rows per sec for shared benchmarks
+
+    A ratio below 1 is a regression"""
+
+    def key(result):
+        return tuple(result[x] for x in ("operation", "type", "width", "rows"))
+
+    old_results = {key(x): x for x in old["results"]}
+    comparison = []
+    for result in new["results"]:
+        old_result = old_results.get(key(result))
+        if old_result and old_result["rows_per_sec"]:
+            comparison.append({
+                **dict(zip(("operation", "type", "width", "rows"),
+                           key(result))),
+                "old_rows_per_sec": old_result["rows_per_sec"],
+                "new_rows_per_sec": result["rows_per_sec"],
+                "ratio": result["rows_per_sec"] / old_result["rows_per_sec"]})
+    return comparison
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", nargs="+", type=int, default=[1000, 100000])
+    parser.add_argument("--types",
+                        nargs="+",
+                        default=list(COLUMN_TYPES) + ["mixed"],
+                        choices=list(COLUMN_TYPES) + ["mixed"])
+    parser.add_argument("--widths", nargs="+", type=int, default=[4, 32])
+    parser.add_argument("--operations",
+                        nargs="+",
+                        default=list(OPERATIONS),
+                        choices=list(OPERATIONS))
+    parser.add_argument("--max-insert-rows", type=int, default=10000)
+    parser.add_argument("--conf-section", default=None)
+    parser.add_argument("--output", help="JSON path, else stdout")
+    parser.add_argument("--compare",
+                        nargs=2,
+                        metavar=("OLD", "NEW"),
+                        help="Compare two JSON results instead of running")
+    args = parser.parse_args(args)
+
+    if args.compare:
+        with open(args.compare[0]) as old, open(args.compare[1]) as new:
+            comparison = compare_results(json.load(old), json.load(new))
+        for x in comparison:
+            print(f"{x['operation']:>18} {x['type']:>9} {x['width']:>4} cols "
+                  f"{x['rows']:>10,} rows: {x['ratio']:>6.2f}x")
+        return
+
+    kwargs = {"conf_section": args.conf_section} if args.conf_section else {}
+    results = run_benchmarks(row_counts=args.rows,
+                             col_types=args.types,
+                             widths=args.widths,
+                             operations=args.operations,
+                             max_insert_rows=args.max_insert_rows,
+                             **kwargs)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    else:
+        json.dump(results, sys.stdout, indent=4)
+
+
+if __name__ == "__main__":
+    main()
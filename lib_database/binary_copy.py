@@ -0,0 +1,586 @@
+import json
+import struct
+from datetime import date, datetime, timezone
+
+import numpy as np
+
+
+# https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+TRAILER = struct.pack(">h", -1)
+NULL_FIELD = struct.pack(">i", -1)
+
+_PG_EPOCH_DATE = date(2000, 1, 1)
+_PG_EPOCH = datetime(2000, 1, 1)
+_PG_EPOCH_TZ = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+_int16 = struct.Struct(">h")
+_int32 = struct.Struct(">i")
+
+# udt_name: (oid, struct format or None if variable width, numpy dtype)
+TYPES = {"bool": (16, "?", ">?"),
+         "bytea": (17, None, None),
+         "int8": (20, "q", ">i8"),
+         "int2": (21, "h", ">i2"),
+         "int4": (23, "i", ">i4"),
+         "text": (25, None, None),
+         "json": (114, None, None),
+         "float4": (700, "f", ">f4"),
+         "float8": (701, "d", ">f8"),
+         "bpchar": (1042, None, None),
+         "varchar": (1043, None, None),
+         "date": (1082, "i", None),
+         "timestamp": (1114, "q", None),
+         "timestamptz": (1184, "q", None),
+         "jsonb": (3802, None, None)}
+
+
+class BinaryCopyEncoder:
+    """Encodes rows into PostgreSQL's binary COPY format
+
+    The encoders for each column are built once from the column's
+    udt_name (as found in information_schema.columns), so per row work
+    is just struct packing. Array columns (udt_names starting with _)
+    of numeric types are packed straight from numpy arrays.
+    """
+
+    __slots__ = ["columns", "udt_names", "_encoders", "_count"]
+
+    def __init__(self, columns: list, udt_names: list):
+        assert len(columns) == len(udt_names), "Need a type for every col"
+        self.columns = list(columns)
+        self.udt_names = list(udt_names)
+        self._encoders = [field_encoder(x) for x in self.udt_names]
+        self._count = _int16.pack(len(self.columns))
+
+    def encode_row(self, row) -> bytes:
+        """Encodes a dict (missing keys are NULL) or ordered sequence"""
+
+        if isinstance(row, dict):
+            row = [row.get(col) for col in self.columns]
+        return self._count + b"".join(
+            [NULL_FIELD if val is None else encode(val)
+             for encode, val in zip(self._encoders, row)])
+
+    def encode_rows(self, rows, batch_size: int = 1000):
+        """Yields bytes chunks for a full COPY, header and trailer included
+
+        batch_size rows are joined per chunk to keep memory bounded"""
+
+        yield HEADER
+        encode_row = self.encode_row
+        batch = []
+        for row in rows:
+            batch.append(encode_row(row))
+            if len(batch) >= batch_size:
+                yield b"".join(batch)
+                batch = []
+        if batch:
+            yield b"".join(batch)
+        yield TRAILER
+
+
+def field_encoder(udt_name: str):
+    """Returns a func that turns a non NULL value into a binary field"""
+
+    if udt_name.startswith("_"):
+        return _array_encoder(udt_name[1:])
+    assert udt_name in TYPES, f"No binary COPY support for {udt_name}"
+    _, fmt, _ = TYPES[udt_name]
+
+    if udt_name == "date":
+        packer = struct.Struct(">ii")
+
+        def encode_date(x):
+            if isinstance(x, np.datetime64):
+                x = x.astype("datetime64[D]").item()
+            elif isinstance(x, datetime):
+                x = x.date()
+            return packer.pack(4, (x - _PG_EPOCH_DATE).days)
+        return encode_date
+    elif udt_name in ("timestamp", "timestamptz"):
+        packer = struct.Struct(">iq")
+        epoch = _PG_EPOCH_TZ if udt_name == "timestamptz" else _PG_EPOCH
+
+        def encode_timestamp(x):
+            if isinstance(x, np.datetime64):
+                x = x.astype("datetime64[us]").item()
+            if udt_name == "timestamptz" and x.tzinfo is None:
+                x = x.replace(tzinfo=timezone.utc)
+            elif udt_name == "timestamp" and x.tzinfo is not None:
+                # As postgres does, the time zone of a timestamp is ignored
+                x = x.replace(tzinfo=None)
+            delta = x - epoch
+            micros = ((delta.days * 86400 + delta.seconds) * 1000000
+                      + delta.microseconds)
+            return packer.pack(8, micros)
+        return encode_timestamp
+    elif udt_name == "bool":
+        packer = struct.Struct(">i?")
+
+        def encode_bool(x):
+            # Anything else, such as "false", would be packed as truthy
+            assert isinstance(x, (bool, np.bool_)) or (
+                isinstance(x, (int, np.integer)) and x in (0, 1)), (
+                f"{x!r} is not a bool")
+            return packer.pack(1, x)
+        return encode_bool
+    elif fmt:
+        packer = struct.Struct(">i" + fmt)
+        size = packer.size - 4
+        return lambda x: packer.pack(size, x)
+    elif udt_name == "bytea":
+        return lambda x: _int32.pack(len(x)) + bytes(x)
+    elif udt_name in ("json", "jsonb"):
+        # jsonb's binary format is a version byte followed by the text
+        prefix = b"\x01" if udt_name == "jsonb" else b""
+
+        def encode_json(x):
+            data = prefix + (x if isinstance(x, str)
+                             else json.dumps(x)).encode()
+            return _int32.pack(len(data)) + data
+        return encode_json
+    else:
+        def encode_text(x):
+            # str would write b'...' rather than the bytes
+            assert not isinstance(x, (bytes, bytearray, memoryview)), (
+                f"Can't write bytes into {udt_name}, decode them first")
+            data = str(x).encode()
+            return _int32.pack(len(data)) + data
+        return encode_text
+
+
+def _array_encoder(elem_udt_name: str):
+    """Returns a func that encodes a sequence or ndarray as an array field
+
+    Numpy arrays and nested lists keep their shape, and their values
+    must be of the element type's kinds (see _COLUMN_KINDS). Lists
+    with NULLs must be 1-D"""
+
+    assert elem_udt_name in TYPES, f"No binary COPY for _{elem_udt_name}"
+    oid, _, np_dtype = TYPES[elem_udt_name]
+    elem_encoder = field_encoder(elem_udt_name)
+
+    if np_dtype:
+        # Each element is its length followed by its value
+        dtype = np.dtype([("len", ">i4"), ("val", np_dtype)])
+        elem_size = dtype["val"].itemsize
+        kinds = _COLUMN_KINDS[elem_udt_name].replace("O", "")
+        # Wider ints would silently wrap when packed into int2 or int4
+        info = (np.iinfo(np_dtype) if elem_udt_name in ("int2", "int4")
+                else None)
+
+    def encode_array(vals):
+        if (np_dtype and not isinstance(vals, np.ndarray)
+                and not any(x is None for x in vals)):
+            # So nested lists keep their real dimensions
+            vals = np.asarray(vals)
+        shape = vals.shape if isinstance(vals, np.ndarray) else (len(vals),)
+        if 0 in shape:
+            body = struct.pack(">iii", 0, 0, oid)
+            return _int32.pack(len(body)) + body
+        # ndim, has nulls, element oid, then size and lower bound per dim
+        dims = b"".join([struct.pack(">ii", size, 1) for size in shape])
+        if np_dtype and isinstance(vals, np.ndarray):
+            assert vals.dtype.kind in kinds, (
+                f"Can't pack {vals.dtype} values into _{elem_udt_name}")
+            if info is not None and vals.dtype.kind in "iu":
+                assert info.min <= vals.min() and vals.max() <= info.max, (
+                    f"Values out of range for _{elem_udt_name}")
+            packed = np.empty(int(np.prod(shape)), dtype=dtype)
+            packed["len"] = elem_size
+            packed["val"] = np.ravel(vals)
+            body = (struct.pack(">iii", len(shape), 0, oid) + dims
+                    + packed.tobytes())
+        else:
+            assert not any(isinstance(x, (list, tuple, np.ndarray))
+                           for x in vals), "Arrays with NULLs must be 1-D"
+            has_null = int(any(x is None for x in vals))
+            body = struct.pack(">iii", 1, has_null, oid) + dims + b"".join(
+                [NULL_FIELD if x is None else elem_encoder(x) for x in vals])
+        return _int32.pack(len(body)) + body
+    return encode_array
+
+
+# udt_name: numpy dtype kinds that can be packed into it
+_COLUMN_KINDS = {"bool": "b",
+                 "int2": "biu",
+                 "int4": "biu",
+                 "int8": "biu",
+                 "float4": "biuf",
+                 "float8": "biuf",
+                 "date": "MO",
+                 "timestamp": "MO",
+                 "timestamptz": "MO",
+                 "text": "UO",
+                 "varchar": "UO",
+                 "bpchar": "UO",
+                 "bytea": "SO"}
+# Python types an object array can hold for variable width columns
+_OBJECT_TYPES = {"text": str,
+                 "varchar": str,
+                 "bpchar": str,
+                 "bytea": (bytes, bytearray, memoryview)}
+# Microseconds and days from the unix epoch to the postgres epoch
+_PG_EPOCH_MICROS = 946684800000000
+_PG_EPOCH_DAYS = 10957
+
+
+def validate_columns(columns: dict, udt_names: dict) -> int:
+    """Asserts that columns of arrays can go into a table. Returns length
+
+    udt_names is {column: udt_name}, such as GenericTable.column_types"""
+
+    assert columns, "No columns to insert"
+    lengths = {len(x) for x in columns.values()}
+    assert len(lengths) == 1, f"Columns have different lengths: {lengths}"
+    for col, vals in columns.items():
+        assert col in udt_names, f"{col} is not a column of the table"
+        udt_name = udt_names[col]
+        # So unsupported types fail here, not once COPY has started
+        assert udt_name.lstrip("_") in TYPES, (
+            f"No binary COPY support for {col} of type {udt_name}")
+        kinds = _COLUMN_KINDS.get(udt_name)
+        arr = np.asarray(vals) if not isinstance(vals, np.ndarray) else vals
+        if udt_name.startswith("_"):
+            # A 2-D array means one row per array, otherwise objects
+            assert arr.ndim == 2 or arr.dtype.kind == "O", (
+                f"{col} is an array column and needs a 2-D or object array")
+        elif kinds:
+            assert arr.dtype.kind in kinds, (
+                f"{col} has dtype {arr.dtype}, not valid for {udt_name}")
+            if arr.dtype.kind == "O" and udt_name in _OBJECT_TYPES:
+                values = (arr.compressed() if np.ma.isMaskedArray(arr)
+                          else arr.ravel())
+                assert all(isinstance(x, _OBJECT_TYPES[udt_name])
+                           for x in values if x is not None), (
+                    f"{col} has values that aren't valid for {udt_name}")
+            is_int = udt_name.startswith("int")
+            if is_int and arr.dtype.kind in "iu" and len(arr):
+                info = np.iinfo(TYPES[udt_name][2])
+                assert info.min <= arr.min() and arr.max() <= info.max, (
+                    f"{col} has values out of range for {udt_name}")
+        else:
+            assert arr.dtype.kind in "USO", (
+                f"{col} has dtype {arr.dtype}, not valid for {udt_name}")
+    return lengths.pop()
+
+
+def encode_columns(columns: dict, udt_names: dict, chunk_rows=65536):
+    """Returns a generator of bytes chunks for a binary COPY of columns
+
+    The columns are validated right away (rather than once COPY has
+    started). When every column is a fixed width numpy type without a
+    mask, each chunk is packed column at a time into one structured
+    array, so no python objects are created per row. Otherwise rows are
+    zipped from the columns and packed by BinaryCopyEncoder.
+    """
+
+    num_rows = validate_columns(columns, udt_names)
+    return _encode_columns(columns, udt_names, num_rows, chunk_rows)
+
+
+def _encode_columns(columns: dict, udt_names: dict, num_rows, chunk_rows):
+    """Yields the bytes chunks for encode_columns"""
+
+    names = list(columns)
+    arrays = [columns[x] if isinstance(columns[x], np.ndarray)
+              else np.asarray(columns[x]) for x in names]
+
+    if all(_is_fixed_width(arr, udt_names[name])
+           for name, arr in zip(names, arrays)):
+        yield HEADER
+        dtype = np.dtype([("count", ">i2")] + [
+            field for i, name in enumerate(names)
+            for field in ((f"len{i}", ">i4"),
+                          (f"val{i}", _np_dtype(udt_names[name])))])
+        for start in range(0, num_rows, chunk_rows):
+            stop = min(start + chunk_rows, num_rows)
+            packed = np.empty(stop - start, dtype=dtype)
+            packed["count"] = len(names)
+            for i, (name, arr) in enumerate(zip(names, arrays)):
+                packed[f"len{i}"] = dtype[f"val{i}"].itemsize
+                packed[f"val{i}"] = _to_wire(arr[start:stop],
+                                             udt_names[name])
+            yield packed.tobytes()
+        yield TRAILER
+    else:
+        encoder = BinaryCopyEncoder(names, [udt_names[x] for x in names])
+        # tolist turns datetime64[ns] into ints, but [us] into datetimes
+        arrays = [_to_python_units(arr, udt_names[name])
+                  for name, arr in zip(names, arrays)]
+        for start in range(0, num_rows, chunk_rows):
+            # 2-D arrays stay as ndarrays (one per row) for array columns
+            chunk = [list(arr[start:start + chunk_rows]) if arr.ndim > 1
+                     # tolist turns masked values into None
+                     else arr[start:start + chunk_rows].tolist()
+                     for arr in arrays]
+            data = b"".join([encoder.encode_row(row) for row in zip(*chunk)])
+            yield HEADER + data if start == 0 else data
+        yield HEADER + TRAILER if num_rows == 0 else TRAILER
+
+
+def _is_fixed_width(arr, udt_name: str) -> bool:
+    """Returns True if the column can be packed without python objects"""
+
+    return (not np.ma.isMaskedArray(arr)
+            and arr.ndim == 1
+            and udt_name in _COLUMN_KINDS
+            and TYPES[udt_name][1] is not None
+            and arr.dtype.kind in _COLUMN_KINDS[udt_name].replace("O", ""))
+
+
+def _to_python_units(arr, udt_name: str):
+    """Casts datetime64 arrays to units that tolist makes dates of"""
+
+    if arr.dtype.kind != "M":
+        return arr
+    return arr.astype("datetime64[D]" if udt_name == "date"
+                      else "datetime64[us]")
+
+
+def _np_dtype(udt_name: str) -> str:
+    """Returns the big endian numpy dtype of a fixed width column"""
+
+    if udt_name == "date":
+        return ">i4"
+    elif udt_name in ("timestamp", "timestamptz"):
+        return ">i8"
+    else:
+        return TYPES[udt_name][2]
+
+
+def _to_wire(arr, udt_name: str):
+    """Converts datetime64 arrays to postgres epoch offsets"""
+
+    if udt_name == "date":
+        return arr.astype("datetime64[D]").astype(np.int64) - _PG_EPOCH_DAYS
+    elif udt_name in ("timestamp", "timestamptz"):
+        micros = arr.astype("datetime64[us]").astype(np.int64)
+        return micros - _PG_EPOCH_MICROS
+    else:
+        return arr
+
+
+# Decoding COPY TO STDOUT WITH (FORMAT binary)
+
+# oid: (struct format, numpy dtype on the wire) of fixed width types
+_FIXED_OIDS = {16: ("?", ">?"),    # bool
+               20: ("q", ">i8"),   # int8
+               21: ("h", ">i2"),   # int2
+               23: ("i", ">i4"),   # int4
+               26: ("I", ">u4"),   # oid
+               700: ("f", ">f4"),  # float4
+               701: ("d", ">f8"),  # float8
+               1082: ("i", ">i4"),  # date, days from 2000-01-01
+               1114: ("q", ">i8"),  # timestamp, micros from 2000-01-01
+               1184: ("q", ">i8")}  # timestamptz, in UTC
+# name, text, bpchar and varchar are decoded as str
+_TEXT_OIDS = {19, 25, 1042, 1043}
+_BYTEA_OID = 17
+_int16_at = struct.Struct(">h").unpack_from
+_int32_at = struct.Struct(">i").unpack_from
+
+
+class BinaryCopyDecoder:
+    """Decodes a binary COPY TO STDOUT into numpy arrays per column
+
+    Pass it as the file to cursor.copy_expert, then call finish.
+    Data is buffered and decoded chunk_bytes at a time into arrays that
+    grow by doubling. Fixed width columns (see _FIXED_OIDS) are numpy
+    typed, and masked arrays if there are NULLs. Text and bytea columns
+    are object arrays, with None for NULLs.
+
+    When every column is fixed width, every row without NULLs has the
+    same size, so runs of them are read as one structured array view.
+    Rows with NULLs are decoded one at a time.
+    """
+
+    def __init__(self, names: list, oids: list, chunk_bytes: int = 2 ** 20):
+        assert self.can_decode(oids), "Not every type can be decoded"
+        self.names = list(names)
+        self.oids = list(oids)
+        self.chunk_bytes = chunk_bytes
+        self.num_rows = 0
+        self._pending = bytearray()
+        self._header_done = False
+        self._finished = False
+        self._capacity = 1024
+        self._values = []
+        self._masks = [None] * len(oids)
+        self._unpackers = []
+        for oid in self.oids:
+            if oid in _FIXED_OIDS:
+                fmt, wire_dtype = _FIXED_OIDS[oid]
+                native = np.dtype(wire_dtype).newbyteorder("=")
+                self._values.append(np.zeros(self._capacity, dtype=native))
+                self._unpackers.append(struct.Struct(">" + fmt).unpack_from)
+            else:
+                self._values.append([])
+                self._unpackers.append(None)
+        if all(oid in _FIXED_OIDS for oid in self.oids):
+            self._row_dtype = np.dtype([("count", ">i2")] + [
+                field for i, oid in enumerate(self.oids)
+                for field in ((f"len{i}", ">i4"),
+                              (f"val{i}", _FIXED_OIDS[oid][1]))])
+        else:
+            self._row_dtype = None
+
+    @staticmethod
+    def can_decode(oids) -> bool:
+        return all(oid in _FIXED_OIDS or oid in _TEXT_OIDS
+                   or oid == _BYTEA_OID for oid in oids)
+
+    def write(self, data):
+        self._pending += data
+        if len(self._pending) >= self.chunk_bytes:
+            self._decode()
+
+    def finish(self) -> dict:
+        """Decodes what is left. Returns {column: array}"""
+
+        self._decode()
+        assert self._finished, "COPY data ended before its trailer"
+        columns = dict()
+        for i, (name, oid) in enumerate(zip(self.names, self.oids)):
+            values = self._values[i]
+            if oid in _FIXED_OIDS:
+                values = _from_wire(values[:self.num_rows], oid)
+                if self._masks[i] is not None:
+                    values = np.ma.masked_array(
+                        values, mask=self._masks[i][:self.num_rows])
+            else:
+                array = np.empty(len(values), dtype=object)
+                for j, value in enumerate(values):
+                    array[j] = value
+                values = array
+            columns[name] = values
+        return columns
+
+    def _decode(self):
+        """Decodes every whole row in the buffer"""
+
+        data = bytes(self._pending)
+        pos = 0
+        if not self._header_done:
+            # Signature, flags, then the length of the header extension
+            if len(data) < 19:
+                return
+            assert data[:11] == HEADER[:11], "Not binary COPY data"
+            pos = 19 + _int32_at(data, 15)[0]
+            self._header_done = True
+
+        run = 16
+        while not self._finished:
+            if self._row_dtype is not None:
+                num_rows = self._decode_run(data, pos, run)
+                pos += num_rows * self._row_dtype.itemsize
+                # Grow the run while rows keep having no NULLs
+                run = run * 2 if num_rows == run else 16
+                if num_rows:
+                    continue
+            end = self._decode_row(data, pos)
+            if end is None:
+                break
+            pos = end
+        self._pending = bytearray(data[pos:])
+
+    def _decode_run(self, data, pos, max_rows) -> int:
+        """Decodes up to max_rows rows without NULLs as one view
+
+        Returns the number of rows decoded"""
+
+        dtype = self._row_dtype
+        num_rows = min((len(data) - pos) // dtype.itemsize, max_rows)
+        if num_rows <= 0:
+            return 0
+        view = np.frombuffer(data, dtype=dtype, count=num_rows, offset=pos)
+        # Rows stop lining up at the first NULL (or the trailer)
+        ok = view["count"] == len(self.oids)
+        for i in range(len(self.oids)):
+            ok &= view[f"len{i}"] == dtype[f"val{i}"].itemsize
+        num_rows = num_rows if ok.all() else int(np.argmin(ok))
+        if num_rows:
+            self._reserve(num_rows)
+            start = self.num_rows
+            for i, values in enumerate(self._values):
+                values[start:start + num_rows] = view[f"val{i}"][:num_rows]
+            self.num_rows += num_rows
+        return num_rows
+
+    def _decode_row(self, data, pos):
+        """Decodes the row at pos. Returns where it ends, or None if the
+        row isn't all in the buffer yet"""
+
+        if len(data) - pos < 2:
+            return None
+        count = _int16_at(data, pos)[0]
+        if count == -1:
+            self._finished = True
+            return pos + 2
+        assert count == len(self.oids), "Row has the wrong number of fields"
+
+        fields = []
+        end = pos + 2
+        for _ in range(count):
+            if len(data) - end < 4:
+                return None
+            size = _int32_at(data, end)[0]
+            end += 4
+            if size == -1:
+                fields.append(None)
+                continue
+            if len(data) - end < size:
+                return None
+            fields.append((end, size))
+            end += size
+
+        self._reserve(1)
+        row = self.num_rows
+        for i, field in enumerate(fields):
+            oid = self.oids[i]
+            if oid in _FIXED_OIDS:
+                if field is None:
+                    if self._masks[i] is None:
+                        self._masks[i] = np.zeros(self._capacity, dtype=bool)
+                    self._masks[i][row] = True
+                else:
+                    self._values[i][row] = self._unpackers[i](data,
+                                                              field[0])[0]
+            elif field is None:
+                self._values[i].append(None)
+            else:
+                value = data[field[0]:field[0] + field[1]]
+                self._values[i].append(value if oid == _BYTEA_OID
+                                       else value.decode())
+        self.num_rows += 1
+        return end
+
+    def _reserve(self, num_rows: int):
+        """Grows the fixed width arrays (by doubling) to fit num_rows more"""
+
+        needed = self.num_rows + num_rows
+        if needed <= self._capacity:
+            return
+        while self._capacity < needed:
+            self._capacity *= 2
+        for i, values in enumerate(self._values):
+            if isinstance(values, np.ndarray):
+                self._values[i] = np.resize(values, self._capacity)
+                self._values[i][self.num_rows:] = 0
+            if self._masks[i] is not None:
+                mask = np.zeros(self._capacity, dtype=bool)
+                mask[:self.num_rows] = self._masks[i][:self.num_rows]
+                self._masks[i] = mask
+
+
+def _from_wire(values, oid: int):
+    """Converts date and timestamp epoch offsets to datetime64"""
+
+    if oid == 1082:
+        return (values.astype(np.int64) + _PG_EPOCH_DAYS).astype(
+            "datetime64[D]")
+    elif oid in (1114, 1184):
+        return (values + _PG_EPOCH_MICROS).astype("datetime64[us]")
+    else:
+        return values
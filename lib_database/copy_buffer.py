@@ -0,0 +1,235 @@
+import gzip
+import json
+import queue
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from itertools import chain
+from threading import Event
+
+
+# Characters that must be escaped in PostgreSQL's text COPY format
+# https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.2
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\",
+                               "\n": "\\n",
+                               "\r": "\\r",
+                               "\t": "\\t"})
+
+NULL = "\\N"
+
+
+class CopyBuffer:
+    """File-like adapter that feeds an iterator of bytes to COPY
+
+    psycopg2's copy_expert only ever calls read(size) on the file it is
+    given, so only a single encoded chunk is held in memory at a time.
+    This lets any generator of rows be streamed to the server without
+    ever touching the filesystem.
+    """
+
+    __slots__ = ["_chunks", "_buf", "_pos", "bytes_read"]
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b""
+        # Where the unread bytes of _buf start, so reads don't copy the rest
+        self._pos = 0
+        # Useful for benchmarks and progress reporting
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        """Returns up to size bytes, b'' once the iterator is exhausted"""
+
+        if size is None or size < 0:
+            data = self._buf[self._pos:] + b"".join(self._chunks)
+            self._buf, self._pos = b"", 0
+        else:
+            while len(self._buf) - self._pos < size and self._fill():
+                pass
+            data = self._buf[self._pos:self._pos + size]
+            self._pos += len(data)
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self, size: int = -1) -> bytes:
+        """Returns the next line. copy_from sometimes uses this"""
+
+        while self._buf.find(b"\n", self._pos) == -1 and self._fill():
+            pass
+        end = self._buf.find(b"\n", self._pos) + 1 or len(self._buf)
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        data = self._buf[self._pos:end]
+        self._pos = end
+        self.bytes_read += len(data)
+        return data
+
+    def _fill(self) -> bool:
+        """Appends the next chunk, dropping read bytes. False at the end"""
+
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+
+class QueueWriter:
+    """File-like adapter that hands what COPY TO writes to a consumer
+
+    copy_expert runs in another thread and calls write, which blocks
+    once maxsize chunks are waiting. done puts a None on the queue for
+    the consumer. After stop is called, writes are discarded so that
+    the thread can finish.
+    """
+
+    __slots__ = ["chunks", "stopped"]
+
+    def __init__(self, maxsize: int = 16):
+        self.chunks = queue.Queue(maxsize)
+        self.stopped = Event()
+
+    def write(self, data) -> int:
+        # Compressors sometimes write nothing
+        if len(data):
+            self._put(bytes(data))
+        return len(data)
+
+    def done(self):
+        self._put(None)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=.1)
+                break
+            except queue.Full:
+                continue
+
+    def stop(self):
+        """Discards further writes and anything that is waiting"""
+
+        self.stopped.set()
+        while True:
+            try:
+                self.chunks.get_nowait()
+            except queue.Empty:
+                break
+
+
+@contextmanager
+def compressed(f, compression: str = None):
+    """Yields a writer that compresses into file object f
+
+    compression can be None, gzip, or zstd (needs zstandard installed)"""
+
+    if compression is None:
+        yield f
+    elif compression == "gzip":
+        with gzip.GzipFile(fileobj=f, mode="wb") as writer:
+            yield writer
+    elif compression == "zstd":
+        # Optional dependency, only needed for zstd
+        import zstandard
+        compressor = zstandard.ZstdCompressor()
+        with compressor.stream_writer(f, closefd=False) as writer:
+            yield writer
+    else:
+        raise ValueError(f"No compression named {compression}")
+
+
+def peek_columns(rows, columns=None):
+    """Returns (rows, columns), getting columns from the first dict
+
+    rows may be a generator, so the first row is put back in front"""
+
+    rows = iter(rows)
+    if columns is not None:
+        return rows, list(columns)
+    try:
+        first = next(rows)
+    except StopIteration:
+        return iter([]), []
+    assert isinstance(first, dict), "Columns are required for non dict rows"
+    return chain([first], rows), list(first.keys())
+
+
+def encode_text_rows(rows, columns: list, batch_size: int = 1000):
+    """Yields bytes chunks of rows in PostgreSQL's text COPY format
+
+    Rows can be dicts (missing keys are NULL) or sequences that are
+    already ordered like columns. batch_size rows are joined per chunk
+    so that memory stays bounded no matter how many rows there are.
+    """
+
+    lines = []
+    for row in rows:
+        if isinstance(row, dict):
+            row = [row.get(col) for col in columns]
+        lines.append("\t".join([text_value(x) for x in row]))
+        if len(lines) >= batch_size:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def text_value(val) -> str:
+    """Converts a python value into a text COPY field"""
+
+    if val is None:
+        return NULL
+    # bool must come before int since bool is a subclass of int
+    elif isinstance(val, bool):
+        return "t" if val else "f"
+    elif isinstance(val, (int, float)):
+        return str(val)
+    elif isinstance(val, str):
+        return val.translate(_TEXT_ESCAPES)
+    else:
+        return _other_value(val).translate(_TEXT_ESCAPES)
+
+
+def _other_value(val) -> str:
+    """Converts less common types into their postgres text format"""
+
+    # numpy is not imported here so this module stays dependency free
+    if hasattr(val, "tolist"):
+        val = val.tolist()
+    if isinstance(val, bool):
+        return "t" if val else "f"
+    elif isinstance(val, (list, tuple)):
+        return _array_literal(val)
+    elif isinstance(val, dict):
+        return json.dumps(val)
+    elif isinstance(val, (bytes, bytearray, memoryview)):
+        return "\\x" + bytes(val).hex()
+    elif isinstance(val, (datetime, date, time)):
+        return val.isoformat()
+    elif isinstance(val, timedelta):
+        return f"{val.total_seconds()} seconds"
+    else:
+        return str(val)
+
+
+def _array_literal(vals) -> str:
+    """Converts a (possibly nested) list into a postgres array literal"""
+
+    elements = []
+    for val in vals:
+        if hasattr(val, "tolist"):
+            val = val.tolist()
+        if val is None:
+            elements.append("NULL")
+        elif isinstance(val, (list, tuple)):
+            elements.append(_array_literal(val))
+        elif isinstance(val, bool):
+            elements.append("t" if val else "f")
+        elif isinstance(val, (int, float)):
+            elements.append(str(val))
+        else:
+            val = val if isinstance(val, str) else _other_value(val)
+            val = val.replace("\\", "\\\\").replace('"', '\\"')
+            elements.append(f'"{val}"')
+    return "{" + ",".join(elements) + "}"
@@ -1,21 +1,80 @@
+from contextlib import contextmanager
+from itertools import count
 import logging
+from weakref import WeakSet
+
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
 from psycopg2.extras import RealDictCursor
 
 from lib_utils.helper_funcs import retry
 
-from .postgres import Postgres, DEFAULT_CONF_SECTION
+from .instrumentation import Instrumentation
+from .pool import get_pool
+from .postgres import Postgres
+from .result_cache import get_result_cache, invalidate_results
+from .result_cache import invalidate_results_for_sql
+from .rows import TupleCursor, to_columns
+from .schema_cache import invalidate_for_sql
+from .statement_cache import StatementCache
+
+
+_cursor_ids = count()
+_savepoint_ids = count()
 
 
 class Database(Postgres):
     """Interact with the database. See README for further details"""
 
+    # Batches of statements
+    from .batch import execute_batch
+
     def __init__(self,
-                 conf_section=DEFAULT_CONF_SECTION,
-                 cursor_factory=RealDictCursor):
-        """Create a new connection with the database"""
+                 conf_section=None,
+                 cursor_factory=RealDictCursor,
+                 pooled=False,
+                 prepared_statements=0,
+                 instrumentation=None,
+                 result_cache=None):
+        """Create a new connection with the database
+
+        conf_section defaults to Postgres.default_conf_section, looked
+        up now rather than at import, so it can be pointed elsewhere
+        (such as at a clone_database in tests).
+
+        cursor_factory is how rows are returned. The default is dicts.
+        RowCursor returns compact Rows, that can be read by index or
+        name, and psycopg2.extensions.cursor returns plain tuples.
 
-        self._connect(conf_section, cursor_factory)
+        If pooled, the connection is borrowed from the process wide pool
+        for the conf_section and returned to it on close.
+
+        If prepared_statements, up to that many statements run through
+        execute are kept PREPAREd on the server. See StatementCache
+
+        instrumentation can be an Instrumentation (to share one) or True
+        for a new one. It times every execute, see Instrumentation
+
+        result_cache can be a ResultCache, or True for the process wide
+        one. SELECT results are then cached, see ResultCache"""
+
+        # Open execute_iter generators, so close can clean them up
+        self._iterators = WeakSet()
+        self._num_open_iterators = 0
+        self._iterator_transaction = False
+        self.statement_cache = (StatementCache(prepared_statements)
+                                if prepared_statements else None)
+        if instrumentation is True:
+            instrumentation = Instrumentation()
+        self.instrumentation = instrumentation or None
+        if result_cache is True:
+            result_cache = get_result_cache()
+        self.result_cache = result_cache or None
+        # Tables written in the current transaction, None for any
+        self._written_tables = set()
+        self._connect(conf_section or self.default_conf_section,
+                      cursor_factory,
+                      pooled)
 
     def __enter__(self):
         return self
@@ -24,15 +83,23 @@ class Database(Postgres):
         self.close()
 
     @retry(psycopg2.OperationalError, msg="DB connection failure")
-    def _connect(self, config_section, cursor_factory):
+    def _connect(self, config_section, cursor_factory, pooled=False):
         """Connects to db with default RealDictCursor.
         Note that RealDictCursor returns everything as a dictionary."""
 
-        db_creds = self._get_db_creds(config_section)
-        self._database = db_creds["database"]
-        
-        # In case the database is somehow off we wait
-        _conn = psycopg2.connect(cursor_factory=cursor_factory, **db_creds)
+        self._conf_section = config_section
+        self._pool = get_pool(config_section) if pooled else None
+        if self._pool:
+            self._database = self._pool.creds["database"]
+            _conn = self._pool.getconn()
+            _conn.cursor_factory = cursor_factory
+        else:
+            db_creds = self._get_db_creds(config_section)
+            self._database = db_creds["database"]
+
+            # In case the database is somehow off we wait
+            _conn = psycopg2.connect(cursor_factory=cursor_factory,
+                                     **db_creds)
 
         logging.debug("Database Connected")
         self._conn = _conn
@@ -45,15 +112,224 @@ class Database(Postgres):
 
         assert (isinstance(data, list)
                 or isinstance(data, tuple)), "Data must be list/tuple"
-        self._cursor.execute(sql, data)
+        if self.result_cache is not None:
+            return self.result_cache.execute(self, sql, data)
+        return self._run(sql, data)
 
-        try:
-            return self._cursor.fetchall()
-        except psycopg2.ProgrammingError:
+    def _run(self, sql: str, data: iter) -> list:
+        """Executes a query without the result cache"""
+
+        if self.instrumentation is not None:
+            return self.instrumentation.execute(self, sql, data)
+        return self._execute(sql, data)
+
+    def _execute(self, sql: str, data: iter) -> list:
+        """Executes a query without instrumentation"""
+
+        if self.statement_cache:
+            self.statement_cache.execute(self._cursor, sql, data)
+        else:
+            self._cursor.execute(sql, data)
+        invalidate_for_sql(self._database, sql)
+        self._wrote(invalidate_results_for_sql(self._database, sql))
+
+        # No description means no results. This keeps rowcount intact
+        if self._cursor.description is None:
             return []
+        return self._cursor.fetchall()
+
+    def _invalidate_results(self, tables: list):
+        """Drops cached results of tables written other than by execute"""
+
+        invalidate_results(self._database, tables)
+        self._wrote(tables)
+
+    def _wrote(self, tables: list):
+        """Notes tables written in a transaction (None for any)
+
+        Other connections could cache their old rows until the commit,
+        so the results are dropped again when the transaction ends"""
+
+        if tables == [] or self._conn.autocommit:
+            return
+        elif tables is None or self._written_tables is None:
+            self._written_tables = None
+        else:
+            self._written_tables.update(tables)
+
+    def _end_transaction(self):
+        """Drops cached results of the tables the transaction wrote"""
+
+        if self._written_tables != set():
+            invalidate_results(self._database,
+                               None if self._written_tables is None
+                               else list(self._written_tables))
+            self._written_tables = set()
+
+    @contextmanager
+    def transaction(self):
+        """Runs everything in the with block in one transaction
+
+        Commits when the block ends, and rolls back if it raises.
+        Nested transactions (or one opened inside of another
+        transaction) are savepoints, so only their work is rolled back.
+        Inside the transaction of an open execute_iter, the work is
+        committed when the last iterator finishes.
+
+        with db.transaction():
+            db.execute(...)
+        """
+
+        if self._conn.autocommit:
+            self._conn.autocommit = False
+            try:
+                yield self
+                self._conn.commit()
+            except BaseException:
+                if not self._conn.closed:
+                    self._conn.rollback()
+                raise
+            finally:
+                self._end_transaction()
+                if not self._conn.closed:
+                    self._conn.autocommit = True
+        else:
+            name = f"lib_database_savepoint_{next(_savepoint_ids)}"
+            self._cursor.execute(f"SAVEPOINT {name}")
+            try:
+                yield self
+                self._cursor.execute(f"RELEASE SAVEPOINT {name}")
+            except BaseException:
+                if not self._conn.closed:
+                    self._cursor.execute(f"ROLLBACK TO SAVEPOINT {name}")
+                    self._cursor.execute(f"RELEASE SAVEPOINT {name}")
+                raise
+
+    @contextmanager
+    def bulk_session(self,
+                     synchronous_commit: bool = False,
+                     work_mem: str = None,
+                     maintenance_work_mem: str = None,
+                     unlogged: list = []):
+        """A transaction with settings for loading data
+
+        Unlike _modify_db, the settings are SET LOCAL, so they only
+        last until the transaction ends and other sessions aren't
+        changed. Without synchronous_commit, the commit doesn't wait
+        for the WAL to be flushed (a crash can lose the load, but not
+        corrupt the database). work_mem and maintenance_work_mem (for
+        index builds) are sizes such as '1GB'.
+
+        Tables in unlogged are SET UNLOGGED for the load, so it writes
+        no WAL, and SET LOGGED again before the commit. Each switch
+        rewrites the table, so this is for tables that start empty.
+        """
+
+        settings = {"synchronous_commit": ("on" if synchronous_commit
+                                           else "off"),
+                    "work_mem": work_mem,
+                    "maintenance_work_mem": maintenance_work_mem}
+        with self.transaction():
+            for name, value in settings.items():
+                if value is not None:
+                    self.execute(f"SET LOCAL {name} TO %s", [value])
+            for table in unlogged:
+                self.execute(f"ALTER TABLE {table} SET UNLOGGED")
+            yield self
+            for table in unlogged:
+                self.execute(f"ALTER TABLE {table} SET LOGGED")
+
+    def execute_columns(self, sql: str, data: iter = []) -> dict:
+        """Executes a query. Returns {column: np.ndarray} of the results
+
+        Rows are fetched as plain tuples and turned into one array per
+        column, for numeric analytics. NULLs in numeric, bool, date and
+        timestamp columns are masked. See rows.to_columns"""
+
+        assert (isinstance(data, list)
+                or isinstance(data, tuple)), "Data must be list/tuple"
+        with self._conn.cursor(cursor_factory=TupleCursor) as cursor:
+            cursor.execute(sql, data)
+            assert cursor.description is not None, "Query returns no rows"
+            return to_columns(cursor.description, cursor.fetchall())
+
+    def execute_iter(self,
+                     sql: str,
+                     data: iter = [],
+                     itersize: int = 2000,
+                     batch: bool = False):
+        """Lazily yields rows of a query from a server side cursor
+
+        Rows are fetched itersize at a time, so results never have to
+        fit in memory. If batch is True, lists of up to itersize rows
+        are yielded instead of single rows.
+
+        Server side cursors only live inside a transaction, so one is
+        opened until the last open iterator finishes (unless we are
+        already inside one). Any iterators still open are closed when
+        the connection is, such as when leaving a with block.
+        """
+
+        assert (isinstance(data, list)
+                or isinstance(data, tuple)), "Data must be list/tuple"
+        rows = self._iter_rows(sql, data, itersize, batch)
+        self._iterators.add(rows)
+        return rows
+
+    def _iter_rows(self, sql, data, itersize, batch):
+        """Generator for execute_iter"""
+
+        if self._conn.autocommit:
+            self._conn.autocommit = False
+            self._iterator_transaction = True
+        self._num_open_iterators += 1
+        cursor = self._conn.cursor(name=f"lib_database_{next(_cursor_ids)}")
+        cursor.itersize = itersize
+        try:
+            cursor.execute(sql, data)
+            if batch:
+                rows = cursor.fetchmany(itersize)
+                while rows:
+                    yield rows
+                    rows = cursor.fetchmany(itersize)
+            else:
+                yield from cursor
+        finally:
+            self._close_iterator(cursor)
+
+    def _close_iterator(self, cursor):
+        """Closes a named cursor, ending the transaction if it's the last"""
+
+        self._num_open_iterators -= 1
+        if self._conn.closed:
+            return
+        status = self._conn.get_transaction_status()
+        if status != TRANSACTION_STATUS_INERROR:
+            cursor.close()
+        if self._num_open_iterators == 0 and self._iterator_transaction:
+            self._iterator_transaction = False
+            if status == TRANSACTION_STATUS_INERROR:
+                self._conn.rollback()
+            else:
+                self._conn.commit()
+            self._end_transaction()
+            self._conn.autocommit = True
 
     def close(self):
         """Closes the database connection correctly"""
 
-        self._cursor.close()
-        self._conn.close()
+        for rows in list(self._iterators):
+            rows.close()
+        if self._pool:
+            # So the next borrower doesn't inherit our statements
+            close = False
+            if self.statement_cache:
+                try:
+                    self.statement_cache.clear(self._cursor)
+                except psycopg2.Error:
+                    close = True
+            self._cursor.close()
+            self._pool.putconn(self._conn, close=close)
+        else:
+            self._cursor.close()
+            self._conn.close()
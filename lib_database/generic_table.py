@@ -1,13 +1,20 @@
 import csv
 import logging
+from threading import Thread
 
 import numpy as np
+from psycopg2.extras import execute_values
 
-from lib_config import Config
 from lib_utils import file_funcs
-from lib_utils.helper_funcs import run_cmds
 
+from .binary_copy import BinaryCopyDecoder, BinaryCopyEncoder
+from .binary_copy import encode_columns
+from .copy_buffer import CopyBuffer, QueueWriter, compressed
+from .copy_buffer import encode_text_rows, peek_columns
 from .database import Database
+from .rows import TupleCursor, row_value, to_columns, to_structured
+from .partitioning import column_partition_values, partition_clause
+from .schema_cache import get_schema, invalidate_schemas, is_cached
 
 
 class GenericTable(Database):
@@ -15,6 +22,32 @@ class GenericTable(Database):
 
     __slots__ = ["name", "id_col"]
 
+    # Parallel loading
+    from .parallel_load import parallel_bulk_insert
+
+    # Resumable loads
+    from .resumable_load import resumable_bulk_insert_tsv, forget_load
+
+    # Upserts
+    from .upsert import bulk_upsert
+
+    # Declared indexes
+    from .indexes import create_indexes, deferred_indexes, drop_indexes
+    from .indexes import missing_indexes
+
+    # Partitions
+    from .partitioning import copy_partitioned, detach_partitions
+    from .partitioning import drop_partitions, ensure_partitions
+    from .partitioning import forget_partitions, maintain_partitions
+    from .partitioning import old_partitions, partition_batches, partitions
+    from .partitioning import truncate_partitions
+
+    # Indexes and Constraints of the table, see indexes.py
+    indexes = []
+    constraints = []
+    # Partitioning of the table, see partitioning.py
+    partitioning = None
+
     def __init__(self, clear=False, **kwargs):
         """Validates name subclass attr. Creates data dir. Inits tables"""
 
@@ -29,30 +62,53 @@ class GenericTable(Database):
         if clear:
             self.clear_table()
 
-        # Creates table
-        self.create_table()
+        # Creates table, unless this process has seen it already
+        if not is_cached(self, self.name):
+            self.create_table()
+            get_schema(self, self.name)
+            if self.partitioning:
+                self.ensure_partitions()
+            if self.indexes or self.constraints:
+                self.create_indexes()
 
     def clear_table(self):
         """Clears the table"""
 
         logging.debug(f"Dropping {self.name} Table")
         self.execute(f"DROP TABLE IF EXISTS {self.name} CASCADE")
+        # CASCADE can drop other tables' views and constraints too
+        invalidate_schemas(self._database)
+        self.forget_partitions()
         logging.debug(f"{self.name} Table dropped")
 
+    @property
+    def partition_by(self) -> str:
+        """PARTITION BY clause for create_table, or "" if not partitioned
+
+        CREATE TABLE {self.name} (...) {self.partition_by};"""
+
+        return partition_clause(self.partitioning)
+
+    def bulk_session(self, unlogged: bool = False, **kwargs):
+        """A transaction with settings for loading data into this table
+
+        If unlogged, the table is UNLOGGED during the load. See
+        Database.bulk_session"""
+
+        return super(GenericTable, self).bulk_session(
+            unlogged=[self.name] if unlogged else [], **kwargs)
+
     def insert(self, data: dict):
         """Inserts a dictionary into the database, and returns id_col"""
 
         assert isinstance(data, dict)
 
+        if self.partitioning and self.partitioning.column in data:
+            self.ensure_partitions([data[self.partitioning.column]])
+
         #  NOTE: you only need to convert lists for CSVs!!! Not here...
         for key, val in data.items():
-            # Can't have this in one place because numpy.ndarray is the type
-            # But numpy.array is the comprehension
-            if isinstance(val, tuple):
-                data[key] = list(data[key])
-            elif isinstance(val, np.ndarray):
-                # Must convert inner types to not be numpy types
-                data[key] = list(float(x) for x in data[key])
+            data[key] = self._adapt(val)
         values_str = ", ".join(["%s"] * len(data))
 
         sql = (f"INSERT INTO {self.name} ({','.join(data.keys())})"
@@ -65,19 +121,85 @@ class GenericTable(Database):
         # If there is no data, replace part of the query
         sql = sql.replace("() VALUES ()", "DEFAULT VALUES")
 
-        logging.debug(f"About to execute: {sql}")
-        logging.debug(f"With data: {str(data.values())}")
+        # Lazy formatting, since str of big rows is slow even if unused
+        logging.debug("About to execute: %s", sql)
+        logging.debug("With data: %s", data.values())
         result = self.execute(sql, tuple(data.values()))
 
         # Return the new ID
         if self.id_col:
-            return result[0][self.id_col]
+            return row_value(result[0], self.id_col)
+
+    def insert_many(self, list_of_dicts: list, page_size: int = 1000):
+        """Inserts dicts with multi row VALUES, returns ids in input order
+
+        Rows are grouped by their set of keys, and each group is sent
+        page_size rows per statement (with execute_values). If there is
+        no id_col, None is returned.
+        """
+
+        groups = dict()
+        for i, data in enumerate(list_of_dicts):
+            assert isinstance(data, dict)
+            groups.setdefault(tuple(sorted(data)), []).append(i)
+        if self.partitioning:
+            key = self.partitioning.column
+            self.ensure_partitions(dict.fromkeys(
+                x[key] for x in list_of_dicts if key in x))
+
+        returning = f" RETURNING {self.id_col}" if self.id_col else ""
+        ids = [None] * len(list_of_dicts)
+        for keys, indexes in groups.items():
+            if keys:
+                sql = (f"INSERT INTO {self.name} ({','.join(keys)}) "
+                       f"VALUES %s{returning}")
+                rows = [tuple([self._adapt(list_of_dicts[i][x])
+                               for x in keys])
+                        for i in indexes]
+                results = execute_values(self._cursor,
+                                         sql,
+                                         rows,
+                                         page_size=page_size,
+                                         fetch=bool(returning))
+                self._invalidate_results([self.name])
+            else:
+                # A SELECT with no columns inserts default rows
+                sql = (f"INSERT INTO {self.name} "
+                       f"SELECT FROM generate_series(1, %s){returning}")
+                results = self.execute(sql, [len(indexes)])
+            # Postgres returns rows in the order of the VALUES
+            if returning:
+                for i, result in zip(indexes, results):
+                    ids[i] = row_value(result, self.id_col)
+        if self.id_col:
+            return ids
+
+    @staticmethod
+    def _adapt(val):
+        """Converts tuples and numpy arrays into lists for psycopg2"""
+
+        # Can't have this in one place because numpy.ndarray is the type
+        # But numpy.array is the comprehension
+        if isinstance(val, tuple):
+            return list(val)
+        elif isinstance(val, np.ndarray):
+            # Must convert inner types to not be numpy types
+            return val.tolist()
+        else:
+            return val
 
     def get_all(self) -> list:
         """Gets all rows from table"""
 
         return self.execute(f"SELECT * FROM {self.name}")
 
+    def iter_all(self, itersize: int = 2000, batch: bool = False):
+        """Lazily yields all rows from table. See execute_iter"""
+
+        return self.execute_iter(f"SELECT * FROM {self.name}",
+                                 itersize=itersize,
+                                 batch=batch)
+
     def get_count(self, sql: str = None, data: list = []) -> int:
         """Gets count from table"""
 
@@ -88,24 +210,75 @@ class GenericTable(Database):
 
         assert "count" in sql.lower(), "This is not a count query"
 
-        return self.execute(sql, data)[0]["count"]
+        return row_value(self.execute(sql, data)[0], "count")
+
+    def bulk_insert(self, list_of_dicts, stream=False):
+        """Bulk inserts rows into the database (with a TSV)
 
-    def bulk_insert(self, list_of_dicts):
-        """Bulk inserts rows into the database (with a TSV)"""
+        If stream is True, rows are sent over the connection with
+        bulk_insert_stream instead, and never touch the filesystem.
+        So are rows of partitioned tables, to route them to partitions"""
+
+        if stream or self.partitioning:
+            return self.bulk_insert_stream(list_of_dicts)
 
         with file_funcs.temp_path(path_append=".tsv") as path:
             file_funcs.write_dicts_to_tsv(list_of_dicts, path)
             self.bulk_insert_tsv(path)
 
+    def bulk_insert_stream(self,
+                           rows,
+                           columns: list = None,
+                           batch_size: int = 1000,
+                           read_size: int = 2 ** 16) -> int:
+        """Streams rows into the table with COPY FROM STDIN
+
+        rows can be any iterable (including generators) of dicts, or of
+        sequences ordered like columns. Rows are encoded batch_size at
+        a time, so memory is bounded no matter how many there are, and
+        since the data goes over the connection this works on remote
+        hosts as well. Returns the number of bytes sent.
+
+        Rows of range and list partitioned tables are copied straight
+        into their partitions, see copy_partitioned.
+        """
+
+        if self.partitioning and self.partitioning.method != "hash":
+            return self.copy_partitioned(rows, columns, batch_size)
+
+        rows, columns = peek_columns(rows, columns)
+        if not columns:
+            return 0
+
+        buf = CopyBuffer(encode_text_rows(rows, columns, batch_size))
+        sql = f"COPY {self.name} ({','.join(columns)}) FROM STDIN"
+        logging.debug(f"Streaming rows into {self.name}")
+        self._cursor.copy_expert(sql, buf, size=read_size)
+        self._invalidate_results([self.name])
+        logging.debug(f"Streamed {buf.bytes_read} bytes into {self.name}")
+        return buf.bytes_read
+
     def bulk_insert_tsv(self, path):
-        """Copies a TSV to the db for bulk insertion"""
+        """Copies a TSV to the db for bulk insertion
+
+        Partitions of range and list partitioned tables are not made
+        from the file, so must exist already (see ensure_partitions).
+        Inside a transaction (such as a bulk_session) the file is sent
+        over this connection instead, so the load is part of it"""
 
         logging.debug(f"Writing {path} to db")
         with open(path, "r") as f:
+            if not self._conn.autocommit:
+                self._cursor.copy_expert(
+                    f"""COPY {self.name} FROM STDIN
+                        DELIMITER E'\t' CSV HEADER NULL AS '';""", f)
+                self._invalidate_results([self.name])
+                return
             sql = f"""COPY {self.name}
                     FROM '{path}'
                   DELIMITER E'\t' CSV HEADER NULL AS '';"""
-            self.run_sql_cmds([sql], database=self._database)
+            self.run_sql_session([sql], database=self._database)
+            self._invalidate_results([self.name])
             # Note that there is a copy_expert function
             # But that reads from stdin, which I'd imagine is slower
             # Than just copying from the file
@@ -113,39 +286,224 @@ class GenericTable(Database):
             # The below does not work with headers
             #self._cursor.copy_from(f, self.name, sep="\t", null="")
 
-    def copy_to_tsv(self, path: str):
+    def bulk_insert_binary(self,
+                           rows,
+                           columns: list = None,
+                           batch_size: int = 1000,
+                           read_size: int = 2 ** 16) -> int:
+        """Streams rows into the table with a binary COPY FROM STDIN
+
+        Like bulk_insert_stream, but values are packed according to the
+        column types of the table, which avoids formatting every number
+        as a string. Returns the number of bytes sent.
+
+        Rows of range and list partitioned tables are copied in batches,
+        each once its partitions exist, see partition_batches.
+        """
+
+        rows, columns = peek_columns(rows, columns)
+        if not columns:
+            return 0
+
+        if self.partitioning and self.partitioning.method != "hash":
+            batches = self.partition_batches(rows, columns)
+        else:
+            batches = [rows]
+        types = self.column_types
+        encoder = BinaryCopyEncoder(columns, [types[x] for x in columns])
+        sql = (f"COPY {self.name} ({','.join(columns)}) "
+               "FROM STDIN WITH (FORMAT binary)")
+        logging.debug(f"Binary copying rows into {self.name}")
+        num_bytes = 0
+        for batch in batches:
+            buf = CopyBuffer(encoder.encode_rows(batch, batch_size))
+            self._cursor.copy_expert(sql, buf, size=read_size)
+            num_bytes += buf.bytes_read
+        self._invalidate_results([self.name])
+        logging.debug(f"Copied {num_bytes} bytes into {self.name}")
+        return num_bytes
+
+    def bulk_insert_columns(self,
+                            columns: dict,
+                            chunk_rows: int = 65536,
+                            read_size: int = 2 ** 16) -> int:
+        """Inserts a dict of {column: array} with a binary COPY
+
+        Lengths and dtypes are validated against the table up front.
+        Numeric, bool and datetime64 columns are packed a column at a
+        time, so no per row python objects are made. Columns that are
+        masked arrays are inserted with NULLs where masked.
+        Missing partitions of range and list partitioned tables are made
+        first. Returns the number of bytes sent.
+        """
+
+        buf = CopyBuffer(encode_columns(columns, self.column_types,
+                                        chunk_rows))
+        if self.partitioning and self.partitioning.method != "hash":
+            key = self.partitioning.column
+            assert key in columns, f"Columns need the partition key {key}"
+            self.ensure_partitions(column_partition_values(
+                columns[key], self.column_types[key]))
+        sql = (f"COPY {self.name} ({','.join(columns)}) "
+               "FROM STDIN WITH (FORMAT binary)")
+        logging.debug(f"Copying columns into {self.name}")
+        self._cursor.copy_expert(sql, buf, size=read_size)
+        self._invalidate_results([self.name])
+        logging.debug(f"Copied {buf.bytes_read} bytes into {self.name}")
+        return buf.bytes_read
+
+    def copy_to_tsv(self, path: str, compression: str = None):
         """Copies table to a specified path"""
 
         logging.debug(f"Copying file from {self.name} to {path}")
-        # NOTE: can't use the easy method due to AWS
-        # self.execute(f"COPY {self.name} TO %s DELIMITER '\t';", [path])
-        with Config(write=False) as conf_dict:
-            creds = conf_dict[self.db]
-            logging.warning("Exposing password like this is insecure!!")
-            cmd = (f"export PGPASSWORD={creds['password']} && "
-                   f"psql --host={creds['host']} "
-                   f"--port={creds['port']} "
-                   f"--username={creds['user']} "
-                   #f"--password "
-                   f"--dbname={creds['database']} "
-                   r""" -c "\COPY """
-                   f"{self.name} TO {path} "
-                   r"""DELIMITER E'\t';" """)
-            logging.info("Attempting to copy table. "
-                         "About to ask for db password")
-            run_cmds(cmd)
+        self.copy_to(path, compression=compression)
         logging.debug("Copy complete")
 
+    def copy_to(self,
+                dest,
+                query: str = None,
+                data: iter = [],
+                fmt: str = "text",
+                header: bool = False,
+                compression: str = None,
+                read_size: int = 2 ** 16):
+        """Streams the table (or a query) out with COPY TO STDOUT
+
+        dest is a path or anything with a write method, such as a pipe.
+        The text format is tab delimited, like the TSVs we insert.
+        compression can be gzip or zstd, and is done on the fly.
+        """
+
+        sql = self._copy_to_sql(query, data, fmt, header)
+        if isinstance(dest, str):
+            with open(dest, "wb") as f, compressed(f, compression) as w:
+                self._cursor.copy_expert(sql, w, size=read_size)
+        else:
+            with compressed(dest, compression) as w:
+                self._cursor.copy_expert(sql, w, size=read_size)
+
+    def fetch_numpy(self,
+                    sql: str,
+                    params: iter = [],
+                    structured: bool = False,
+                    chunk_bytes: int = 2 ** 20):
+        """Returns the results of a query as {column: np.ndarray}
+
+        The query is run as a binary COPY TO STDOUT, and decoded
+        chunk_bytes at a time straight into numpy arrays, so no per row
+        python objects are made for numeric columns. Columns with NULLs
+        are masked arrays. See BinaryCopyDecoder for the types. Queries
+        with other types (such as numeric) fall back to execute_columns.
+
+        If structured, one structured array is returned instead.
+        """
+
+        query = sql.strip().rstrip(";")
+        # Run without params from here on, so % isn't formatted twice
+        sql = self._cursor.mogrify(query, params).decode()
+        with self._conn.cursor(cursor_factory=TupleCursor) as cursor:
+            cursor.execute(f"SELECT * FROM ({sql}) AS q LIMIT 0")
+            names = [x.name for x in cursor.description]
+            oids = [x.type_code for x in cursor.description]
+            assert len(set(names)) == len(names), "Columns must be unique"
+            if BinaryCopyDecoder.can_decode(oids):
+                decoder = BinaryCopyDecoder(names, oids, chunk_bytes)
+                cursor.copy_expert(
+                    f"COPY ({sql}) TO STDOUT WITH (FORMAT binary)", decoder)
+                columns = decoder.finish()
+            else:
+                logging.debug("No binary decoding for some types of "
+                              f"{sql}, using execute_columns")
+                cursor.execute(query, params)
+                columns = to_columns(cursor.description, cursor.fetchall())
+        return to_structured(columns) if structured else columns
+
+    def get_all_numpy(self, structured: bool = False) -> dict:
+        """Gets all rows from table as numpy arrays. See fetch_numpy"""
+
+        return self.fetch_numpy(f"SELECT * FROM {self.name}",
+                                structured=structured)
+
+    def iter_copy_to(self,
+                     query: str = None,
+                     data: iter = [],
+                     fmt: str = "text",
+                     header: bool = False,
+                     compression: str = None,
+                     max_chunks: int = 16):
+        """Yields bytes chunks of the table (or a query) from COPY TO
+
+        See copy_to. The COPY runs in a thread, and at most max_chunks
+        are held in memory waiting to be consumed. If the generator is
+        closed early the COPY is cancelled.
+        """
+
+        writer = QueueWriter(max_chunks)
+        errors = []
+
+        def copy():
+            try:
+                self.copy_to(writer, query, data, fmt, header, compression)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                writer.done()
+
+        thread = Thread(target=copy, daemon=True)
+        thread.start()
+        try:
+            yield from iter(writer.chunks.get, None)
+            thread.join()
+            if errors:
+                raise errors[0]
+        finally:
+            # Closed early, so stop the COPY
+            if thread.is_alive():
+                writer.stop()
+                self._conn.cancel()
+                thread.join()
+
+    def _copy_to_sql(self, query, data, fmt, header) -> str:
+        """Returns the COPY TO STDOUT sql for a table or query"""
+
+        if query:
+            source = f"({self._cursor.mogrify(query, data).decode()})"
+        else:
+            assert not data, "Data is only for queries"
+            source = self.name
+        options = f"FORMAT {fmt}" + (", HEADER" if header else "")
+        return f"COPY {source} TO STDOUT WITH ({options})"
+
+    @property
+    def schema(self):
+        """Returns the cached TableSchema of the table (None if missing)
+
+        Columns, types, nullability, primary key and indexes are read
+        from pg_catalog once per process, and dropped from the cache by
+        clear_table and by DDL run through execute. DDL run elsewhere
+        needs refresh_schema."""
+
+        return get_schema(self, self.name)
+
+    def refresh_schema(self):
+        """Reloads the schema of the table from pg_catalog"""
+
+        return get_schema(self, self.name, refresh=True)
+
     @property
     def columns(self) -> list:
         """Returns the columns of the table
 
         used to insert into the database"""
 
-        sql = """SELECT column_name FROM information_schema.columns
-              WHERE table_schema = 'public' AND table_name = %s
-                --Without this they are out of order
-                ORDER BY ordinal_position;
-              """
+        schema = self.schema
+        return list(schema.columns) if schema else []
+
+    @property
+    def column_types(self) -> dict:
+        """Returns {column: udt_name} for the table
+
+        udt_name is the underlying type, such as int4 or _float8"""
 
-        return [x['column_name'] for x in self.execute(sql, [self.name])]
+        schema = self.schema
+        return dict(schema.types) if schema else {}
@@ -0,0 +1,247 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import logging
+import os
+import re
+from typing import NamedTuple
+
+import psycopg2
+
+from .database import Database
+from .rows import row_value
+from .schema_cache import get_schema
+
+
+class Index(NamedTuple):
+    """An index a GenericTable declares in its indexes attr
+
+    columns can be column names or expressions, such as "lower(email)".
+    The name defaults to {table}_{columns}_idx"""
+
+    columns: list
+    name: str = None
+    unique: bool = False
+    method: str = "btree"
+    include: list = None
+    where: str = None
+
+
+class Constraint(NamedTuple):
+    """A constraint a GenericTable declares in its constraints attr
+
+    definition is what follows ADD CONSTRAINT name, such as
+    "UNIQUE (col1, col2)" or "CHECK (col1 > 0)"
+    """
+
+    name: str
+    definition: str
+
+
+def index_name(table: str, index: Index) -> str:
+    """Returns the name of a declared index"""
+
+    if index.name:
+        return index.name
+    name = re.sub(r"\W+", "_", f"{table}_{'_'.join(index.columns)}_idx")
+    # Postgres truncates identifiers to 63 bytes
+    return name[:63]
+
+
+def index_sql(table: str, index: Index, concurrently: bool = False) -> str:
+    """Returns the CREATE INDEX statement of a declared index"""
+
+    sql = (f"CREATE {'UNIQUE ' if index.unique else ''}INDEX "
+           f"{'CONCURRENTLY ' if concurrently else ''}"
+           f"{index_name(table, index)} ON {table} USING {index.method} "
+           f"({', '.join(index.columns)})")
+    if index.include:
+        sql += f" INCLUDE ({', '.join(index.include)})"
+    if index.where:
+        sql += f" WHERE {index.where}"
+    return sql
+
+
+def missing_indexes(self) -> list:
+    """Returns the declared Indexes and Constraints that need building
+
+    Indexes are missing if they don't exist or are invalid (such as
+    after a failed CREATE INDEX CONCURRENTLY). Constraints are missing
+    if they don't exist or were added NOT VALID"""
+
+    schema = get_schema(self, self.name, refresh=True)
+    valid = {x.name for x in schema.indexes if x.valid} if schema else set()
+    missing = [x for x in self.indexes
+               if index_name(self.name, x) not in valid]
+    if self.constraints:
+        sql = """SELECT conname FROM pg_constraint
+              WHERE conrelid = to_regclass(%s) AND convalidated;"""
+        existing = {row_value(x, "conname")
+                    for x in self.execute(sql, [self.name])}
+        missing.extend(x for x in self.constraints
+                       if x.name not in existing)
+    return missing
+
+
+def drop_indexes(self,
+                 constraints: bool = True,
+                 undeclared: bool = False) -> list:
+    """Drops the declared indexes (and constraints) that exist
+
+    With undeclared, the table's other indexes are dropped too, other
+    than those backing constraints. Returns the names of those dropped"""
+
+    dropped = []
+    if constraints:
+        sql = "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass"
+        existing = {row_value(x, "conname")
+                    for x in self.execute(sql, [self.name])}
+        for constraint in self.constraints:
+            if constraint.name in existing:
+                logging.info(f"Dropping constraint {constraint.name}")
+                self.execute(f"ALTER TABLE {self.name} "
+                             f"DROP CONSTRAINT {constraint.name}")
+                dropped.append(constraint.name)
+    schema = get_schema(self, self.name, refresh=True)
+    existing = {x.name for x in schema.indexes} if schema else set()
+    names = [index_name(self.name, x) for x in self.indexes]
+    if undeclared:
+        sql = """SELECT i.relname FROM pg_constraint c
+              JOIN pg_class i ON i.oid = c.conindid
+              WHERE c.conrelid = %s::regclass;"""
+        backing = {row_value(x, "relname")
+                   for x in self.execute(sql, [self.name])}
+        names += sorted(existing - backing - set(names))
+    for name in names:
+        if name in existing:
+            logging.info(f"Dropping index {name}")
+            self.execute(f"DROP INDEX {name}")
+            dropped.append(name)
+    return dropped
+
+
+def create_indexes(self,
+                   workers: int = None,
+                   maintenance_work_mem: str = "1GB",
+                   parallel_workers: int = None,
+                   concurrently: bool = False) -> list:
+    """Builds the missing declared indexes, then adds the constraints
+
+    Indexes are built at the same time on up to workers connections of
+    their own, each with maintenance_work_mem and parallel_workers
+    (max_parallel_maintenance_workers, by default the cpus left over
+    per build). Constraints lock the whole table, so they are added one
+    at a time afterwards. With concurrently, writes to the table aren't
+    blocked during index builds, but each takes longer.
+
+    Returns the names of the indexes and constraints built"""
+
+    missing = missing_indexes(self)
+    indexes = [x for x in missing if isinstance(x, Index)]
+    constraints = [x for x in missing if isinstance(x, Constraint)]
+
+    sqls = []
+    for index in indexes:
+        # Invalid indexes are still there, and must be dropped first
+        self.execute(f"DROP INDEX IF EXISTS {index_name(self.name, index)}")
+        sqls.append(index_sql(self.name, index, concurrently))
+    build_indexes(self,
+                  sqls,
+                  workers=workers,
+                  maintenance_work_mem=maintenance_work_mem,
+                  parallel_workers=parallel_workers)
+
+    existing = {row_value(x, "conname") for x in self.execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass",
+        [self.name])}
+    # Add the rest before raising the first error, as with indexes
+    errors = []
+    for constraint in constraints:
+        logging.info(f"Adding constraint {constraint.name}")
+        try:
+            with self.transaction():
+                if constraint.name in existing:
+                    self.execute(f"ALTER TABLE {self.name} "
+                                 f"VALIDATE CONSTRAINT {constraint.name}")
+                else:
+                    self.execute(f"ALTER TABLE {self.name} ADD CONSTRAINT "
+                                 f"{constraint.name} {constraint.definition}")
+        except psycopg2.Error as e:
+            logging.error(f"Could not add {constraint.name}: {e}")
+            errors.append(e)
+    if errors:
+        raise errors[0]
+    return ([index_name(self.name, x) for x in indexes]
+            + [x.name for x in constraints])
+
+
+def build_indexes(self,
+                  sqls: list,
+                  workers: int = None,
+                  maintenance_work_mem: str = "1GB",
+                  parallel_workers: int = None):
+    """Runs CREATE INDEX statements at the same time on new connections
+
+    Inside a transaction, other connections can't see its work, so
+    the statements run one at a time on this connection instead"""
+
+    if not sqls:
+        return
+    cpus = os.cpu_count() or 1
+    workers = min(workers or cpus, len(sqls))
+    if parallel_workers is None:
+        parallel_workers = max(cpus // workers - 1, 0)
+    settings = {"maintenance_work_mem": maintenance_work_mem,
+                "max_parallel_maintenance_workers": parallel_workers}
+
+    if not self._conn.autocommit:
+        with self.transaction():
+            for name, value in settings.items():
+                self.execute(f"SET LOCAL {name} TO %s", [value])
+            for sql in sqls:
+                logging.info(f"Building {sql}")
+                self.execute(sql)
+        return
+
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(_build_index,
+                                   self._conf_section,
+                                   sql,
+                                   settings)
+                   for sql in sqls]
+        # Wait for every build before raising the first error
+        errors = [x.exception() for x in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+
+
+def _build_index(conf_section: str, sql: str, settings: dict):
+    """Runs one CREATE INDEX on a new connection. Run in threads"""
+
+    with Database(conf_section) as db:
+        for name, value in settings.items():
+            db.execute(f"SET {name} TO %s", [value])
+        logging.info(f"Building {sql}")
+        db.execute(sql)
+
+
+@contextmanager
+def deferred_indexes(self, **kwargs):
+    """Drops the declared indexes and constraints, and rebuilds them after
+
+    with table.deferred_indexes():
+        table.bulk_insert(rows)
+
+    Rows are then loaded without index upkeep, and the indexes are built
+    once at the end. They are rebuilt even if the load fails. kwargs are
+    passed to create_indexes"""
+
+    drop_indexes(self)
+    try:
+        yield self
+    except BaseException:
+        # In a transaction, rolling it back brings the indexes back
+        if self._conn.autocommit:
+            create_indexes(self, **kwargs)
+        raise
+    create_indexes(self, **kwargs)
@@ -0,0 +1,204 @@
+from collections import deque
+import logging
+import math
+from threading import Lock
+import time
+from typing import NamedTuple
+
+import psycopg2
+
+from .statement_cache import first_word, normalize
+
+
+class QueryEvent(NamedTuple):
+    """One call to Database.execute, as passed to after hooks
+
+    rows is the number of rows returned, or affected if none were.
+    num_bytes is the size of the query sent, after params are filled in.
+    error is the exception raised, if any"""
+
+    sql: str
+    data: object
+    seconds: float
+    rows: int
+    num_bytes: int
+    error: Exception = None
+
+
+class StatementStats:
+    """Aggregates for one normalized statement"""
+
+    __slots__ = ["count", "errors", "total_seconds", "max_seconds", "rows",
+                 "num_bytes", "latencies"]
+
+    def __init__(self, max_samples: int):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.num_bytes = 0
+        # The latest latencies, for percentiles
+        self.latencies = deque(maxlen=max_samples)
+
+    def add(self, event: QueryEvent):
+        self.count += 1
+        self.errors += event.error is not None
+        self.total_seconds += event.seconds
+        self.max_seconds = max(self.max_seconds, event.seconds)
+        self.rows += event.rows
+        self.num_bytes += event.num_bytes
+        self.latencies.append(event.seconds)
+
+    def to_dict(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {"count": self.count,
+                "errors": self.errors,
+                "total_seconds": self.total_seconds,
+                "mean_seconds": self.total_seconds / self.count,
+                "p50_seconds": _percentile(latencies, .5),
+                "p99_seconds": _percentile(latencies, .99),
+                "max_seconds": self.max_seconds,
+                "rows": self.rows,
+                "bytes": self.num_bytes}
+
+
+class Instrumentation:
+    """Times Database.execute calls and aggregates them per statement
+
+    Pass one to Database(instrumentation=...), or share one between
+    several Database objects (such as many tables). Statements are
+    grouped by their normalized SQL, so params don't split them up.
+    p50/p99 are over the latest max_samples calls of each statement.
+
+    before hooks are called with (sql, data), after hooks with a
+    QueryEvent. With slow_query_ms set, slower statements are logged,
+    and for SELECTs in autocommit, EXPLAIN (ANALYZE, BUFFERS) is
+    captured. Note that EXPLAIN ANALYZE runs the query a second time.
+    """
+
+    def __init__(self,
+                 slow_query_ms: float = None,
+                 explain: bool = True,
+                 max_samples: int = 1000,
+                 max_slow_queries: int = 100):
+        self.slow_query_ms = slow_query_ms
+        self.explain = explain
+        self.max_samples = max_samples
+        self.before_hooks = []
+        self.after_hooks = []
+        self._lock = Lock()
+        # {normalized sql: StatementStats}
+        self._statements = dict()
+        self._slow_queries = deque(maxlen=max_slow_queries)
+
+    def add_hooks(self, before=None, after=None):
+        """Adds a hook called before and/or after every execute"""
+
+        if before:
+            self.before_hooks.append(before)
+        if after:
+            self.after_hooks.append(after)
+
+    def execute(self, db, sql: str, data) -> list:
+        """Runs db._execute, recording how long it took"""
+
+        for hook in self.before_hooks:
+            hook(sql, data)
+        error = None
+        rows = []
+        start = time.perf_counter()
+        try:
+            rows = db._execute(sql, data)
+            return rows
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            cursor = db._cursor
+            event = QueryEvent(sql=sql,
+                               data=data,
+                               seconds=seconds,
+                               rows=len(rows) or max(cursor.rowcount, 0),
+                               num_bytes=len(cursor.query or b""),
+                               error=error)
+            self._record(db, event)
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """Returns {"statements": {sql: stats}, "slow_queries": [...]}
+
+        Statements are sorted by total time, slowest first"""
+
+        with self._lock:
+            statements = sorted(self._statements.items(),
+                                key=lambda x: x[1].total_seconds,
+                                reverse=True)
+            snapshot = {"statements": {sql: stats.to_dict()
+                                       for sql, stats in statements},
+                        "slow_queries": list(self._slow_queries)}
+            if reset:
+                self._reset()
+        return snapshot
+
+    def reset(self):
+        """Clears all stats"""
+
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._statements = dict()
+        self._slow_queries.clear()
+
+    def _record(self, db, event: QueryEvent):
+        """Adds an event to the stats, runs after hooks and slow logging"""
+
+        key = normalize(event.sql)
+        with self._lock:
+            if key not in self._statements:
+                self._statements[key] = StatementStats(self.max_samples)
+            self._statements[key].add(event)
+
+        if (self.slow_query_ms is not None
+                and event.error is None
+                and event.seconds * 1000 >= self.slow_query_ms):
+            plan = self._explain(db, event) if self.explain else None
+            logging.warning(f"Slow query ({event.seconds * 1000:.1f} ms): "
+                            f"{key}" + (f"\n{plan}" if plan else ""))
+            with self._lock:
+                self._slow_queries.append({"sql": key,
+                                           "seconds": event.seconds,
+                                           "rows": event.rows,
+                                           "plan": plan})
+
+        for hook in self.after_hooks:
+            hook(event)
+
+    @staticmethod
+    def _explain(db, event: QueryEvent):
+        """Returns the EXPLAIN (ANALYZE, BUFFERS) of a SELECT, or None
+
+        Skipped inside transactions, where a failure would abort them,
+        and for WITH, which can hold INSERTs that would run again"""
+
+        if first_word(event.sql) != "SELECT" or not db._conn.autocommit:
+            return None
+        try:
+            with db._conn.cursor() as cursor:
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {event.sql}",
+                               event.data)
+                return "\n".join(list(row.values())[0]
+                                 if isinstance(row, dict) else row[0]
+                                 for row in cursor.fetchall())
+        except psycopg2.Error as e:
+            logging.debug(f"Could not explain {event.sql}: {e}")
+            return None
+
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest rank percentile of sorted values"""
+
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(math.ceil(fraction * len(sorted_values)) - 1, 0)]
@@ -0,0 +1,241 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import logging
+import multiprocessing
+import os
+import time
+from typing import NamedTuple
+
+from .copy_buffer import CopyBuffer, encode_text_rows, peek_columns
+from .database import Database
+from .indexes import build_indexes
+from .partitioning import ensure_row_partitions
+from .schema_cache import get_schema
+
+
+# How bulk_insert_tsv reads TSVs
+TSV_OPTIONS = "DELIMITER E'\\t' CSV NULL AS ''"
+
+
+class ChunkResult(NamedTuple):
+    """Outcome of loading one chunk in a worker
+
+    source can be passed back to parallel_bulk_insert to retry the chunk.
+    It is None for chunks of rows that loaded. error is None on success
+    """
+
+    chunk: int
+    source: object
+    pid: int
+    rows: int
+    num_bytes: int
+    seconds: float
+    error: str = None
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class RangeReader:
+    """File-like object that reads only bytes [start, end) of a file"""
+
+    __slots__ = ["_f", "_remaining", "bytes_read"]
+
+    def __init__(self, f, start: int, end: int):
+        f.seek(start)
+        self._f = f
+        self._remaining = end - start
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._f.read(size)
+        self._remaining -= len(data)
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._f.readline(size)
+        self._remaining -= len(data)
+        self.bytes_read += len(data)
+        return data
+
+
+def split_tsv(path: str, chunk_bytes: int = 2 ** 28, header: bool = True):
+    """Returns [(path, start, end)] byte ranges of a TSV
+
+    Ranges end on line boundaries and skip the header, so each can be
+    copied on its own. Quoted fields must not contain newlines.
+    """
+
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, "rb") as f:
+        start = len(f.readline()) if header else 0
+        while start < size:
+            f.seek(min(start + chunk_bytes, size) - 1)
+            # Read to the end of the line that the chunk ends in
+            end = min(f.tell() + len(f.readline()), size)
+            ranges.append((path, start, end))
+            start = end
+    return ranges
+
+
+def copy_chunk(conf_section: str,
+               table: str,
+               columns: list,
+               chunk: int,
+               source) -> ChunkResult:
+    """Copies one chunk on a new connection. Run in worker processes
+
+    source is a TSV path (with a header), a (path, start, end) range of
+    a TSV without the header, or a list of rows. Errors are returned in
+    the result rather than raised, so one chunk can't sink the load.
+    """
+
+    start = time.perf_counter()
+    rows = num_bytes = 0
+    error = None
+    try:
+        with Database(conf_section) as db:
+            if isinstance(source, str):
+                sql = f"COPY {table} FROM STDIN {TSV_OPTIONS} HEADER"
+                with open(source, "rb") as f:
+                    db._cursor.copy_expert(sql, f)
+                num_bytes = os.path.getsize(source)
+            elif isinstance(source, tuple):
+                path, range_start, range_end = source
+                sql = f"COPY {table} FROM STDIN {TSV_OPTIONS}"
+                with open(path, "rb") as f:
+                    reader = RangeReader(f, range_start, range_end)
+                    db._cursor.copy_expert(sql, reader)
+                num_bytes = reader.bytes_read
+            else:
+                source, cols = peek_columns(source, columns)
+                buf = CopyBuffer(encode_text_rows(source, cols))
+                sql = f"COPY {table} ({','.join(cols)}) FROM STDIN"
+                db._cursor.copy_expert(sql, buf)
+                num_bytes = buf.bytes_read
+            rows = db._cursor.rowcount
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    # Rows are sent back by the parent only if they failed (_run_chunks)
+    if not isinstance(source, (str, tuple)):
+        source = None
+    return ChunkResult(chunk=chunk,
+                       source=source,
+                       pid=os.getpid(),
+                       rows=max(rows, 0),
+                       num_bytes=num_bytes,
+                       seconds=time.perf_counter() - start,
+                       error=error)
+
+
+def parallel_bulk_insert(self,
+                         source,
+                         workers: int = None,
+                         chunk_bytes: int = 2 ** 28,
+                         columns: list = None,
+                         drop_indexes: bool = False,
+                         disable_triggers: bool = False) -> list:
+    """Copies source into the table with COPYs in worker processes
+
+    source can be:
+        - The path of one large TSV, split on line boundaries into
+          chunks of about chunk_bytes
+        - A list of TSV paths and/or (path, start, end) ranges, such as
+          the sources of failed ChunkResults to retry them
+        - An iterable of lists of rows (dicts, or sequences ordered like
+          columns). At most 2 per worker are in flight at once
+
+    TSVs are read like bulk_insert_tsv reads them, so the partitions
+    they need must exist already. Those of rows are made before each
+    chunk is sent. Indexes (other than
+    those of constraints) can be dropped and rebuilt at the same time
+    (see drop_indexes and build_indexes), and triggers disabled, around
+    the load. Returns [ChunkResult] in chunk order. Failed chunks have
+    an error, and the rest of the load goes on.
+    """
+
+    workers = workers or max(multiprocessing.cpu_count() - 1, 1)
+    if isinstance(source, str):
+        source = split_tsv(source, chunk_bytes)
+
+    index_defs = []
+    if drop_indexes:
+        schema = get_schema(self, self.name, refresh=True)
+        definitions = {x.name: x.definition for x in schema.indexes}
+        index_defs = [definitions[x] for x in
+                      self.drop_indexes(constraints=False, undeclared=True)]
+    if disable_triggers:
+        self.execute(f"ALTER TABLE {self.name} DISABLE TRIGGER ALL")
+    try:
+        results = _run_chunks(self, enumerate(source), workers, columns)
+    finally:
+        if disable_triggers:
+            self.execute(f"ALTER TABLE {self.name} ENABLE TRIGGER ALL")
+        build_indexes(self, index_defs, workers=workers)
+        # The rows were written on other connections
+        self._invalidate_results([self.name])
+
+    _log_results(self.name, results)
+    return results
+
+
+def _run_chunks(table, chunks, workers: int, columns: list) -> list:
+    """Submits chunks to a process pool, keeping 2 per worker in flight"""
+
+    results = []
+    # {future: source}, so failed chunks of rows can be retried
+    pending = dict()
+    # Spawn so that workers don't inherit the parent's connections
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as executor:
+        for chunk, chunk_source in chunks:
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(_result(x, pending.pop(x)) for x in done)
+            if (table.partitioning
+                    and table.partitioning.method != "hash"
+                    and not isinstance(chunk_source, (str, tuple))):
+                chunk_source, cols = peek_columns(chunk_source, columns)
+                chunk_source = list(chunk_source)
+                if cols:
+                    ensure_row_partitions(table, chunk_source, cols)
+            future = executor.submit(copy_chunk,
+                                     table._conf_section,
+                                     table.name,
+                                     columns,
+                                     chunk,
+                                     chunk_source)
+            pending[future] = chunk_source
+        results.extend(_result(x, pending.pop(x))
+                       for x in wait(pending).done)
+    return sorted(results, key=lambda x: x.chunk)
+
+
+def _result(future, source) -> ChunkResult:
+    """Returns a future's ChunkResult, with the source if it failed"""
+
+    result = future.result()
+    if result.error and result.source is None:
+        result = result._replace(source=source)
+    return result
+
+
+def _log_results(table_name: str, results: list):
+    """Logs throughput per worker and any failed chunks"""
+
+    by_pid = dict()
+    for result in results:
+        rows, seconds = by_pid.get(result.pid, (0, 0))
+        by_pid[result.pid] = (rows + result.rows, seconds + result.seconds)
+        if result.error:
+            logging.error(f"Chunk {result.chunk} of {table_name} failed: "
+                          f"{result.error}")
+    for pid, (rows, seconds) in by_pid.items():
+        logging.info(f"Worker {pid} copied {rows} rows into {table_name} "
+                     f"at {rows / seconds if seconds else 0:,.0f} rows/sec")
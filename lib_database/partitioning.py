@@ -0,0 +1,377 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from itertools import islice
+import logging
+import os
+import re
+from typing import NamedTuple
+import zlib
+
+import numpy as np
+import psycopg2
+
+from .copy_buffer import CopyBuffer, encode_text_rows, peek_columns
+from .database import Database
+from .rows import row_value
+
+
+# Units of time a range partition can span
+TIME_INTERVALS = ("day", "week", "month", "year")
+
+# {(database, table): {partition names}}, for this process
+_partitions = dict()
+# {(database, table): {names}} of partitions that would overlap others
+_overlaps = dict()
+
+
+class Partitioning(NamedTuple):
+    """How a GenericTable is partitioned, in its partitioning attr
+
+    method is "range", "list" or "hash", and column is the key.
+    For range, interval is how much of the key each partition holds:
+    a number for numeric keys, or one of TIME_INTERVALS for dates and
+    timestamps. For hash, modulus is the number of partitions.
+    """
+
+    method: str
+    column: str
+    interval: object = None
+    modulus: int = None
+
+
+class Partition(NamedTuple):
+    """A partition of a table, from pg_inherits"""
+
+    name: str
+    # Such as FOR VALUES FROM ('2024-01-01') TO ('2024-02-01')
+    bound: str
+
+
+def partition_clause(partitioning: Partitioning) -> str:
+    """Returns the PARTITION BY clause to end a CREATE TABLE with"""
+
+    if partitioning is None:
+        return ""
+    assert partitioning.method in ("range", "list", "hash"), "Bad method"
+    if partitioning.method == "range":
+        assert partitioning.interval, "Range partitions need an interval"
+    elif partitioning.method == "hash":
+        assert partitioning.modulus, "Hash partitions need a modulus"
+    return (f"PARTITION BY {partitioning.method.upper()} "
+            f"({partitioning.column})")
+
+
+def partition_for(table: str, partitioning: Partitioning, value):
+    """Returns (name, bound sql, bound params) of the partition of value
+
+    Hash partitions can't be worked out here, so these are for range
+    and list partitions only"""
+
+    if partitioning.method == "list":
+        if value is None:
+            return _name(table, "null"), "IN (NULL)", []
+        suffix = re.sub(r"\W+", "_", str(value))
+        # Keep names unique when characters were replaced or cut
+        if suffix != str(value) or suffix == "null" or len(suffix) > 30:
+            suffix = f"{suffix[:30]}_{zlib.crc32(str(value).encode()):08x}"
+        return _name(table, suffix), "IN (%s)", [value]
+
+    start, end = _range_bounds(value, partitioning.interval)
+    if isinstance(start, (date, datetime)):
+        suffix = start.strftime("%Y%m%d")
+    else:
+        suffix = str(start).replace("-", "m").replace(".", "_")
+    return _name(table, suffix), "FROM (%s) TO (%s)", [start, end]
+
+
+def _name(table: str, suffix: str) -> str:
+    # Postgres truncates identifiers to 63 bytes, so cut the table instead
+    return f"{table[:62 - len(suffix) - 1]}_p{suffix}"
+
+
+def _range_bounds(value, interval):
+    """Returns [start, end) of the range partition holding value"""
+
+    assert value is not None, "Range partition keys can't be NULL"
+    if interval not in TIME_INTERVALS:
+        if isinstance(value, str):
+            value = type(interval)(value)
+        start = value // interval * interval
+        return start, start + interval
+
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if interval == "day":
+        start = value
+    elif interval == "week":
+        start = value - timedelta(days=value.weekday())
+    elif interval == "month":
+        start = value.replace(day=1)
+    else:
+        start = value.replace(month=1, day=1)
+    if isinstance(start, datetime):
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if interval == "day":
+        end = start + timedelta(days=1)
+    elif interval == "week":
+        end = start + timedelta(days=7)
+    elif interval == "month":
+        end = (start.replace(year=start.year + 1, month=1)
+               if start.month == 12 else start.replace(month=start.month + 1))
+    else:
+        end = start.replace(year=start.year + 1)
+    return start, end
+
+
+def partitions(self) -> list:
+    """Returns the [Partition] of the table, ordered by name"""
+
+    sql = """SELECT c.relname AS name,
+                    pg_get_expr(c.relpartbound, c.oid) AS bound
+          FROM pg_inherits i
+          JOIN pg_class c ON c.oid = i.inhrelid
+          WHERE i.inhparent = %s::regclass
+          ORDER BY c.relname;"""
+    return [Partition(row_value(x, "name"), row_value(x, "bound", 1))
+            for x in self.execute(sql, [self.name])]
+
+
+def _known_partitions(self) -> set:
+    """Returns the partition names this process knows of"""
+
+    key = (self._database, self.name)
+    if key not in _partitions:
+        _partitions[key] = {x.name for x in partitions(self)}
+    return _partitions[key]
+
+
+def forget_partitions(self):
+    """Drops the partitions this process has cached for the table
+
+    Call this if partitions were dropped by another process"""
+
+    _partitions.pop((self._database, self.name), None)
+    _overlaps.pop((self._database, self.name), None)
+
+
+def ensure_partitions(self, values=()) -> list:
+    """Creates the partitions that values of the key need, if missing
+
+    For hash partitioning, every partition is created instead.
+    Returns the name of each value's partition. That is the table's
+    own name for values that fall in a partition made some other way,
+    since postgres can route them"""
+
+    known = _known_partitions(self)
+    partitioning = self.partitioning
+    if partitioning.method == "hash":
+        for remainder in range(partitioning.modulus):
+            name = _name(self.name, str(remainder))
+            if name not in known:
+                _create_partition(
+                    self,
+                    name,
+                    f"WITH (MODULUS {partitioning.modulus}, "
+                    f"REMAINDER {remainder})",
+                    [])
+        return []
+
+    overlaps = _overlaps.setdefault((self._database, self.name), set())
+    names = []
+    for value in values:
+        name, bound, params = partition_for(self.name, partitioning, value)
+        if name not in known and name not in overlaps:
+            _create_partition(self, name, bound, params)
+        names.append(self.name if name in overlaps else name)
+    return names
+
+
+def partition_batches(self, rows, columns: list, route_size: int = 2 ** 16):
+    """Yields lists of route_size rows, once their partitions exist
+
+    For COPYs into the table itself, which can't create partitions
+    part way through. rows is an iterator, such as from peek_columns"""
+
+    while True:
+        batch = list(islice(rows, route_size))
+        if not batch:
+            return
+        ensure_row_partitions(self, batch, columns)
+        yield batch
+
+
+def ensure_row_partitions(self, rows: list, columns: list) -> list:
+    """ensure_partitions for the key values of rows (dicts, or sequences
+    ordered like columns)"""
+
+    key = self.partitioning.column
+    assert key in columns, f"Rows need the partition key {key}"
+    key_index = columns.index(key)
+    return ensure_partitions(self, dict.fromkeys(
+        row.get(key) if isinstance(row, dict) else row[key_index]
+        for row in rows))
+
+
+def column_partition_values(column, udt_name: str) -> list:
+    """Returns the distinct values of an array, to pass to
+    ensure_partitions. Masked values are None"""
+
+    arr = column if isinstance(column, np.ndarray) else np.asarray(column)
+    if arr.dtype.kind == "M":
+        # So tolist makes dates and datetimes rather than ints
+        arr = arr.astype("datetime64[D]" if udt_name == "date"
+                         else "datetime64[us]")
+    values = arr.compressed() if np.ma.isMaskedArray(arr) else arr
+    values = (np.unique(values) if values.dtype.kind != "O"
+              else values).tolist()
+    if np.ma.isMaskedArray(arr) and np.ma.is_masked(arr):
+        values.append(None)
+    return list(dict.fromkeys(values))
+
+
+def _create_partition(self, name: str, bound: str, params: list):
+    logging.info(f"Creating partition {name} of {self.name}")
+    try:
+        # In a savepoint, so losing a race doesn't abort a transaction
+        with self.transaction():
+            self.execute(f"CREATE TABLE IF NOT EXISTS {name} "
+                         f"PARTITION OF {self.name} FOR VALUES {bound}",
+                         params)
+    # Another process made it between the check and the create
+    except (psycopg2.errors.DuplicateTable, psycopg2.errors.UniqueViolation):
+        pass
+    # A partition made some other way, such as by hand, holds some of
+    # the values already. Rows are routed there through the table
+    except psycopg2.errors.InvalidObjectDefinition as e:
+        logging.warning(f"Not creating {name}: {e}")
+        _overlaps.setdefault((self._database, self.name), set()).add(name)
+        return
+    _known_partitions(self).add(name)
+
+
+def copy_partitioned(self,
+                     rows,
+                     columns: list = None,
+                     batch_size: int = 1000,
+                     route_size: int = 2 ** 16) -> int:
+    """COPYs rows straight into their range or list partitions
+
+    route_size rows at a time are grouped by partition, any missing
+    partitions are created, and each group is copied into its
+    partition. This skips routing each row through the parent table.
+    Returns the number of bytes sent."""
+
+    rows, columns = peek_columns(rows, columns)
+    if not columns:
+        return 0
+    key = self.partitioning.column
+    assert key in columns, f"Rows need the partition key {key}"
+    key_index = columns.index(key)
+
+    num_bytes = 0
+    while True:
+        batch = list(islice(rows, route_size))
+        if not batch:
+            return num_bytes
+        values = [row.get(key) if isinstance(row, dict) else row[key_index]
+                  for row in batch]
+        # Many rows share a value, so each is only looked up once
+        unique = list(dict.fromkeys(values))
+        names = dict(zip(unique, ensure_partitions(self, unique)))
+        groups = dict()
+        for value, row in zip(values, batch):
+            groups.setdefault(names[value], []).append(row)
+        for name, group in groups.items():
+            buf = CopyBuffer(encode_text_rows(group, columns, batch_size))
+            self._cursor.copy_expert(
+                f"COPY {name} ({','.join(columns)}) FROM STDIN", buf)
+            num_bytes += buf.bytes_read
+        self._invalidate_results([self.name])
+
+
+def old_partitions(self, before) -> list:
+    """Returns the names of range partitions that end at or before before
+
+    Such as those older than a retention period"""
+
+    assert self.partitioning.method == "range", "Only for range partitions"
+    udt_name = self.column_types[self.partitioning.column]
+    old = []
+    for partition in partitions(self):
+        match = re.search(r"TO \((.*)\)$", partition.bound)
+        # MAXVALUE and the DEFAULT partition never end
+        if not match or "MAXVALUE" in match.group(1):
+            continue
+        # The bound is a literal from pg_get_expr, so it is safe to use
+        sql = f"SELECT {match.group(1)}::{udt_name} <= %s::{udt_name} AS old"
+        if row_value(self.execute(sql, [before])[0], "old"):
+            old.append(partition.name)
+    return old
+
+
+def drop_partitions(self, names: list):
+    """Drops partitions, which is far cheaper than DELETEing their rows"""
+
+    if names:
+        logging.info(f"Dropping partitions {names} of {self.name}")
+        self.execute(f"DROP TABLE IF EXISTS {', '.join(names)}")
+        _known_partitions(self).difference_update(names)
+        self._invalidate_results([self.name])
+
+
+def detach_partitions(self, names: list, concurrently: bool = False):
+    """Detaches partitions, which then become tables of their own
+
+    With concurrently, queries on the table aren't blocked, but it
+    can't be done inside a transaction"""
+
+    for name in names:
+        logging.info(f"Detaching partition {name} of {self.name}")
+        self.execute(f"ALTER TABLE {self.name} DETACH PARTITION {name}"
+                     f"{' CONCURRENTLY' if concurrently else ''}")
+        _known_partitions(self).discard(name)
+    self._invalidate_results([self.name])
+
+
+def truncate_partitions(self, names: list):
+    """Empties partitions, keeping them"""
+
+    if names:
+        logging.info(f"Truncating partitions {names} of {self.name}")
+        self.execute(f"TRUNCATE {', '.join(names)}")
+        self._invalidate_results([self.name])
+
+
+def maintain_partitions(self,
+                        sql: str = "VACUUM (ANALYZE) {partition}",
+                        names: list = None,
+                        workers: int = None):
+    """Runs sql for each partition at the same time on new connections
+
+    {partition} in sql is replaced by each partition's name, such as
+    for VACUUM, ANALYZE, REINDEX or CLUSTER. names defaults to every
+    partition. Every partition is done before the first error is raised
+    """
+
+    names = [x.name for x in partitions(self)] if names is None else names
+    if not names:
+        return
+    workers = min(workers or os.cpu_count() or 1, len(names))
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(_run_sql,
+                                   self._conf_section,
+                                   sql.format(partition=name))
+                   for name in names]
+        errors = [x.exception() for x in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+
+
+def _run_sql(conf_section: str, sql: str):
+    """Runs sql on a new connection. Run in threads"""
+
+    with Database(conf_section) as db:
+        logging.info(f"Running {sql}")
+        db.execute(sql)
@@ -0,0 +1,210 @@
+import logging
+import os
+from threading import Condition, Lock
+from time import monotonic
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import PoolError
+
+from .postgres import Postgres
+
+
+# {(pid, conf_section): ConnectionPool}, see get_pool
+_pools = dict()
+_pools_lock = Lock()
+
+
+def get_pool(conf_section=None, **kwargs):
+    """Returns the process wide pool for a config section
+
+    The pool is made (with kwargs) the first time it is asked for.
+    Pools are keyed by pid as well so that forked children never share
+    their parent's connections. conf_section defaults to
+    Postgres.default_conf_section
+    """
+
+    conf_section = conf_section or Postgres.default_conf_section
+    key = (os.getpid(), conf_section)
+    with _pools_lock:
+        if key not in _pools:
+            creds = Postgres()._get_db_creds(conf_section)
+            _pools[key] = ConnectionPool(creds, **kwargs)
+        return _pools[key]
+
+
+def close_pools():
+    """Closes all pools in this process"""
+
+    with _pools_lock:
+        for key in [x for x in _pools if x[0] == os.getpid()]:
+            _pools.pop(key).closeall()
+
+
+class ConnectionPool:
+    """Thread safe pool of connections to one database
+
+    Semantics are like psycopg2.pool.ThreadedConnectionPool, except that
+    getconn waits for a connection to be returned instead of erroring
+    when maxconn are in use, connections that sat idle for check_after
+    seconds are checked with a SELECT 1 before being handed out, and
+    connections idle for max_idle seconds are closed (down to minconn).
+    """
+
+    def __init__(self,
+                 creds: dict,
+                 minconn: int = 1,
+                 maxconn: int = 10,
+                 timeout: float = 30,
+                 check_after: float = 30,
+                 max_idle: float = 600):
+        assert 0 <= minconn <= maxconn, "Need 0 <= minconn <= maxconn"
+        self.creds = creds
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_idle = max_idle
+        self.closed = False
+        # Stack of (conn, time returned), so the most recent is reused
+        self._idle = []
+        self._num_in_use = 0
+        self._cond = Condition()
+        self._stats = {"checkouts": 0,
+                       "waits": 0,
+                       "wait_seconds": 0.0,
+                       "timeouts": 0,
+                       "created": 0,
+                       "closed": 0,
+                       "failed_checks": 0}
+        for _ in range(minconn):
+            self._idle.append((self._new_conn(), monotonic()))
+
+    def getconn(self, timeout: float = None):
+        """Checks out a connection, waiting up to timeout seconds"""
+
+        timeout = self.timeout if timeout is None else timeout
+        start = monotonic()
+        waited = False
+        while True:
+            with self._cond:
+                assert not self.closed, "Pool is closed"
+                while not self._idle and self._size() >= self.maxconn:
+                    remaining = timeout - (monotonic() - start)
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolError(f"No connection in {timeout}s")
+                    waited = True
+                    self._cond.wait(remaining)
+                # Reserve the slot so others don't go over maxconn
+                self._num_in_use += 1
+                conn, returned_at = (self._idle.pop() if self._idle
+                                     else (None, None))
+            try:
+                if conn is None:
+                    conn = self._new_conn()
+                elif not self._healthy(conn, returned_at):
+                    self._release(conn, close=True)
+                    continue
+            except BaseException:
+                self._release(None)
+                raise
+            with self._cond:
+                self._stats["checkouts"] += 1
+                if waited:
+                    self._stats["waits"] += 1
+                    self._stats["wait_seconds"] += monotonic() - start
+            return conn
+
+    def putconn(self, conn, close: bool = False):
+        """Returns a connection, rolling back anything left open"""
+
+        if not (close or conn.closed or self.closed):
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.autocommit = True
+            except psycopg2.Error:
+                close = True
+        self._release(conn, close=close or self.closed)
+
+    def closeall(self):
+        """Closes idle connections. In use ones close when returned"""
+
+        with self._cond:
+            self.closed = True
+            while self._idle:
+                self._close(self._idle.pop()[0])
+            self._cond.notify_all()
+
+    @property
+    def stats(self) -> dict:
+        """Returns counters and current sizes, for monitoring"""
+
+        with self._cond:
+            return {**self._stats,
+                    "in_use": self._num_in_use,
+                    "idle": len(self._idle),
+                    "size": self._size()}
+
+    def _size(self) -> int:
+        return self._num_in_use + len(self._idle)
+
+    def _new_conn(self):
+        conn = psycopg2.connect(**self.creds)
+        # Like Database, so health checks don't open transactions
+        conn.autocommit = True
+        logging.debug("Pool connection created")
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _healthy(self, conn, returned_at: float) -> bool:
+        """Checks connections that were idle for check_after seconds"""
+
+        if conn.closed:
+            healthy = False
+        elif monotonic() - returned_at < self.check_after:
+            healthy = True
+        else:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                healthy = True
+            except psycopg2.Error:
+                healthy = False
+        if not healthy:
+            logging.debug("Pool connection failed health check")
+            with self._cond:
+                self._stats["failed_checks"] += 1
+        return healthy
+
+    def _release(self, conn, close: bool = False):
+        """Frees the slot of a checked out connection"""
+
+        with self._cond:
+            self._num_in_use -= 1
+            if conn is not None:
+                if close or conn.closed:
+                    self._close(conn)
+                else:
+                    self._idle.append((conn, monotonic()))
+            self._evict_idle()
+            self._cond.notify()
+
+    def _evict_idle(self):
+        """Closes connections idle too long. Must hold the lock"""
+
+        now = monotonic()
+        # The oldest connections are at the bottom of the stack
+        while (self._idle
+               and self._size() > self.minconn
+               and now - self._idle[0][1] > self.max_idle):
+            self._close(self._idle.pop(0)[0])
+
+    def _close(self, conn):
+        """Closes a connection. Must hold the lock"""
+
+        if not conn.closed:
+            conn.close()
+        self._stats["closed"] += 1
@@ -1,2 +1,3 @@
 from .postgres import Postgres
 from .postgres_defaults import DEFAULT_CONF_SECTION
+from .postgres_tuning import TUNING_PROFILES
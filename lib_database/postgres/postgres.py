@@ -2,6 +2,7 @@ import logging
 from multiprocessing import cpu_count
 from subprocess import check_output, CalledProcessError
 
+import psycopg2
 from psutil import virtual_memory
 
 from lib_config import Config
@@ -15,16 +16,23 @@ class Postgres:
     # Defaults
     from .postgres_defaults import default_conf_section
     from .postgres_defaults import default_db_kwargs
+    from .postgres_defaults import default_admin_creds
 
     # Create database
-    def create_database(self, conf_section=DEFAULT_CONF_SECTION, **kwargs):
-        """Writes database entry in config. Creates database. Modifies db"""
+    def create_database(self,
+                        conf_section=DEFAULT_CONF_SECTION,
+                        profile="bulk_load",
+                        **kwargs):
+        """Writes database entry in config. Creates database. Modifies db
+
+        profile is the workload to tune for, see _modify_db"""
 
         database = kwargs.get("database", self.default_db_kwargs["database"])
         self.drop_database(database)
         self._write_db_conf(conf_section, **kwargs)
         self._init_db(**self._get_db_creds(conf_section))
-        self._modify_db(db=self._get_db_creds(conf_section)["database"])
+        self._modify_db(db=self._get_db_creds(conf_section)["database"],
+                        profile=profile)
 
     # Create database helpers
     from .postgres_create_db import _write_db_conf
@@ -34,6 +42,21 @@ class Postgres:
     from .postgres_create_db import _get_ram
     from .postgres_create_db import _get_ulimit
 
+    # Workload profiles
+    from .postgres_tuning import _tuning_diff
+
+    # Superuser session
+    from .postgres_admin import run_sql_session
+    from .postgres_admin import _admin_connect
+
+    # Template databases
+    from .postgres_templates import create_template
+    from .postgres_templates import clone_database
+    from .postgres_templates import drop_clone
+    from .postgres_templates import drop_template
+    from .postgres_templates import _write_clone_conf
+    from .postgres_templates import _drop_db_connections
+
     @staticmethod
     def restart_postgres():
         logging.info("Restarting Postgres")
@@ -44,8 +67,13 @@ class Postgres:
         """Drops all databases that exist"""
 
         sql = "SELECT datname FROM pg_database WHERE datistemplate = false;"
-        databases = check_output(self._get_sql_bash(sql), shell=True)
-        databases = databases.decode().split("\n")[2:-3]
+        results = self.run_sql_session([sql])
+        if results is not None:
+            databases = [x["datname"] for x in results[0]]
+        else:
+            # Only psql's output is left to go on
+            databases = check_output(self._get_sql_bash(sql), shell=True)
+            databases = databases.decode().split("\n")[2:-3]
         for database in databases:
             if "postgres" not in database:
                 self.drop_database(database.strip())
@@ -56,9 +84,9 @@ class Postgres:
         try:
             self._terminate_db_connections(db_name)
         # This happens every time a conn is closed, so we ignore
-        except CalledProcessError as e:
+        except (CalledProcessError, psycopg2.Error) as e:
             pass
-        self.run_sql_cmds([f"DROP DATABASE IF EXISTS {db_name};"])
+        self.run_sql_session([f"DROP DATABASE IF EXISTS {db_name};"])
         self._remove_db_from_config(db_name)
 
     def _terminate_db_connections(self, db_name: str):
@@ -67,7 +95,7 @@ class Postgres:
         sql1 = f"REVOKE CONNECT ON DATABASE {db_name} FROM PUBLIC;"
         sql2 = f"""select pg_terminate_backend(pid)
                 from pg_stat_activity where datname='{db_name}';"""
-        self.run_sql_cmds([sql1, sql2])
+        self.run_sql_session([sql1, sql2])
 
 
     def _remove_db_from_config(self, db):
@@ -87,7 +115,9 @@ class Postgres:
                 del conf_dict[section_to_delete]
 
     def run_sql_cmds(self, sqls: list, database=None):
-        """Runs SQL commands"""
+        """Runs SQL commands, each with its own psql subprocess
+
+        run_sql_session is much faster, and falls back to this"""
 
         assert isinstance(sqls, list), "Must be a list of SQL commands"
         for sql in sqls:
@@ -0,0 +1,75 @@
+import logging
+import os
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from lib_config import Config
+
+from .postgres_defaults import ADMIN_CONF_SECTION
+
+
+# pids that have warned about no superuser connection, so each
+# process warns once rather than on every bulk_insert_tsv
+_warned_pids = set()
+
+
+def run_sql_session(self, sqls: list, database=None):
+    """Runs SQL commands in one superuser session. Returns their rows
+
+    Each statement runs on its own in autocommit, so statements that
+    can't be in a transaction (CREATE DATABASE, ALTER SYSTEM) work.
+    Returns a list with the rows of each statement ([] if none).
+
+    If there is no way to connect as a superuser, falls back to
+    run_sql_cmds (a psql subprocess per statement) and returns None.
+    Like run_sql_cmds, each statement must end with a ;
+    """
+
+    assert isinstance(sqls, list), "Must be a list of SQL commands"
+    for sql in sqls:
+        assert sql[-1] == ";", f"{sql} statement has no ;"
+    try:
+        conn = self._admin_connect(database)
+    except psycopg2.OperationalError as e:
+        msg = f"No superuser connection ({e}), using psql"
+        if os.getpid() in _warned_pids:
+            logging.debug(msg)
+        else:
+            _warned_pids.add(os.getpid())
+            logging.warning(msg)
+        self.run_sql_cmds(sqls, database=database)
+        return None
+
+    results = []
+    try:
+        with conn.cursor() as cursor:
+            for sql in sqls:
+                try:
+                    cursor.execute(sql)
+                except psycopg2.Error:
+                    logging.error(f"Failed to run {sql}")
+                    raise
+                results.append(cursor.fetchall() if cursor.description
+                               else [])
+    finally:
+        conn.close()
+    return results
+
+
+def _admin_connect(self, database=None):
+    """Connects as a superuser
+
+    Uses the admin section of the config if there is one, otherwise
+    the postgres user over the local socket (peer/trust auth)."""
+
+    with Config(write=False) as conf_dict:
+        if ADMIN_CONF_SECTION in conf_dict:
+            creds = dict(conf_dict[ADMIN_CONF_SECTION])
+        else:
+            creds = dict(self.default_admin_creds)
+    if database:
+        creds["database"] = database
+    conn = psycopg2.connect(cursor_factory=RealDictCursor, **creds)
+    conn.autocommit = True
+    return conn
@@ -8,6 +8,7 @@ from lib_config import Config
 from lib_utils import file_funcs
 
 from .postgres_defaults import DEFAULT_CONF_SECTION
+from .postgres_tuning import TUNING_PROFILES
 
 def _write_db_conf(self, conf_section, **kwargs): 
     """Writes database information in config"""
@@ -49,65 +50,53 @@ def _init_db(self, user=None, database=None, host=None, password=None):
             f"ALTER USER {user} WITH PASSWORD '{password}';",
             f"ALTER USER {user} WITH SUPERUSER;"]
 
-    self.run_sql_cmds(sqls)
+    self.run_sql_session(sqls)
     file_funcs.delete_paths("/var/lib/postgresql.psql_history")
 
-def _modify_db(self, db=None, ram=None, cpus=cpu_count() - 1, ssd=True):
-    """Modifies database for speed.
-
-    The database will be corrupted if there is a crash. These changes
-    work at a cluster level, so all databases will be changed. This is
-    also meant to maximize the database for the server, so other things
-    will run slower and have less RAM/cache.
+def _modify_db(self,
+               db=None,
+               ram=None,
+               cpus=cpu_count() - 1,
+               ssd=True,
+               profile="bulk_load",
+               dry_run=False):
+    """Modifies database settings for a workload. Returns what changed
+
+    profile is a name in TUNING_PROFILES (bulk_load, olap, oltp, shared)
+    or a func like them. The default, bulk_load, is for speed, and the
+    database will be corrupted if there is a crash. These changes
+    work at a cluster level, so all databases will be changed.
+
+    Settings are compared to pg_settings, and only those that differ
+    are set. Returns [{name, current, new, restart}] of those. With
+    dry_run nothing is changed. Postgres is only restarted if a changed
+    setting needs it, otherwise the config is reloaded.
     """
 
-    logging.info("Modifying db for speed")
     ram = ram if ram else self._get_ram()
-    random_page_cost = 1 if ssd else 2
-
-    sqls = [f"ALTER DATABASE {db} SET timezone TO 'UTC';",
-            # These are settings that ensure data isn't corrupted in
-            # the event of a crash. We don't care so...
-            "ALTER SYSTEM SET fsync TO off;",
-            "ALTER SYSTEM SET synchronous_commit TO off;",
-            "ALTER SYSTEM SET full_page_writes TO off;",
-
-            # Allows for parallelization
-            f"ALTER SYSTEM SET max_parallel_workers_per_gather TO {cpus};",
-            f"ALTER SYSTEM SET max_parallel_workers TO {cpus};",
-            f"ALTER SYSTEM SET max_worker_processes TO {cpu_count() * 2};",
-
-            # Writes as few logs as possible
-            "ALTER SYSTEM SET wal_level TO minimal;",
-            "ALTER SYSTEM SET archive_mode TO off;",
-            "ALTER SYSTEM SET max_wal_senders TO 0;",
-
-            # https://www.postgresql.org/docs/current/
-            # runtime-config-resource.html
-            # https://dba.stackexchange.com/a/18486
-            # https://severalnines.com/blog/
-            # setting-optimal-environment-postgresql
-            # Buffers for postgres, set to 40%, and no more
-            f"ALTER SYSTEM SET shared_buffers TO '{int(.4 * ram)}MB';",
-            # Memory per process, since 11 paralell gathers and
-            # some for vacuuming, set to ram/(1.5*cores)
-            "ALTER SYSTEM SET work_mem TO "
-            f"'{int(ram / (cpu_count() * 1.5))}MB';",
-            # Total cache postgres has, ignore shared buffers
-            f"ALTER SYSTEM SET effective_cache_size TO '{ram}MB';",
-            # Set random page cost to 2 if no ssd, with ssd
-            # seek time is one for ssds
-            f"ALTER SYSTEM SET random_page_cost TO {random_page_cost};",
-            # Yes I know I could call this, but this is just for machines
-            # that might not have it or whatever
-            # Gets the maximum safe depth of a servers execution stack
-            # in kilobytes from ulimit -s
-            # https://www.postgresql.org/docs/9.1/runtime-config-resource.html
-            # Subtract one megabyte for safety
-            "ALTER SYSTEM SET max_stack_depth TO "
-            f"'{self._get_ulimit() - 1000}kB';"]
-    self.run_sql_cmds(sqls)
-    self.restart_postgres()
+    if not callable(profile):
+        assert profile in TUNING_PROFILES, f"No tuning profile {profile}"
+        profile = TUNING_PROFILES[profile]
+    logging.info(f"Modifying db for the {profile.__name__} profile")
+    settings = profile(self, ram, cpus, ssd)
+
+    changes = self._tuning_diff(settings)
+    for change in changes:
+        logging.info(f"{change['name']}: {change['current']} -> "
+                     f"{change['new']}"
+                     + (" (needs restart)" if change["restart"] else ""))
+    if dry_run:
+        return changes
+
+    sqls = [f"ALTER DATABASE {db} SET timezone TO 'UTC';"] if db else []
+    sqls += [f"ALTER SYSTEM SET {x['name']} TO '{x['new']}';"
+             for x in changes]
+    if any(x["restart"] for x in changes):
+        self.run_sql_session(sqls)
+        self.restart_postgres()
+    else:
+        self.run_sql_session(sqls + ["SELECT pg_reload_conf();"])
+    return changes
 
 def _get_ram(self):
     # Returns RAM in megabytes
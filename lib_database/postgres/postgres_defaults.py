@@ -5,3 +5,9 @@ default_conf_section = DEFAULT_CONF_SECTION
 default_db_kwargs = {"host": "localhost",
                      "database": "main",
                      "password": "notsecure"}
+
+# Config section with superuser creds for run_sql_session
+ADMIN_CONF_SECTION = "postgres_admin"
+
+# Without that section, connect as postgres over the local socket
+default_admin_creds = {"user": "postgres", "database": "postgres"}
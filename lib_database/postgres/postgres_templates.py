@@ -0,0 +1,118 @@
+from itertools import count
+import logging
+import os
+from subprocess import CalledProcessError
+
+import psycopg2
+
+from lib_config import Config
+
+
+_clone_ids = count()
+
+
+def create_template(self,
+                    template: str,
+                    conf_section=None,
+                    source: str = None,
+                    setup=None):
+    """Creates a database to clone others from with clone_database
+
+    The template is made from source (by default template1), and
+    written in the config like a clone of conf_section. setup, if
+    given, is called with the template's conf section to fill it, such
+    as with tables. Then its connections are closed, and it is marked
+    as a template that can't be connected to, so clones can be made.
+    """
+
+    self.drop_template(template)
+    self.run_sql_session([f"CREATE DATABASE {template}"
+                          + (f" TEMPLATE {source};" if source else ";")])
+    self._write_clone_conf(template, conf_section)
+    if setup:
+        setup(template)
+    self._drop_db_connections(template)
+    self.run_sql_session([f"ALTER DATABASE {template} "
+                          "WITH IS_TEMPLATE true ALLOW_CONNECTIONS false;"])
+    logging.info(f"Created template {template}")
+
+
+def clone_database(self,
+                   template: str,
+                   database: str = None,
+                   conf_section=None,
+                   strategy: str = None) -> str:
+    """Creates a database as a copy of a template. Returns its conf section
+
+    CREATE DATABASE ... TEMPLATE copies files, so this takes
+    milliseconds rather than rerunning a setup. The database (by
+    default a unique name) is written in the config with the creds
+    of conf_section. strategy can be WAL_LOG or FILE_COPY (postgres
+    15+), see CREATE DATABASE. Drop it with drop_clone.
+    """
+
+    if database is None:
+        # Postgres truncates identifiers to 63 bytes
+        database = f"{template[:40]}_{os.getpid()}_{next(_clone_ids)}"
+    sql = f"CREATE DATABASE {database} TEMPLATE {template}"
+    if strategy:
+        sql += f" STRATEGY {strategy}"
+    self.run_sql_session([sql + ";"])
+    self._write_clone_conf(database, conf_section)
+    return database
+
+
+def drop_clone(self, database: str):
+    """Drops a database, closing only its own connections
+
+    Removes it from the config as well"""
+
+    self._drop_db_connections(database, drop=True)
+    self._remove_db_from_config(database)
+
+
+def drop_template(self, template: str):
+    """Drops a template made by create_template, if it exists"""
+
+    # Checked in the same statement, since the psql fallback of
+    # run_sql_session returns no rows. The body is quoted with '
+    # rather than $$, which bash would expand in the psql command
+    self.run_sql_session(["DO 'BEGIN IF EXISTS (SELECT 1 FROM pg_database "
+                          f"WHERE datname = ''{template}'') THEN "
+                          f"ALTER DATABASE {template} WITH IS_TEMPLATE false; "
+                          "END IF; END';"])
+    self.drop_clone(template)
+
+
+def _write_clone_conf(self, database: str, conf_section=None):
+    """Writes a config section named database, with conf_section's creds"""
+
+    creds = self._get_db_creds(conf_section or self.default_conf_section)
+    with Config(write=True) as conf_dict:
+        conf_dict[database] = {}
+        for k, v in creds.items():
+            conf_dict[database][k] = v
+        conf_dict[database]["database"] = database
+
+
+def _drop_db_connections(self, database: str, drop: bool = False):
+    """Closes the connections to one database, and optionally drops it
+
+    Other databases' connections are left alone. DROP DATABASE ...
+    WITH (FORCE) does both at once on postgres 13+"""
+
+    if drop:
+        try:
+            self.run_sql_session([f"DROP DATABASE IF EXISTS {database} "
+                                  "WITH (FORCE);"])
+            return
+        # Older postgres, so terminate them first. Through psql (see
+        # run_sql_session) the error is the subprocess failing instead
+        except (psycopg2.errors.SyntaxError, CalledProcessError):
+            pass
+    self.run_sql_session(["SELECT pg_terminate_backend(pid) "
+                          "FROM pg_stat_activity "
+                          f"WHERE datname = '{database}' "
+                          "AND pid <> pg_backend_pid();"]
+                         + ([f"DROP DATABASE IF EXISTS {database};"]
+                            if drop else []))
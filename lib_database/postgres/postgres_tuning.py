@@ -0,0 +1,227 @@
+"""Workload profiles for _modify_db
+
+Each profile is a func of (self, ram, cpus, ssd) that returns
+{setting: value} for ALTER SYSTEM, where ram is in MB. Add more to
+TUNING_PROFILES, or pass a func as the profile, to plug in your own.
+"""
+
+import math
+import re
+from multiprocessing import cpu_count
+
+
+def bulk_load(self, ram, cpus, ssd) -> dict:
+    """Maximum load speed. The database is corrupted if there is a crash"""
+
+    return {**_common(self, ram, cpus, ssd),
+            # These are settings that ensure data isn't corrupted in
+            # the event of a crash. We don't care so...
+            "fsync": "off",
+            "synchronous_commit": "off",
+            "full_page_writes": "off",
+
+            # Allows for parallelization
+            "max_parallel_workers_per_gather": cpus,
+            "max_parallel_workers": cpus,
+            "max_parallel_maintenance_workers": cpus,
+
+            # Writes as few logs as possible
+            "wal_level": "minimal",
+            "archive_mode": "off",
+            "max_wal_senders": 0,
+            # Few checkpoints while loading
+            "max_wal_size": "16GB",
+            "checkpoint_timeout": "30min",
+
+            # Buffers for postgres, set to 40%, and no more
+            "shared_buffers": _mb(.4 * ram),
+            # Memory per process, since 11 paralell gathers and
+            # some for vacuuming, set to ram/(1.5*cores)
+            "work_mem": _mb(ram / (cpu_count() * 1.5)),
+            # Index builds after loads. Over 2GB is not used
+            "maintenance_work_mem": _mb(min(.1 * ram, 2047)),
+            # Total cache postgres has, ignore shared buffers
+            "effective_cache_size": _mb(ram),
+            # Let autovacuum catch up quickly after loads
+            "autovacuum_vacuum_cost_limit": 2000}
+
+
+def olap(self, ram, cpus, ssd) -> dict:
+    """Read heavy analytics: big sorts and hashes, parallel scans"""
+
+    return {**_safe(self, ram, cpus, ssd),
+            "max_parallel_workers_per_gather": max(cpus // 2, 1),
+            "max_parallel_workers": cpus,
+            "max_parallel_maintenance_workers": max(cpus // 2, 1),
+            "max_wal_size": "4GB",
+            "checkpoint_timeout": "15min",
+            "shared_buffers": _mb(.25 * ram),
+            # Few concurrent queries, each with large sorts
+            "work_mem": _mb(.25 * ram / (cpu_count() * 2)),
+            "maintenance_work_mem": _mb(min(.05 * ram, 2047)),
+            "effective_cache_size": _mb(.75 * ram),
+            "default_statistics_target": 500,
+            "jit": "on"}
+
+
+def oltp(self, ram, cpus, ssd) -> dict:
+    """Many small concurrent transactions"""
+
+    return {**_safe(self, ram, cpus, ssd),
+            "max_parallel_workers_per_gather": min(2, cpus),
+            "max_parallel_workers": cpus,
+            "max_parallel_maintenance_workers": min(2, cpus),
+            "max_wal_size": "2GB",
+            "checkpoint_timeout": "10min",
+            "shared_buffers": _mb(.25 * ram),
+            # Split across the default 100 connections
+            "work_mem": _mb(.25 * ram / 100),
+            "maintenance_work_mem": _mb(min(.05 * ram, 1024)),
+            "effective_cache_size": _mb(.75 * ram),
+            # Keep up with many updates
+            "autovacuum_naptime": "15s",
+            "autovacuum_vacuum_scale_factor": .05,
+            "autovacuum_analyze_scale_factor": .02,
+            # Short queries don't gain from JIT compilation
+            "jit": "off"}
+
+
+def shared(self, ram, cpus, ssd) -> dict:
+    """A host where postgres must leave room for other programs"""
+
+    return {**_safe(self, ram, cpus, ssd),
+            "max_parallel_workers_per_gather": min(2, max(cpus // 2, 1)),
+            "max_parallel_workers": max(cpus // 2, 1),
+            "max_parallel_maintenance_workers": min(2, max(cpus // 2, 1)),
+            "max_wal_size": "1GB",
+            "checkpoint_timeout": "5min",
+            "shared_buffers": _mb(.1 * ram),
+            "work_mem": _mb(.05 * ram / cpu_count()),
+            "maintenance_work_mem": _mb(min(.025 * ram, 512)),
+            "effective_cache_size": _mb(.25 * ram)}
+
+
+TUNING_PROFILES = {"bulk_load": bulk_load,
+                   "olap": olap,
+                   "oltp": oltp,
+                   "shared": shared}
+
+
+def _tuning_diff(self, settings: dict) -> list:
+    """Returns [{name, current, new, restart}] of settings that differ
+
+    restart is True for settings only read at server start. If
+    pg_settings can't be read, every setting is returned as changed,
+    needing a restart."""
+
+    sql = ("SELECT name, setting, unit, vartype, context FROM pg_settings"
+           " WHERE name IN ({});".format(
+               ", ".join(f"'{x}'" for x in settings)))
+    results = self.run_sql_session([sql])
+    if results is None:
+        return [{"name": name, "current": None, "new": value,
+                 "restart": True} for name, value in settings.items()]
+
+    current = {x["name"]: x for x in results[0]}
+    changes = []
+    for name, value in settings.items():
+        assert name in current, f"{name} is not a postgres setting"
+        if setting_changed(value, current[name]):
+            row = current[name]
+            changes.append({"name": name,
+                            "current": row["setting"] + (row["unit"] or ""),
+                            "new": value,
+                            "restart": row["context"] == "postmaster"})
+    return changes
+
+
+def _common(self, ram, cpus, ssd) -> dict:
+    """Settings for every profile"""
+
+    return {"max_worker_processes": cpu_count() * 2,
+            # Set random page cost to 2 if no ssd, with ssd
+            # seek time is one for ssds
+            "random_page_cost": 1 if ssd else 2,
+            "effective_io_concurrency": 200 if ssd else 2,
+            "checkpoint_completion_target": .9,
+            # Gets the maximum safe depth of a servers execution stack
+            # in kilobytes from ulimit -s
+            # https://www.postgresql.org/docs/9.1/runtime-config-resource.html
+            # Subtract one megabyte for safety
+            "max_stack_depth": f"{self._get_ulimit() - 1000}kB",
+            "autovacuum": "on"}
+
+
+def _safe(self, ram, cpus, ssd) -> dict:
+    """Crash safe settings, undoing what bulk_load turns off"""
+
+    return {**_common(self, ram, cpus, ssd),
+            "fsync": "on",
+            "synchronous_commit": "on",
+            "full_page_writes": "on",
+            "wal_level": "replica",
+            "max_wal_senders": 10,
+            "autovacuum_vacuum_cost_limit": -1}
+
+
+def _mb(megabytes) -> str:
+    return f"{max(int(megabytes), 1)}MB"
+
+
+# Multipliers to the base units of pg_settings
+_UNITS = {"B": 1,
+          "kB": 1024,
+          "MB": 1024 ** 2,
+          "GB": 1024 ** 3,
+          "TB": 1024 ** 4,
+          "us": .001,
+          "ms": 1,
+          "s": 1000,
+          "min": 60 * 1000,
+          "h": 60 * 60 * 1000,
+          "d": 24 * 60 * 60 * 1000}
+_NUMBER_AND_UNIT = re.compile(r"^\s*(-?[\d.]+)\s*([a-zA-Z]*)\s*$")
+
+
+def setting_changed(value, current: dict) -> bool:
+    """Returns True if value differs from a pg_settings row
+
+    Handles units, so '1GB' matches a shared_buffers setting of 131072
+    (8kB pages), and booleans such as on/true"""
+
+    value = str(value).strip().strip("'")
+    if current["vartype"] == "bool":
+        return _to_bool(value) != _to_bool(current["setting"])
+    elif current["vartype"] in ("integer", "real"):
+        unit_size = _unit_size(current["unit"])
+        match = _NUMBER_AND_UNIT.match(value)
+        if not match:
+            return True
+        number, unit = match.groups()
+        new = float(number) * (_UNITS[unit] if unit else unit_size)
+        old = float(current["setting"]) * unit_size
+        if current["vartype"] == "real":
+            return not math.isclose(new, old, rel_tol=1e-6, abs_tol=1e-12)
+        elif current["unit"]:
+            # Postgres rounds to its unit, such as 8kB pages
+            return abs(new - old) >= unit_size
+        else:
+            return new != old
+    else:
+        return value.lower() != current["setting"].lower()
+
+
+def _unit_size(unit) -> float:
+    """Returns the size of a pg_settings unit, such as 8kB"""
+
+    if not unit:
+        return 1
+    elif unit[0].isdigit():
+        number, unit = _NUMBER_AND_UNIT.match(unit).groups()
+        return float(number) * _UNITS[unit]
+    else:
+        return _UNITS[unit]
+
+
+def _to_bool(value: str) -> bool:
+    return value.lower() in ("on", "true", "yes", "1", "t", "y")
@@ -0,0 +1,307 @@
+from collections import OrderedDict
+import copy
+import re
+from threading import Lock
+import time
+from weakref import WeakSet
+
+from .rows import TupleCursor
+from .statement_cache import first_word, normalize
+
+
+# Statements that never change a table
+_READS = {"SELECT", "SHOW", "EXPLAIN", "VALUES", "TABLE", "SET", "RESET",
+          "BEGIN", "START", "COMMIT", "END", "ROLLBACK", "SAVEPOINT",
+          "RELEASE", "PREPARE", "DEALLOCATE", "LISTEN", "NOTIFY"}
+# Tables written by a statement
+_WRITE_TABLES = re.compile(
+    r"\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|MERGE\s+INTO|COPY|TRUNCATE"
+    r"(?:\s+TABLE)?|(?:ALTER|DROP)\s+TABLE(?:\s+IF\s+EXISTS)?"
+    r"|INTO(?:\s+TEMP(?:ORARY)?|\s+UNLOGGED)?(?:\s+TABLE)?)"
+    r"\s+(?:ONLY\s+)?([\w.\"]+(?:\s*,\s*[\w.\"]+)*)", re.IGNORECASE)
+
+_KEYWORDS = (r"(?:WHERE|GROUP|ORDER|LIMIT|OFFSET|HAVING|WINDOW|UNION"
+             r"|INTERSECT|EXCEPT|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|NATURAL"
+             r"|ON|USING|FOR|FETCH|TABLESAMPLE)\b")
+_ITEM = rf"[\w.\"]+(?:\s+(?:AS\s+)?(?!{_KEYWORDS})\w+)?"
+# Tables read by a query, including comma joins
+_READ_TABLES = re.compile(rf"\b(?:FROM|JOIN)\s+(?:ONLY\s+|LATERAL\s+)?"
+                          rf"({_ITEM}(?:\s*,\s*{_ITEM})*)", re.IGNORECASE)
+_FROM = re.compile(r"\bFROM\b", re.IGNORECASE)
+_AFTER_COMMA = re.compile(r",\s*(?:ONLY\s+|LATERAL\s+)?([\w.\"]+)",
+                          re.IGNORECASE)
+# Queries whose results can change without a write, or that lock rows
+_UNCACHEABLE = re.compile(r"\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY)\b"
+                          r"|\bINTO\b|\b(?:nextval|setval|random|now"
+                          r"|clock_timestamp|statement_timestamp|txid_\w+"
+                          r"|pg_\w+)\s*\(|\bcurrent_(?:timestamp|date|time)"
+                          r"\b", re.IGNORECASE)
+
+# SELECT ... INTO makes a table
+_INTO = re.compile(r"\bINTO\b", re.IGNORECASE)
+
+# Every ResultCache, so writes invalidate all of them
+_caches = WeakSet()
+_default_cache = None
+_default_lock = Lock()
+
+
+def get_result_cache(**kwargs):
+    """Returns the process wide ResultCache
+
+    It is made (with kwargs) the first time it is asked for. This is
+    the cache of Database(result_cache=True)"""
+
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache(**kwargs)
+        return _default_cache
+
+
+def invalidate_results(database: str = None, tables: list = None):
+    """Drops cached results of tables (or all) in database (or all)"""
+
+    for cache in list(_caches):
+        cache.invalidate(database, tables)
+
+
+def tables_written(sql: str):
+    """Returns the tables a statement writes
+
+    [] for reads, and None when they can't be found (such as for DO
+    or CALL), which means any table might have been written"""
+
+    word = first_word(sql)
+    if word in _READS and (word != "SELECT" or not _INTO.search(sql)):
+        return []
+    tables = [_table_name(name)
+              for names in _WRITE_TABLES.findall(sql)
+              for name in names.split(",")]
+    # Writes in a WITH are INSERT/UPDATE/DELETE, which are found above
+    return tables if tables or word == "WITH" else None
+
+
+def invalidate_results_for_sql(database: str, sql: str):
+    """Drops cached results of the tables a statement writes
+
+    Returns those tables, like tables_written"""
+
+    if not _caches:
+        return []
+    tables = tables_written(sql)
+    if tables != []:
+        invalidate_results(database, tables)
+    return tables
+
+
+def tables_read(sql: str) -> list:
+    """Returns the tables a query reads from
+
+    Names after commas past the first FROM are included too, so that
+    comma joins after a JOIN ... ON aren't missed. Extra names only
+    mean extra invalidations"""
+
+    tables = [_table_name(item.split()[0])
+              for items in _READ_TABLES.findall(sql)
+              for item in items.split(",")]
+    match = _FROM.search(sql)
+    if match:
+        tables.extend(_table_name(x)
+                      for x in _AFTER_COMMA.findall(sql, match.end()))
+    return list(dict.fromkeys(tables))
+
+
+def base_tables(db, tables: list) -> list:
+    """Returns tables along with the tables under any views among them
+
+    Views are followed (through pg_rewrite and pg_depend) down to the
+    tables they read, so writes to those drop results of the views"""
+
+    if not tables:
+        return tables
+    sql = """WITH RECURSIVE deps(oid) AS (
+                SELECT oid FROM pg_class WHERE relname = ANY(%s)
+                UNION
+                SELECT d.refobjid
+                FROM deps
+                JOIN pg_rewrite r ON r.ev_class = deps.oid
+                JOIN pg_depend d
+                    ON d.classid = 'pg_rewrite'::regclass
+                    AND d.objid = r.oid
+                    AND d.refclassid = 'pg_class'::regclass
+                    AND d.refobjid <> deps.oid)
+             SELECT DISTINCT c.relname
+             FROM deps JOIN pg_class c ON c.oid = deps.oid;"""
+    with db._conn.cursor(cursor_factory=TupleCursor) as cursor:
+        cursor.execute(sql, [list(tables)])
+        found = [x[0] for x in cursor.fetchall()]
+    return list(dict.fromkeys(list(tables) + found))
+
+
+def _table_name(name: str) -> str:
+    # Without the schema or quotes, as GenericTable.name would be
+    return name.strip().split(".")[-1].strip('"')
+
+
+class ResultCache:
+    """Thread safe LRU cache of SELECT results, with TTLs
+
+    Pass one (or True for the process wide one) as
+    Database(result_cache=...), and that Database's SELECTs run in
+    autocommit are cached, keyed by (database, cursor_factory,
+    normalized SQL, params). Queries with FOR UPDATE/SHARE, INTO or
+    volatile functions (such as now()) are never cached.
+
+    Any write through this library (execute, insert, bulk inserts,
+    clear_table...) drops the entries of the tables it writes, in every
+    cache of this process, including entries of views over those tables
+    (see base_tables). Writes made elsewhere (other processes, or
+    functions called by a SELECT) are only seen once entries expire
+    after ttl seconds. Cached rows are copied on the way out, so
+    callers can't change them.
+    """
+
+    def __init__(self, capacity: int = 1024, ttl: float = 60):
+        assert capacity > 0, "Capacity must be positive"
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # Bumped by every invalidation, see execute
+        self._generation = 0
+        self._lock = Lock()
+        # {key: (expires at, [(database, table)], rows)}
+        self._entries = OrderedDict()
+        # {(database, table): {keys}}
+        self._keys_by_table = dict()
+        _caches.add(self)
+
+    def execute(self, db, sql: str, data) -> list:
+        """Returns the cached rows of a query, or runs and caches it"""
+
+        key = self._key(db, sql, data)
+        if key is None:
+            return db._run(sql, data)
+        with self._lock:
+            rows = self._get(key)
+            generation = self._generation
+        if rows is not None:
+            return _copy_rows(rows)
+
+        rows = db._run(sql, data)
+        tables = [(db._database, x)
+                  for x in base_tables(db, tables_read(sql))]
+        with self._lock:
+            # A write while the query ran could have made the rows stale
+            if generation == self._generation:
+                self._put(key, tables, _copy_rows(rows))
+        return rows
+
+    def invalidate(self, database: str = None, tables: list = None):
+        """Drops entries of tables (or all) in database (or all)"""
+
+        with self._lock:
+            self._generation += 1
+            if database is None and tables is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self._keys_by_table.clear()
+                return
+            for table_key in list(self._keys_by_table):
+                if ((database is None or table_key[0] == database)
+                        and (tables is None or table_key[1] in tables)):
+                    for key in self._keys_by_table.pop(table_key):
+                        self.invalidations += key in self._entries
+                        self._remove(key)
+            if tables is None:
+                # Entries that read no known table, such as SELECT 1
+                for key in [x for x in self._entries if x[0] == database]:
+                    self.invalidations += 1
+                    self._remove(key)
+
+    def clear(self):
+        self.invalidate()
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations,
+                    "invalidations": self.invalidations,
+                    "size": len(self._entries),
+                    "capacity": self.capacity}
+
+    @staticmethod
+    def _key(db, sql: str, data):
+        """Returns the key of a query, or None if it can't be cached"""
+
+        if (first_word(sql) != "SELECT"
+                or not db._conn.autocommit
+                or _UNCACHEABLE.search(sql)):
+            return None
+        try:
+            params = _freeze(data)
+            hash(params)
+        except TypeError:
+            return None
+        return (db._database, db._conn.cursor_factory, normalize(sql), params)
+
+    def _get(self, key):
+        """Returns the rows of key, or None. Call with the lock held"""
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            self.expirations += 1
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def _put(self, key, tables: list, rows: list):
+        """Adds an entry, evicting the oldest. Call with the lock held"""
+
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, tables, rows)
+        for table_key in tables:
+            self._keys_by_table.setdefault(table_key, set()).add(key)
+        if len(self._entries) > self.capacity:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for table_key in entry[1]:
+            keys = self._keys_by_table.get(table_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_table[table_key]
+
+
+def _freeze(data):
+    """Returns params as something hashable"""
+
+    if isinstance(data, (list, tuple)):
+        return tuple(_freeze(x) for x in data)
+    elif isinstance(data, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in data.items()))
+    return data
+
+
+def _copy_rows(rows: list) -> list:
+    # Tuples (and Rows) can't be changed, so only dicts are copied
+    return [copy.copy(x) if isinstance(x, dict) else x for x in rows]
@@ -0,0 +1,196 @@
+import logging
+import os
+import time
+from typing import NamedTuple
+
+import psycopg2
+
+from .parallel_load import RangeReader, TSV_OPTIONS, split_tsv
+from .rows import row_value
+
+
+# Bookkeeping table, in the database being loaded
+PROGRESS_TABLE = "lib_database_load_progress"
+
+
+class LoadProgress(NamedTuple):
+    """Where a resumable load is, as passed to its progress callback"""
+
+    load_id: str
+    chunks_done: int
+    num_chunks: int
+    rows: int
+    bytes_done: int
+    num_bytes: int
+    rows_per_sec: float
+    # None until a chunk has been loaded this run
+    eta_seconds: float = None
+
+
+def resumable_bulk_insert_tsv(self,
+                              path: str,
+                              load_id: str = None,
+                              chunk_bytes: int = 2 ** 28,
+                              columns: list = None,
+                              retries: int = 3,
+                              progress=None) -> dict:
+    """Copies a TSV in chunks that each commit, so a failed load resumes
+
+    The TSV (read like bulk_insert_tsv) is split on line boundaries
+    into numbered chunks of about chunk_bytes. Each chunk is COPYed in
+    its own transaction, along with a row in lib_database_load_progress,
+    so a chunk is either loaded and recorded or neither. Running the
+    same load again (the same load_id, by default from the table, the
+    path, the file's size and mtime, and chunk_bytes) skips the chunks
+    that were recorded.
+
+    A dropped connection is reconnected and the chunk retried, up to
+    retries times in a row. rows/s and the ETA are logged after each
+    chunk, and progress is called with a LoadProgress if given.
+    Returns {"load_id", "chunks", "skipped", "rows", "total_rows"}
+
+    Chunks must commit as they go, so this can't run in a transaction.
+    Partitions are not made from the file, so must exist already.
+    """
+
+    assert self._conn.autocommit, "Resumable loads can't be in a transaction"
+    if load_id is None:
+        stat = os.stat(path)
+        load_id = (f"{self.name}:{os.path.abspath(path)}:{stat.st_size}:"
+                   f"{stat.st_mtime_ns}:{chunk_bytes}")
+    chunks = split_tsv(path, chunk_bytes)
+    num_bytes = sum(end - start for _, start, end in chunks)
+    _create_progress_table(self)
+    done = _committed_chunks(self, load_id)
+    for chunk, (_, start, end) in enumerate(chunks):
+        if chunk in done:
+            assert done[chunk][1:] == (start, end), (
+                f"Chunk {chunk} of {load_id} was {done[chunk][1:]}, "
+                f"not {(start, end)}. Did the file change?")
+
+    skipped = len(done)
+    if skipped:
+        logging.info(f"Resuming {load_id}: {skipped}/{len(chunks)} chunks "
+                     "are loaded already")
+    copy_sql = (f"COPY {self.name}"
+                + (f" ({','.join(columns)})" if columns else "")
+                + f" FROM STDIN {TSV_OPTIONS}")
+    started = time.perf_counter()
+    rows = bytes_loaded = 0
+    failures = 0
+    chunk = 0
+    while chunk < len(chunks):
+        _, start, end = chunks[chunk]
+        if chunk in done:
+            chunk += 1
+            continue
+        try:
+            chunk_rows = _load_chunk(self, load_id, chunk, copy_sql,
+                                     path, start, end)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            failures += 1
+            if failures > retries:
+                raise
+            logging.warning(f"Chunk {chunk} of {load_id} failed ({e}), "
+                            f"reconnecting ({failures}/{retries})")
+            _reconnect(self)
+            # The commit might have gone through before the connection
+            # dropped, in which case the chunk is recorded
+            done = _committed_chunks(self, load_id)
+            continue
+        failures = 0
+        done[chunk] = (chunk_rows, start, end)
+        rows += chunk_rows
+        bytes_loaded += end - start
+        _report(self, load_id, done, chunks, num_bytes, rows,
+                bytes_loaded, time.perf_counter() - started, progress)
+        chunk += 1
+
+    self._invalidate_results([self.name])
+    return {"load_id": load_id,
+            "chunks": len(chunks),
+            "skipped": skipped,
+            "rows": rows,
+            "total_rows": sum(x[0] for x in done.values())}
+
+
+def forget_load(self, load_id: str):
+    """Deletes the progress of a load, so it would run from the start"""
+
+    _create_progress_table(self)
+    self.execute(f"DELETE FROM {PROGRESS_TABLE} WHERE load_id = %s",
+                 [load_id])
+
+
+def _load_chunk(self, load_id, chunk, copy_sql, path, start, end) -> int:
+    """COPYs one chunk and records it in one transaction. Returns rows"""
+
+    with self.transaction():
+        with open(path, "rb") as f:
+            self._cursor.copy_expert(copy_sql, RangeReader(f, start, end))
+        rows = self._cursor.rowcount
+        self.execute(f"""INSERT INTO {PROGRESS_TABLE}
+                         (load_id, chunk, rows, start_byte, end_byte)
+                         VALUES (%s, %s, %s, %s, %s)""",
+                     [load_id, chunk, rows, start, end])
+    return rows
+
+
+def _create_progress_table(self):
+    self.execute(f"""CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} (
+                        load_id TEXT,
+                        chunk INTEGER,
+                        rows BIGINT,
+                        start_byte BIGINT,
+                        end_byte BIGINT,
+                        committed_at TIMESTAMPTZ DEFAULT now(),
+                        PRIMARY KEY (load_id, chunk));""")
+
+
+def _committed_chunks(self, load_id: str) -> dict:
+    """Returns {chunk: (rows, start byte, end byte)} of a load"""
+
+    sql = f"""SELECT chunk, rows, start_byte, end_byte FROM {PROGRESS_TABLE}
+           WHERE load_id = %s"""
+    return {row_value(x, "chunk"): (row_value(x, "rows", 1),
+                                    row_value(x, "start_byte", 2),
+                                    row_value(x, "end_byte", 3))
+            for x in self.execute(sql, [load_id])}
+
+
+def _reconnect(self):
+    """Replaces a broken connection with a new one"""
+
+    cursor_factory = self._conn.cursor_factory
+    pooled = self._pool is not None
+    try:
+        self.close()
+    except psycopg2.Error:
+        pass
+    self._connect(self._conf_section, cursor_factory, pooled)
+    # Statements prepared on the old connection are gone
+    if self.statement_cache:
+        self.statement_cache.clear(self._cursor)
+
+
+def _report(self, load_id, done, chunks, num_bytes, rows, bytes_loaded,
+            seconds, progress):
+    """Logs rows/s and the ETA, and calls progress"""
+
+    bytes_done = sum(end - start for _, start, end in done.values())
+    rows_per_sec = rows / seconds if seconds else 0.0
+    bytes_per_sec = bytes_loaded / seconds if seconds else 0.0
+    eta = ((num_bytes - bytes_done) / bytes_per_sec
+           if bytes_per_sec else None)
+    logging.info(f"{load_id}: {len(done)}/{len(chunks)} chunks, "
+                 f"{rows:,} rows at {rows_per_sec:,.0f} rows/s"
+                 + (f", ETA {eta:,.0f}s" if eta is not None else ""))
+    if progress:
+        progress(LoadProgress(load_id=load_id,
+                              chunks_done=len(done),
+                              num_chunks=len(chunks),
+                              rows=sum(x[0] for x in done.values()),
+                              bytes_done=bytes_done,
+                              num_bytes=num_bytes,
+                              rows_per_sec=rows_per_sec,
+                              eta_seconds=eta))
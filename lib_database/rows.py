@@ -0,0 +1,191 @@
+from datetime import date, datetime
+from functools import lru_cache
+from keyword import iskeyword
+from operator import itemgetter
+
+import numpy as np
+from psycopg2.extensions import cursor as TupleCursor
+
+
+class Row(tuple):
+    """Compact row: a tuple that can also be read by column name
+
+    row[0], row["col"] and row.col all work, and dict(row) converts it
+    when a dict is needed. Classes are made once per set of columns by
+    row_class, so no per row dict is allocated."""
+
+    __slots__ = ()
+    # {column: index}, set on each subclass
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self):
+        return tuple(self)
+
+    def items(self):
+        return zip(self._index, self)
+
+    def get(self, key, default=None):
+        return self[key] if key in self._index else default
+
+    def to_dict(self) -> dict:
+        return dict(zip(self._index, self))
+
+    def __repr__(self):
+        return f"Row({self.to_dict()})"
+
+
+@lru_cache(maxsize=1024)
+def row_class(columns: tuple):
+    """Returns a Row subclass for columns, cached per column names"""
+
+    # The first of duplicated names wins, as it would in a dict lookup
+    index = dict()
+    for i, column in enumerate(columns):
+        index.setdefault(column, i)
+    attrs = {"__slots__": (), "_index": index}
+    for column, i in index.items():
+        if (column.isidentifier()
+                and not iskeyword(column)
+                and not hasattr(Row, column)):
+            attrs[column] = property(itemgetter(i))
+    return type("Row", (Row,), attrs)
+
+
+class RowCursor(TupleCursor):
+    """Cursor that returns Rows. Use as a cursor_factory
+
+    Database(cursor_factory=RowCursor)"""
+
+    def _row_class(self):
+        return row_class(tuple(x.name for x in self.description))
+
+    def fetchone(self):
+        row = super(RowCursor, self).fetchone()
+        return None if row is None else self._row_class()(row)
+
+    def fetchmany(self, size=None):
+        rows = super(RowCursor, self).fetchmany(
+            self.arraysize if size is None else size)
+        cls = self._row_class() if rows else None
+        return [cls(x) for x in rows]
+
+    def fetchall(self):
+        rows = super(RowCursor, self).fetchall()
+        cls = self._row_class() if rows else None
+        return [cls(x) for x in rows]
+
+    def __iter__(self):
+        # next() on the cursor itself, since iter() would come back here
+        try:
+            first = next(self)
+        except StopIteration:
+            return
+        # Named cursors iterate with fetchmany, so rows are Rows already
+        if isinstance(first, Row):
+            yield first
+            while True:
+                try:
+                    yield next(self)
+                except StopIteration:
+                    return
+        cls = self._row_class()
+        yield cls(first)
+        while True:
+            try:
+                yield cls(next(self))
+            except StopIteration:
+                return
+
+
+def row_value(row, column: str, index: int = 0):
+    """Returns a column of a row from any cursor_factory
+
+    Plain tuples (and namedtuples) don't have names, so index is used"""
+
+    if isinstance(row, tuple) and not isinstance(row, Row):
+        return row[index]
+    return row[column]
+
+
+# {type oid: numpy dtype} for execute_columns
+_NUMPY_TYPES = {16: np.bool_,          # bool
+                20: np.int64,          # int8
+                21: np.int16,          # int2
+                23: np.int32,          # int4
+                26: np.uint32,         # oid
+                700: np.float32,       # float4
+                701: np.float64,       # float8
+                1700: np.float64,      # numeric
+                1082: "datetime64[D]",  # date
+                1114: "datetime64[us]"}  # timestamp
+
+
+def to_columns(description, rows: list) -> dict:
+    """Returns {column: np.ndarray} of tuple rows
+
+    Numeric, bool, date and timestamp columns get their numpy dtype,
+    and are masked arrays where there are NULLs. Other columns (such
+    as text and timestamptz) are object arrays."""
+
+    values = list(zip(*rows)) if rows else [()] * len(description)
+    columns = dict()
+    for col, col_values in zip(description, values):
+        dtype = _NUMPY_TYPES.get(col.type_code, object)
+        if dtype is object:
+            array = np.empty(len(col_values), dtype=object)
+            # Assigned one at a time so lists aren't made into 2D arrays
+            for i, value in enumerate(col_values):
+                array[i] = value
+        elif None in col_values:
+            mask = np.fromiter((x is None for x in col_values),
+                               dtype=bool,
+                               count=len(col_values))
+            fill = _fill_value(col_values)
+            array = np.ma.masked_array(
+                np.array([fill if x is None else x for x in col_values],
+                         dtype=dtype),
+                mask=mask)
+        else:
+            array = np.array(col_values, dtype=dtype)
+        columns[col.name] = array
+    return columns
+
+
+def _fill_value(values):
+    """Returns a placeholder of the right type for NULLs"""
+
+    for value in values:
+        if isinstance(value, datetime):
+            return datetime(1970, 1, 1)
+        elif isinstance(value, date):
+            return date(1970, 1, 1)
+        elif value is not None:
+            return type(value)()
+    return 0
+
+
+def to_structured(columns: dict):
+    """Returns {column: array} as one structured array
+
+    If any column is masked, a masked structured array is returned"""
+
+    names = list(columns)
+    num_rows = len(columns[names[0]]) if names else 0
+    dtype = np.dtype([(name, columns[name].dtype) for name in names])
+    array = np.empty(num_rows, dtype=dtype)
+    for name in names:
+        array[name] = np.ma.getdata(columns[name])
+    if any(np.ma.isMaskedArray(x) for x in columns.values()):
+        mask = np.zeros(num_rows, dtype=[(name, bool) for name in names])
+        for name in names:
+            mask[name] = np.ma.getmaskarray(columns[name])
+        return np.ma.masked_array(array, mask=mask)
+    return array
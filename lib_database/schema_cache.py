@@ -0,0 +1,127 @@
+import re
+from typing import NamedTuple
+
+from .rows import TupleCursor
+from .statement_cache import first_word
+
+
+# Statements that can change a table's columns or indexes
+_SCHEMA_DDL = {"CREATE", "ALTER", "DROP"}
+# Tables named in DDL, such as ALTER TABLE x or CREATE INDEX ON x
+_DDL_TABLES = re.compile(r"\b(?:TABLE|ON)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?"
+                         r"(?:ONLY\s+)?([\w.\"]+)", re.IGNORECASE)
+
+# {(database, table): TableSchema}, for this process
+_schemas = dict()
+
+
+class IndexInfo(NamedTuple):
+    """An index of a table, from pg_index"""
+
+    name: str
+    columns: list
+    unique: bool
+    primary: bool
+    definition: str
+    # False after a failed CREATE INDEX CONCURRENTLY
+    valid: bool = True
+
+
+class TableSchema(NamedTuple):
+    """Columns and indexes of a table, from pg_catalog"""
+
+    columns: list
+    # {column: udt_name}, such as int4 or _float8 for arrays
+    types: dict
+    # {column: True if NULLs are allowed}
+    nullable: dict
+    primary_key: list
+    indexes: list
+
+
+def get_schema(db, table: str, refresh: bool = False):
+    """Returns the TableSchema of a table, or None if it doesn't exist
+
+    Schemas are cached per process by (database, table). Missing
+    tables are not cached."""
+
+    key = (db._database, table)
+    if not refresh and key in _schemas:
+        return _schemas[key]
+    schema = _load_schema(db, table)
+    if schema is not None:
+        _schemas[key] = schema
+    return schema
+
+
+def is_cached(db, table: str) -> bool:
+    return (db._database, table) in _schemas
+
+
+def invalidate_schemas(database: str = None, tables: list = None):
+    """Drops cached schemas of tables (or all) in database (or all)"""
+
+    for key in list(_schemas):
+        if ((database is None or key[0] == database)
+                and (tables is None or key[1] in tables)):
+            _schemas.pop(key, None)
+
+
+def invalidate_for_sql(database: str, sql: str):
+    """Drops cached schemas that a statement might change
+
+    The tables are found in the DDL when possible, otherwise every
+    table of the database is dropped."""
+
+    if first_word(sql) in _SCHEMA_DDL:
+        tables = [x.strip('"').split(".")[-1].strip('"')
+                  for x in _DDL_TABLES.findall(sql)]
+        invalidate_schemas(database, tables or None)
+
+
+def _load_schema(db, table: str):
+    """Queries pg_catalog for a table's schema. None if it is missing
+
+    Tables are looked up in the public schema, not the search_path"""
+
+    # Domains are given as their base type, like udt_name
+    columns_sql = """SELECT a.attname,
+                        CASE WHEN t.typtype = 'd' THEN b.typname
+                             ELSE t.typname END,
+                        NOT a.attnotnull
+                  FROM pg_attribute a
+                  JOIN pg_type t ON t.oid = a.atttypid
+                  LEFT JOIN pg_type b ON b.oid = t.typbasetype
+                  WHERE a.attrelid = to_regclass('public.' || quote_ident(%s))
+                    AND a.attnum > 0 AND NOT a.attisdropped
+                  ORDER BY a.attnum;"""
+    indexes_sql = """SELECT i.relname,
+                        ARRAY(SELECT a.attname
+                              FROM unnest(x.indkey) WITH ORDINALITY
+                                  AS k(attnum, n)
+                              JOIN pg_attribute a
+                                  ON a.attrelid = x.indrelid
+                                  AND a.attnum = k.attnum
+                              ORDER BY k.n),
+                        x.indisunique,
+                        x.indisprimary,
+                        pg_get_indexdef(x.indexrelid),
+                        x.indisvalid
+                  FROM pg_index x
+                  JOIN pg_class i ON i.oid = x.indexrelid
+                  WHERE x.indrelid = to_regclass('public.' || quote_ident(%s))
+                  ORDER BY i.relname;"""
+    with db._conn.cursor(cursor_factory=TupleCursor) as cursor:
+        cursor.execute(columns_sql, [table])
+        columns = cursor.fetchall()
+        if not columns:
+            return None
+        cursor.execute(indexes_sql, [table])
+        indexes = [IndexInfo(*x) for x in cursor.fetchall()]
+
+    primary = [x for x in indexes if x.primary]
+    return TableSchema(columns=[x[0] for x in columns],
+                       types={x[0]: x[1] for x in columns},
+                       nullable={x[0]: x[2] for x in columns},
+                       primary_key=primary[0].columns if primary else [],
+                       indexes=indexes)
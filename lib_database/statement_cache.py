@@ -0,0 +1,227 @@
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from itertools import count
+import logging
+import math
+import re
+
+import psycopg2
+
+
+_statement_ids = count()
+
+# Quoted strings, identifiers and comments are kept as they are
+_TOKENS = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|/\*.*?\*/)"""
+                     r"|(--[^\n]*)|(\s+)", re.DOTALL)
+# Like psycopg2, these are replaced even inside of quotes
+_PARAMS = re.compile(r"%%|%s")
+# Statements that PREPARE accepts
+_PREPARABLE = {"SELECT", "INSERT", "UPDATE", "DELETE", "VALUES", "WITH"}
+# Statements after which cached plans might be stale
+_DDL = {"CREATE", "ALTER", "DROP", "TRUNCATE", "COMMENT", "GRANT", "REVOKE"}
+_FIRST_WORD = re.compile(r"[\s(]*(\w+)")
+# The types postgres gives the literals psycopg2 makes of these. Strings
+# and None are untyped literals, so their type is inferred the same way
+_PARAM_TYPES = {bool: "bool", str: "unknown", type(None): "unknown",
+                bytes: "bytea", Decimal: "numeric", date: "date",
+                time: "time", timedelta: "interval"}
+
+
+def first_word(sql: str) -> str:
+    """Returns the first word of a statement, upper cased"""
+
+    # A match, so long statements aren't split up just for this
+    match = _FIRST_WORD.match(sql)
+    return match.group(1).upper() if match else ""
+
+
+def normalize(sql: str) -> str:
+    """Collapses whitespace outside of quotes and comments, strips ;"""
+
+    def replace(match):
+        if match.group(2):
+            # -- comments end at the newline, so keep one
+            return match.group(2) + "\n"
+        return " " if match.group(3) else match.group(0)
+
+    return _TOKENS.sub(replace, sql).strip().rstrip(";").strip()
+
+
+def to_numbered_params(sql: str):
+    """Returns (sql with %s as $1, $2..., number of params)
+
+    Returns (None, 0) if the sql can't be prepared, such as when it
+    has named %(x)s params or several statements"""
+
+    unquoted = _TOKENS.sub(lambda m: "" if m.group(1) or m.group(2)
+                           else m.group(0), sql)
+    if "%(" in sql or ";" in unquoted:
+        return None, 0
+
+    num_params = 0
+
+    def replace(match):
+        nonlocal num_params
+        if match.group(0) == "%%":
+            return "%"
+        num_params += 1
+        return f"${num_params}"
+
+    return _PARAMS.sub(replace, sql), num_params
+
+
+def param_types(data) -> tuple:
+    """Returns the postgres types of params, as psycopg2 would send them
+
+    Returns None if any param has no clear type (such as lists, dicts
+    or adapted objects), since a prepared statement would then guess"""
+
+    types = []
+    for value in data:
+        kind = type(value)
+        if kind is int:
+            types.append("int4" if -2 ** 31 <= value < 2 ** 31
+                         else "int8" if -2 ** 63 <= value < 2 ** 63
+                         else "numeric")
+        # psycopg2 sends floats as numeric literals, except for nan/inf
+        elif kind is float:
+            types.append("numeric" if math.isfinite(value) else "float8")
+        elif kind is datetime:
+            types.append("timestamp" if value.tzinfo is None
+                         else "timestamptz")
+        elif kind in _PARAM_TYPES:
+            types.append(_PARAM_TYPES[kind])
+        else:
+            return None
+    return tuple(types)
+
+
+class StatementCache:
+    """LRU cache of server side prepared statements for one connection
+
+    Statements are keyed by their normalized SQL and the types of their
+    params. A miss PREPAREs the statement with those types, a hit runs
+    it with EXECUTE, so postgres skips parsing and planning. Params are
+    typed as psycopg2's literals would be, so results match running the
+    SQL directly. Statements with params of other types (such as lists,
+    dicts or Json) aren't prepared. When over capacity the least
+    recently used statement is DEALLOCATEd. DDL through the cache
+    clears it, since prepared plans for SELECT * can break when a
+    table's columns change.
+    """
+
+    __slots__ = ["capacity", "hits", "misses", "evictions",
+                 "_statements", "_unpreparable"]
+
+    def __init__(self, capacity: int = 256):
+        assert capacity > 0, "Capacity must be positive"
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # {(normalized sql, param types): (statement name, num params)}
+        self._statements = OrderedDict()
+        # Statements that failed to PREPARE, so we don't keep trying
+        self._unpreparable = OrderedDict()
+
+    def execute(self, cursor, sql: str, data) -> None:
+        """Executes sql with data on cursor, using a prepared statement
+
+        Statements that can't be prepared run as normal"""
+
+        word = first_word(sql)
+        if word in _DDL:
+            self.clear(cursor)
+        elif word in _PREPARABLE and isinstance(data, (list, tuple)):
+            types = param_types(data)
+            name, num_params = ((None, 0) if types is None
+                                else self._get(cursor, sql, types))
+            if name and num_params == len(data):
+                params = ", ".join(["%s"] * num_params)
+                try:
+                    return cursor.execute(
+                        f"EXECUTE {name}" + (f" ({params})" if params else ""),
+                        data)
+                # The result type changed, so the plan must be redone
+                except psycopg2.errors.FeatureNotSupported:
+                    if cursor.connection.autocommit:
+                        self._deallocate(cursor, (normalize(sql), types))
+                    else:
+                        raise
+        cursor.execute(sql, data)
+
+    def clear(self, cursor):
+        """Deallocates every statement in the cache"""
+
+        if self._statements and not cursor.connection.closed:
+            cursor.execute("DEALLOCATE ALL")
+        self._statements.clear()
+        self._unpreparable.clear()
+
+    @property
+    def stats(self) -> dict:
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._statements),
+                "capacity": self.capacity}
+
+    def _get(self, cursor, sql: str, types: tuple):
+        """Returns (name, num params) of the prepared statement for sql
+
+        Prepares it on a miss. Returns (None, 0) if it can't be"""
+
+        key = (normalize(sql), types)
+        if key in self._statements:
+            self.hits += 1
+            self._statements.move_to_end(key)
+            return self._statements[key]
+        elif key in self._unpreparable:
+            return None, 0
+
+        self.misses += 1
+        converted, num_params = to_numbered_params(key[0])
+        name = f"lib_database_stmt_{next(_statement_ids)}"
+        if (converted is None
+                or num_params != len(types)
+                or not self._prepare(cursor, name, types, converted)):
+            self._unpreparable[key] = None
+            if len(self._unpreparable) > self.capacity:
+                self._unpreparable.popitem(last=False)
+            return None, 0
+
+        self._statements[key] = (name, num_params)
+        if len(self._statements) > self.capacity:
+            self._deallocate(cursor, next(iter(self._statements)))
+            self.evictions += 1
+        return name, num_params
+
+    def _prepare(self, cursor, name: str, types: tuple, sql: str) -> bool:
+        """PREPAREs a statement, returning False if postgres won't
+
+        Inside a transaction a savepoint keeps a failure from aborting
+        the transaction"""
+
+        in_transaction = not cursor.connection.autocommit
+        try:
+            if in_transaction:
+                cursor.execute("SAVEPOINT lib_database_prepare")
+            # No params, so psycopg2 leaves percent signs alone
+            cursor.execute(f"PREPARE {name}"
+                           + (f" ({', '.join(types)})" if types else "")
+                           + f" AS {sql}")
+            if in_transaction:
+                cursor.execute("RELEASE SAVEPOINT lib_database_prepare")
+            return True
+        except psycopg2.Error as e:
+            logging.debug(f"Could not prepare {sql}: {e}")
+            if in_transaction:
+                cursor.execute("ROLLBACK TO SAVEPOINT lib_database_prepare")
+            return False
+
+    def _deallocate(self, cursor, key: str):
+        """Removes a statement from the cache and the server"""
+
+        name, _ = self._statements.pop(key)
+        cursor.execute(f"DEALLOCATE {name}")
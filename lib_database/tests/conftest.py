@@ -1,11 +1,41 @@
+import os
+
 import pytest
 
 from ..generic_table import GenericTable
+from ..pool import close_pools
+from ..postgres import Postgres
+
+
+@pytest.fixture(scope="session")
+def template_database():
+    """Creates an empty template database for the session
+
+    Each xdist worker runs its own session, so gets its own template"""
+
+    worker = os.environ.get("PYTEST_XDIST_WORKER", "main")
+    template = f"lib_database_test_{worker}"
+    postgres = Postgres()
+    postgres.create_template(template)
+    yield template
+    postgres.drop_template(template)
+
+
+@pytest.fixture(scope="function")
+def database_clone(template_database, monkeypatch):
+    """Points Database at a clone of the template for one test. Drops it"""
+
+    postgres = Postgres()
+    clone = postgres.clone_database(template_database)
+    monkeypatch.setattr(Postgres, "default_conf_section", clone)
+    yield clone
+    close_pools()
+    postgres.drop_clone(clone)
 
 
 @pytest.fixture(scope="function")
-def test_table():
-    """Creates a test table. Adds 1 row. Yields. Deletes."""
+def test_table(database_clone):
+    """Creates a test table in a clone. Adds 1 row. Yields. Closes."""
 
     class TestTable(GenericTable):
         name = "test"
@@ -40,5 +70,4 @@ def test_table():
     table = TestTable(clear=True)
     table.fill_table()
     yield table
-    table.clear_table()
     table.close()
@@ -0,0 +1,108 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from ..async_generic_table import AsyncGenericTable
+
+pytest.importorskip("psycopg")
+pytest.importorskip("psycopg_pool")
+
+
+class AsyncTestTable(AsyncGenericTable):
+    name = "test_async"
+    id_col = "test_id"
+
+    async def create_table(self):
+        sql = f"""CREATE TABLE IF NOT EXISTS {self.name} (
+                test_id SERIAL PRIMARY KEY, col1 INTEGER, col2 INTEGER[]
+              );"""
+        await self.execute(sql)
+
+
+def run(coroutine_func):
+    """Runs a coroutine func with a fresh table, then drops the table"""
+
+    async def wrapper():
+        async with AsyncTestTable(clear=True) as table:
+            try:
+                return await coroutine_func(table)
+            finally:
+                await table.clear_table()
+    return asyncio.run(wrapper())
+
+
+@pytest.mark.async_generic_table
+@pytest.mark.usefixtures("database_clone")
+class TestAsyncGenericTable:
+    """Tests the asyncio version of the generic table"""
+
+    def test_no_name(self):
+        """Tests subclassing with no name"""
+
+        class Subtable(AsyncGenericTable):
+            id_col = None
+
+        with pytest.raises(AssertionError):
+            Subtable()
+
+    def test_insert(self):
+        """Tests that insert returns ids and converts numpy arrays"""
+
+        async def test(table):
+            test_id = await table.insert({"col1": 1,
+                                          "col2": np.array([1, 2])})
+            assert isinstance(test_id, int)
+            rows = await table.get_all()
+            assert rows[0]["col2"] == [1, 2]
+        run(test)
+
+    def test_bulk_insert_async_iterable(self):
+        """Tests streaming an async generator in with COPY"""
+
+        async def rows():
+            for i in range(1000):
+                yield {"col1": i, "col2": [i]}
+
+        async def test(table):
+            await table.bulk_insert(rows(), batch_size=100)
+            assert await table.get_count() == 1000
+        run(test)
+
+    def test_bulk_insert_columns(self):
+        """Tests inserting columns of numpy arrays"""
+
+        async def test(table):
+            await table.bulk_insert_columns({"col1": np.arange(1000)})
+            assert await table.get_count() == 1000
+        run(test)
+
+    def test_concurrent_queries(self):
+        """Tests that queries from different tasks run at once"""
+
+        async def test(table):
+            sql = "SELECT pg_sleep(.5), 1 AS count"
+            start = asyncio.get_running_loop().time()
+            await asyncio.gather(*[table.get_count(sql) for _ in range(4)])
+            assert asyncio.get_running_loop().time() - start < 2
+        run(test)
+
+    def test_iter_all_and_copy_out(self):
+        """Tests streaming rows and COPY output back out"""
+
+        async def test(table):
+            await table.bulk_insert([{"col1": i} for i in range(10)])
+            rows = [row async for row in table.iter_all(itersize=3)]
+            assert len(rows) == 10
+            chunks = [x async for x in table.iter_copy_to(
+                query=f"SELECT col1 FROM {table.name} WHERE col1 < %s",
+                data=[3])]
+            assert b"".join(chunks) == b"0\n1\n2\n"
+        run(test)
+
+    def test_columns(self):
+        """Tests that columns must be awaited and are in order"""
+
+        async def test(table):
+            assert await table.columns == ["test_id", "col1", "col2"]
+        run(test)
@@ -0,0 +1,108 @@
+import psycopg2
+import pytest
+
+from ..batch import BatchError
+from ..database import Database
+
+
+@pytest.mark.batch
+class TestBatch:
+    """Tests executing batches of statements"""
+
+    def test_results(self, test_table):
+        """Tests that each statement's rows are collected"""
+
+        name = test_table.name
+        with Database() as db:
+            results = db.execute_batch(
+                [(f"INSERT INTO {name} VALUES (%s, %s)", [2, 2]),
+                 f"UPDATE {name} SET col2 = 5 WHERE col1 = 2",
+                 (f"SELECT col2 FROM {name} WHERE col1 = %s", [2]),
+                 (f"INSERT INTO {name} VALUES (%s, %s) RETURNING col1",
+                  [3, 3]),
+                 "SELECT '100%%' AS pct"],
+                page_size=2)
+        assert results == [[], [], [{"col2": 5}], [{"col1": 3}],
+                           [{"pct": "100%"}]]
+
+    def test_few_round_trips(self, test_table, monkeypatch):
+        """Tests that statements are sent a page at a time"""
+
+        with Database() as db:
+            queries = []
+            execute = type(db._cursor).execute
+            monkeypatch.setattr(type(db._cursor), "execute",
+                                lambda self, sql, *args: queries.append(sql)
+                                or execute(self, sql, *args))
+            db.execute_batch([(f"INSERT INTO {test_table.name} "
+                               "VALUES (%s, %s)", [x, x])
+                              for x in range(2, 252)],
+                             transaction=False,
+                             page_size=100)
+            assert len(queries) == 3
+        assert test_table.get_count() == 252
+
+    @pytest.mark.parametrize("transaction", [True, False])
+    def test_error_index(self, test_table, transaction):
+        """Tests that the failing statement is reported"""
+
+        name = test_table.name
+        statements = [(f"INSERT INTO {name} VALUES (%s, %s)", [x, x])
+                      for x in range(2, 10)]
+        statements[5] = (f"INSERT INTO {name} VALUES (%s, %s)", ["x", 1])
+        with Database() as db:
+            with pytest.raises(BatchError) as e:
+                db.execute_batch(statements,
+                                 transaction=transaction,
+                                 page_size=4)
+            assert e.value.index == 5 and e.value.params == ["x", 1]
+            assert db._conn.autocommit
+        # Pages before the failed one stay only without a transaction
+        expected = 2 + (4 if not transaction else 0)
+        assert test_table.get_count() == expected
+
+    @pytest.mark.parametrize("transaction", [True, False])
+    def test_rerun_succeeds(self, test_table, transaction):
+        """Tests that a page is never applied by a rerun that succeeds"""
+
+        class FailOnce:
+            """A cursor whose first multi statement query fails"""
+
+            def __init__(self, cursor):
+                self.cursor = cursor
+                self.failed = False
+
+            def execute(self, sql, *args):
+                if ";" in sql and not self.failed:
+                    self.failed = True
+                    raise psycopg2.errors.SerializationFailure("Try again")
+                return self.cursor.execute(sql, *args)
+
+            def __getattr__(self, name):
+                return getattr(self.cursor, name)
+
+        name = test_table.name
+        with Database() as db:
+            db._cursor = FailOnce(db._cursor)
+            with pytest.raises(psycopg2.errors.SerializationFailure):
+                db.execute_batch([f"INSERT INTO {name} VALUES (10, 10)",
+                                  f"INSERT INTO {name} VALUES (11, 11)"],
+                                 transaction=transaction)
+            db._cursor = db._cursor.cursor
+            assert db._conn.autocommit
+        assert test_table.get_count() == 2
+
+    def test_in_callers_transaction(self, test_table):
+        """Tests that a failure leaves the caller's transaction usable"""
+
+        name = test_table.name
+        with Database() as db:
+            db._conn.autocommit = False
+            db.execute(f"INSERT INTO {name} VALUES (10, 10)")
+            with pytest.raises(BatchError):
+                db.execute_batch([f"INSERT INTO {name} VALUES (11, 11)",
+                                  "SELECT * FROM not_a_table"])
+            db.execute(f"INSERT INTO {name} VALUES (12, 12)")
+            db._conn.commit()
+            db._conn.autocommit = True
+        assert test_table.get_count() == 4
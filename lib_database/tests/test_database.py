@@ -105,3 +105,33 @@ class TestDatabase:
             # There doesn't seem to be a way to access the named tuple class
             # Because of this, we can just check to make sure it's not equal
             assert type(real_dict_rows[0]) != type(named_tuple_rows[0])
+
+    @pytest.mark.parametrize("itersize", [1, 2, 100])
+    def test_execute_iter(self, test_table, itersize):
+        """Tests that rows are streamed from a server side cursor"""
+
+        with Database() as db:
+            sql = f"SELECT * FROM {test_table.name}"
+            rows = list(db.execute_iter(sql, itersize=itersize))
+            test_table.match_default_rows(rows)
+            # The connection goes back to autocommit afterwards
+            assert db._conn.autocommit
+
+    def test_execute_iter_batch(self, test_table):
+        """Tests that batches of at most itersize rows are yielded"""
+
+        with Database() as db:
+            sql = f"SELECT * FROM {test_table.name}"
+            batches = list(db.execute_iter(sql, itersize=1, batch=True))
+            assert len(batches) == len(test_table.default_rows)
+            assert all(len(x) == 1 for x in batches)
+
+    def test_execute_iter_closed_with_db(self, test_table):
+        """Tests that open iterators are cleaned up on close"""
+
+        with Database() as db:
+            rows = db.execute_iter(f"SELECT * FROM {test_table.name}")
+            next(rows)
+            assert not db._conn.autocommit
+        with pytest.raises(StopIteration):
+            next(rows)
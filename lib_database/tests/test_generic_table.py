@@ -1,3 +1,6 @@
+from datetime import date, datetime, timedelta, timezone
+import gzip
+import io
 import itertools
 import os
 
@@ -7,6 +10,8 @@ import pytest
 
 from lib_utils.file_funcs import delete_paths
 
+from .. import generic_table
+from ..binary_copy import encode_columns, field_encoder
 from ..generic_table import GenericTable
 
 
@@ -62,10 +67,11 @@ class TestGenericTable:
                              # Is the type
                              list(itertools.product([list, tuple, np.array],
                                                     ["test_id", None])))
-    def test_insert(self, iter_func, id_col):
+    def test_insert(self, iter_func, id_col, database_clone):
         """Tests the insert function for the generic_table"""
 
         temp = id_col
+
         class Test_Table(GenericTable):
             """Test table class"""
 
@@ -93,11 +99,62 @@ class TestGenericTable:
             assert results[0]["data"] == list(data["data"])
             assert results[0]["test_val"] == data["test_val"]
 
+    @pytest.mark.parametrize("id_col", ["test_id", None])
+    def test_insert_many(self, id_col, database_clone, monkeypatch):
+        """Tests that ids come back in input order for mixed key sets"""
+
+        temp = id_col
+
+        class Test_Table(GenericTable):
+            """Test table class"""
+
+            name = "test"
+            id_col = temp
+
+            def create_table(self):
+                sql = f"""CREATE TABLE IF NOT EXISTS {self.name} (
+                      data INTEGER[], test_val INTEGER"""
+                if self.id_col:
+                    sql += f", {id_col} SERIAL PRIMARY KEY "
+                sql += ");"
+                self.execute(sql)
+
+        rows = [{"test_val": 0},
+                {"data": np.array([1, 2]), "test_val": 1},
+                {},
+                {"test_val": 3},
+                # Same keys in another order, so in the same group
+                {"test_val": 4, "data": [4]}]
+        groups = []
+        execute_values = generic_table.execute_values
+
+        def record(cursor, sql, *args, **kwargs):
+            groups.append(sql)
+            return execute_values(cursor, sql, *args, **kwargs)
+
+        monkeypatch.setattr(generic_table, "execute_values", record)
+        with Test_Table(clear=True) as db:
+            ids = db.insert_many(rows, page_size=1)
+            assert len(groups) == 2
+            results = db.get_all()
+            assert len(results) == len(rows)
+            assert {x["test_val"]: x["data"] for x in results}[4] == [4]
+            if id_col:
+                vals = {x[id_col]: x["test_val"] for x in results}
+                assert [vals[x] for x in ids] == [0, 1, None, 3, 4]
+            else:
+                assert ids is None
+
     def test_get_all(self, test_table):
         """Tests get_all function"""
 
         test_table.match_default_rows(test_table.get_all())
 
+    def test_iter_all(self, test_table):
+        """Tests iter_all function"""
+
+        test_table.match_default_rows(list(test_table.iter_all()))
+
     def test_get_count_no_sql_no_data(self, test_table):
         """Tests get_count with no sql or data passed in"""
 
@@ -122,6 +179,180 @@ class TestGenericTable:
         data = [row[k] for k in ["col1", "col2"]]
         assert test_table.get_count(sql, data) == 1
 
+    @pytest.mark.parametrize("as_generator", [True, False])
+    def test_bulk_insert_stream(self, test_table, as_generator):
+        """Tests that rows can be streamed in without a TSV"""
+
+        rows = [{"col1": x, "col2": x} for x in range(2, 1002)]
+        if as_generator:
+            rows = (row for row in rows)
+        test_table.bulk_insert_stream(rows, batch_size=100)
+        assert test_table.get_count() == len(test_table.default_rows) + 1000
+
+    def test_bulk_insert_stream_sequences(self, test_table):
+        """Tests streaming sequences with NULLs and explicit columns"""
+
+        test_table.bulk_insert_stream([(5, None), (6, 6)],
+                                      columns=["col1", "col2"])
+        sql = f"SELECT COUNT(*) FROM {test_table.name} WHERE col2 IS NULL"
+        assert test_table.get_count(sql) == 1
+
+    def test_bulk_insert_stream_mode(self, test_table):
+        """Tests that bulk_insert can stream instead of using a TSV"""
+
+        test_table.bulk_insert([{"col1": 5, "col2": 5}], stream=True)
+        assert test_table.get_count() == len(test_table.default_rows) + 1
+
+    @pytest.mark.parametrize("as_array", [True, False])
+    def test_bulk_insert_binary(self, test_table, as_array):
+        """Tests that rows can be packed with a binary COPY"""
+
+        rows = [{"col1": x, "col2": None if x % 2 else x}
+                for x in range(2, 1002)]
+        if as_array:
+            rows = [[np.int32(x["col1"]), x["col2"]] for x in rows]
+            test_table.bulk_insert_binary(rows, columns=["col1", "col2"])
+        else:
+            test_table.bulk_insert_binary(rows)
+        assert test_table.get_count() == len(test_table.default_rows) + 1000
+        sql = f"SELECT COUNT(*) FROM {test_table.name} WHERE col2 IS NULL"
+        assert test_table.get_count(sql) == 500
+
+    @pytest.mark.parametrize("masked", [True, False])
+    def test_bulk_insert_columns(self, test_table, masked):
+        """Tests inserting a dict of numpy arrays"""
+
+        col1 = np.arange(2, 1002)
+        col2 = np.arange(2, 1002, dtype=np.int16)
+        if masked:
+            col2 = np.ma.array(col2, mask=col2 % 2)
+        test_table.bulk_insert_columns({"col1": col1, "col2": col2})
+        assert test_table.get_count() == len(test_table.default_rows) + 1000
+        sql = f"SELECT COUNT(*) FROM {test_table.name} WHERE col2 IS NULL"
+        assert test_table.get_count(sql) == (500 if masked else 0)
+
+    @pytest.mark.parametrize("columns", [{"col1": np.array([1.5])},
+                                         {"col1": np.array([2 ** 40])},
+                                         {"col3": np.array([1])},
+                                         {"col1": np.array([1, 2]),
+                                          "col2": np.array([1])}])
+    def test_bulk_insert_columns_invalid(self, test_table, columns):
+        """Tests that bad dtypes, columns, and lengths are caught"""
+
+        with pytest.raises(AssertionError):
+            test_table.bulk_insert_columns(columns)
+        assert test_table.get_count() == len(test_table.default_rows)
+
+    def test_bulk_insert_columns_masked_datetimes(self, test_table):
+        """Tests that masked datetime64[ns] columns go in as datetimes"""
+
+        test_table.execute(f"""ALTER TABLE {test_table.name}
+                               ADD COLUMN ts TIMESTAMP, ADD COLUMN d DATE""")
+        values = np.array(["2020-05-06T07:08:09", "2021-01-02"],
+                          dtype="datetime64[ns]")
+        test_table.bulk_insert_columns({
+            "col1": np.array([5, 6]),
+            "ts": np.ma.array(values, mask=[False, True]),
+            "d": np.ma.array(values, mask=[True, False])})
+        sql = f"SELECT ts, d FROM {test_table.name} WHERE col1 >= 5"
+        rows = sorted(test_table.execute(sql), key=lambda x: x["d"] is None)
+        assert rows == [{"ts": None, "d": date(2021, 1, 2)},
+                        {"ts": datetime(2020, 5, 6, 7, 8, 9), "d": None}]
+
+    @pytest.mark.parametrize("udt_name", ["numeric", "uuid", "_numeric"])
+    def test_encode_columns_unsupported(self, udt_name):
+        """Tests that types without an encoder fail before any COPY"""
+
+        with pytest.raises(AssertionError):
+            encode_columns({"x": np.array([1], dtype=object)},
+                           {"x": udt_name})
+
+    def test_bulk_insert_binary_arrays(self, test_table):
+        """Tests that nested lists keep their dimensions in array columns"""
+
+        test_table.execute(f"ALTER TABLE {test_table.name} ADD COLUMN a INT[]")
+        test_table.bulk_insert_binary([{"col1": 5, "a": [[1, 2], [3, 4]]},
+                                       {"col1": 6, "a": np.array([5, 6])},
+                                       {"col1": 7, "a": [7, None]}])
+        sql = f"SELECT a FROM {test_table.name} WHERE col1 >= 5 ORDER BY col1"
+        assert [x["a"] for x in test_table.execute(sql)] == [
+            [[1, 2], [3, 4]], [5, 6], [7, None]]
+
+    @pytest.mark.parametrize("value", [[1.5, 2], np.array([1.5]),
+                                       [[1, None], [2, 3]],
+                                       np.array([2 ** 31])])
+    def test_bad_arrays(self, value):
+        """Tests that floats, out of range ints and nested NULLs are caught"""
+
+        with pytest.raises(AssertionError):
+            field_encoder("_int4")(value)
+
+    def test_array_of_arrays(self):
+        """Tests that a list of ndarrays is encoded as a 2-D array"""
+
+        encode = field_encoder("_int4")
+        assert encode([np.array([1, 2]), np.array([3, 4])]) == encode(
+            [[1, 2], [3, 4]])
+
+    @pytest.mark.parametrize("value", [datetime(2020, 5, 6, 7, 8),
+                                       np.datetime64("2020-05-06"),
+                                       np.datetime64("2020-05-06T07:08")])
+    def test_encode_date_types(self, value):
+        """Tests that datetimes and datetime64s are written as dates"""
+
+        encode = field_encoder("date")
+        assert encode(value) == encode(date(2020, 5, 6))
+
+    @pytest.mark.parametrize("value", ["false", "true", 2, 1.0])
+    def test_encode_bad_bools(self, value):
+        """Tests that only bools (or 0 and 1) go into bool columns"""
+
+        with pytest.raises(AssertionError):
+            field_encoder("bool")(value)
+
+    def test_encode_aware_timestamp(self):
+        """Tests that a timestamp drops a time zone, as postgres does"""
+
+        encode = field_encoder("timestamp")
+        aware = datetime(2020, 5, 6, 7, 8, tzinfo=timezone(timedelta(hours=3)))
+        assert encode(aware) == encode(datetime(2020, 5, 6, 7, 8))
+
+    def test_encode_bytes_as_text(self):
+        """Tests that bytes aren't written as their repr into text"""
+
+        with pytest.raises(AssertionError):
+            field_encoder("text")(b"abc")
+
+    @pytest.mark.parametrize("column, udt_name", [
+        (np.array([b"abc"]), "text"),
+        (np.array([b"abc"], dtype=object), "varchar"),
+        (np.array(["abc"]), "bytea"),
+        (np.array(["abc"], dtype=object), "bytea")])
+    def test_encode_columns_invalid_text(self, column, udt_name):
+        """Tests that bytes for text and str for bytea are caught"""
+
+        with pytest.raises(AssertionError):
+            encode_columns({"x": column}, {"x": udt_name})
+
+    def test_bulk_insert_columns_text(self, test_table):
+        """Tests inserting text and bytea arrays"""
+
+        test_table.execute(f"""ALTER TABLE {test_table.name}
+                               ADD COLUMN t TEXT, ADD COLUMN b BYTEA""")
+        test_table.bulk_insert_columns({
+            "col1": np.array([5, 6]),
+            "t": np.array(["abc", "de"]),
+            "b": np.array([b"abc", None], dtype=object)})
+        sql = f"SELECT t, b FROM {test_table.name} WHERE col1 >= 5"
+        rows = sorted(test_table.execute(sql), key=lambda x: x["t"])
+        assert [x["t"] for x in rows] == ["abc", "de"]
+        assert [x["b"] and bytes(x["b"]) for x in rows] == [b"abc", None]
+
+    def test_column_types(self, test_table):
+        """Tests that udt names are returned for each column"""
+
+        assert test_table.column_types == {"col1": "int4", "col2": "int4"}
+
     def test_copy_to_tsv(self, test_table):
         """Tests that a table can be copied to a TSV file"""
 
@@ -134,6 +365,80 @@ class TestGenericTable:
             assert len(f.readlines()) == len(test_table.default_rows)
             delete_paths(file_path)
 
+    def test_copy_to_query_gzip(self, test_table):
+        """Tests copying a query out with compression"""
+
+        file_path = "/tmp/test_table.tsv.gz"
+        sql = f"SELECT col1 FROM {test_table.name} WHERE col1 = %s"
+        test_table.copy_to(file_path, query=sql, data=[0], compression="gzip")
+        with gzip.open(file_path, "rt") as f:
+            assert f.read() == "0\n"
+        delete_paths(file_path)
+
+    def test_copy_to_bad_compression(self, test_table):
+        """Tests that an unknown compression is a bad argument"""
+
+        with pytest.raises(ValueError):
+            test_table.copy_to(io.BytesIO(), compression="rar")
+
+    def test_iter_copy_to(self, test_table):
+        """Tests that a table can be streamed out in chunks"""
+
+        data = b"".join(test_table.iter_copy_to())
+        assert len(data.splitlines()) == len(test_table.default_rows)
+
+    def test_iter_copy_to_closed_early(self, test_table):
+        """Tests that the connection is usable after closing early"""
+
+        test_table.bulk_insert_stream({"col1": x, "col2": x}
+                                      for x in range(2, 100000))
+        chunks = test_table.iter_copy_to(max_chunks=1)
+        next(chunks)
+        chunks.close()
+        assert test_table.get_count() == 100000
+
+    def test_get_all_numpy(self, test_table):
+        """Tests reading a table into typed numpy arrays"""
+
+        columns = test_table.get_all_numpy()
+        assert columns["col1"].dtype == np.int32
+        assert sorted(columns["col1"].tolist()) == [0, 1]
+        assert test_table.get_all_numpy(structured=True).dtype.names == (
+            "col1", "col2")
+
+    @pytest.mark.parametrize("chunk_bytes", [1, 2 ** 20])
+    def test_fetch_numpy_nulls(self, test_table, chunk_bytes):
+        """Tests NULLs, types and chunking when fetching numpy arrays"""
+
+        sql = """SELECT x::int8 AS i, NULLIF(x %% 3, 0)::float8 AS f,
+                        x %% 2 = 0 AS b, x::text AS t,
+                        '2000-01-01'::date + x AS d,
+                        '2000-01-01'::timestamp + x * interval '1s' AS ts
+                 FROM generate_series(1, %s) x ORDER BY x"""
+        columns = test_table.fetch_numpy(sql, [5000], chunk_bytes=chunk_bytes)
+        expected = test_table.execute_columns(sql, [5000])
+        for name, values in expected.items():
+            assert columns[name].tolist() == values.tolist()
+        assert columns["f"].mask.sum() == 5000 // 3
+        assert columns["ts"].dtype == np.dtype("datetime64[us]")
+
+        structured = test_table.fetch_numpy(sql, [10], structured=True)
+        assert structured["i"].tolist() == list(range(1, 11))
+        assert structured.mask["f"].tolist() == [x % 3 == 0
+                                                 for x in range(1, 11)]
+
+    def test_fetch_numpy_fallback(self, test_table):
+        """Tests types without binary decoding use execute_columns"""
+
+        columns = test_table.fetch_numpy("SELECT 1.5::numeric AS n")
+        assert columns["n"].tolist() == [1.5]
+        # % is only formatted once, so LIKE patterns survive
+        sql = """SELECT %s::numeric AS n, v FROM (VALUES ('ab'), ('ba')) t(v)
+                 WHERE v LIKE 'a%%'"""
+        columns = test_table.fetch_numpy(sql, [2.5])
+        assert columns["n"].tolist() == [2.5]
+        assert columns["v"].tolist() == ["ab"]
+
     @pytest.mark.skip(reason="Added feature later. Needs testing")
     def test_columns(self):
         pass
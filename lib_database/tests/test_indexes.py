@@ -0,0 +1,107 @@
+import pytest
+
+from ..generic_table import GenericTable
+from ..indexes import Constraint, Index, index_name, index_sql
+
+
+class IndexedTable(GenericTable):
+    name = "test_indexed"
+    id_col = None
+
+    indexes = [Index(["col1"]),
+               Index(["col2", "col1"], name="test_indexed_both"),
+               Index(["lower(col3)"], where="col3 IS NOT NULL")]
+    constraints = [Constraint("test_indexed_positive", "CHECK (col1 >= 0)"),
+                   Constraint("test_indexed_unique", "UNIQUE (col3)")]
+
+    def create_table(self):
+        self.execute(f"""CREATE TABLE IF NOT EXISTS {self.name}(
+                         col1 INTEGER, col2 INTEGER, col3 TEXT);""")
+
+
+@pytest.fixture
+def indexed_table(database_clone):
+    table = IndexedTable(clear=True)
+    yield table
+    table.close()
+
+
+@pytest.mark.indexes
+class TestIndexes:
+    """Tests declared indexes and constraints"""
+
+    def test_index_sql(self):
+        """Tests the statements built from declarations"""
+
+        index = Index(["a", "lower(b)"], unique=True, include=["c"],
+                      where="a > 0")
+        assert index_name("t", index) == "t_a_lower_b__idx"
+        assert index_sql("t", index, concurrently=True) == (
+            "CREATE UNIQUE INDEX CONCURRENTLY t_a_lower_b__idx ON t "
+            "USING btree (a, lower(b)) INCLUDE (c) WHERE a > 0")
+
+    def test_created_with_table(self, indexed_table):
+        """Tests that declared indexes are built when the table is"""
+
+        assert indexed_table.missing_indexes() == []
+        names = {x.name for x in indexed_table.schema.indexes}
+        assert {"test_indexed_col1_idx", "test_indexed_both",
+                "test_indexed_unique"} <= names
+
+    def test_drop_and_create(self, indexed_table):
+        """Tests dropping and rebuilding every declared index"""
+
+        dropped = indexed_table.drop_indexes()
+        assert len(dropped) == 5
+        assert len(indexed_table.missing_indexes()) == 5
+        built = indexed_table.create_indexes(workers=2)
+        assert sorted(built) == sorted(dropped)
+        assert indexed_table.missing_indexes() == []
+
+    def test_drop_undeclared(self, indexed_table):
+        """Tests that other indexes are only dropped when asked"""
+
+        indexed_table.execute("CREATE INDEX test_indexed_extra "
+                              f"ON {indexed_table.name} (col2)")
+        assert "test_indexed_extra" not in indexed_table.drop_indexes()
+        dropped = indexed_table.drop_indexes(undeclared=True)
+        assert dropped == ["test_indexed_extra"]
+
+    def test_invalid_index(self, indexed_table):
+        """Tests that invalid indexes are reported and rebuilt"""
+
+        indexed_table.execute("""UPDATE pg_index SET indisvalid = false
+                              WHERE indexrelid = 'test_indexed_both'::regclass
+                              """)
+        assert indexed_table.missing_indexes() == [IndexedTable.indexes[1]]
+        assert indexed_table.create_indexes() == ["test_indexed_both"]
+        assert indexed_table.missing_indexes() == []
+
+    def test_deferred_indexes(self, indexed_table):
+        """Tests loading without indexes, then rebuilding them"""
+
+        with indexed_table.deferred_indexes(workers=3):
+            assert len(indexed_table.missing_indexes()) == 5
+            indexed_table.bulk_insert_stream(
+                [{"col1": i, "col2": i, "col3": str(i)} for i in range(100)])
+        assert indexed_table.missing_indexes() == []
+        assert indexed_table.get_count() == 100
+
+    def test_deferred_failed_constraint(self, indexed_table):
+        """Tests that indexes are rebuilt even if the load fails"""
+
+        with pytest.raises(Exception):
+            with indexed_table.deferred_indexes():
+                indexed_table.bulk_insert_stream([{"col1": -1}])
+        # The rows broke the CHECK, so it can't be added back
+        assert [x.name for x in indexed_table.missing_indexes()] == [
+            "test_indexed_positive"]
+        assert len(indexed_table.schema.indexes) == 4
+
+    def test_deferred_in_transaction(self, indexed_table):
+        """Tests that builds are on the table's connection in a transaction"""
+
+        with indexed_table.bulk_session():
+            with indexed_table.deferred_indexes():
+                indexed_table.bulk_insert_stream([{"col1": 1, "col2": 1}])
+        assert indexed_table.missing_indexes() == []
@@ -0,0 +1,79 @@
+import psycopg2
+import pytest
+
+from ..database import Database
+from ..instrumentation import Instrumentation
+
+
+@pytest.mark.instrumentation
+class TestInstrumentation:
+    """Tests timing and aggregating execute calls"""
+
+    def test_disabled_by_default(self):
+        """Tests that there is no instrumentation unless asked for"""
+
+        with Database() as db:
+            assert db.instrumentation is None
+
+    def test_aggregates(self, test_table):
+        """Tests counts, rows and bytes per normalized statement"""
+
+        with Database(instrumentation=True) as db:
+            sql = f"SELECT * FROM {test_table.name} WHERE col1 = %s"
+            for row in test_table.default_rows:
+                db.execute(sql, [row["col1"]])
+            db.execute(f"SELECT  *  FROM {test_table.name}")
+            stats = db.instrumentation.snapshot()["statements"]
+            assert stats[sql]["count"] == len(test_table.default_rows)
+            assert stats[sql]["rows"] == len(test_table.default_rows)
+            assert stats[sql]["bytes"] > len(sql)
+            assert (stats[sql]["p50_seconds"]
+                    <= stats[sql]["p99_seconds"]
+                    <= stats[sql]["max_seconds"])
+            assert stats[f"SELECT * FROM {test_table.name}"]["rows"] == 2
+
+    def test_affected_rows_and_errors(self, test_table):
+        """Tests that writes count rows affected, and errors count"""
+
+        with Database(instrumentation=True) as db:
+            db.execute(f"UPDATE {test_table.name} SET col2 = 0")
+            with pytest.raises(psycopg2.Error):
+                db.execute("SELECT * FROM not_a_table")
+            stats = db.instrumentation.snapshot()["statements"]
+            assert stats[f"UPDATE {test_table.name} SET col2 = 0"]["rows"] == 2
+            assert stats["SELECT * FROM not_a_table"]["errors"] == 1
+
+    def test_hooks(self):
+        """Tests that before and after hooks are called"""
+
+        before, after = [], []
+        instrumentation = Instrumentation()
+        instrumentation.add_hooks(before=lambda sql, data: before.append(sql),
+                                  after=after.append)
+        with Database(instrumentation=instrumentation) as db:
+            db.execute("SELECT %s AS x", [1])
+        assert before == ["SELECT %s AS x"]
+        assert after[0].rows == 1 and after[0].error is None
+
+    def test_shared_snapshot_reset(self, test_table):
+        """Tests sharing one instrumentation, and resetting it"""
+
+        instrumentation = Instrumentation()
+        for _ in range(2):
+            with Database(instrumentation=instrumentation) as db:
+                db.execute("SELECT 1")
+        snapshot = instrumentation.snapshot(reset=True)
+        assert snapshot["statements"]["SELECT 1"]["count"] == 2
+        assert instrumentation.snapshot()["statements"] == {}
+
+    def test_slow_query_explain(self):
+        """Tests that slow SELECTs are logged with their plan"""
+
+        instrumentation = Instrumentation(slow_query_ms=0)
+        with Database(instrumentation=instrumentation) as db:
+            assert db.execute("SELECT 1 AS x") == [{"x": 1}]
+            db.execute("SET work_mem TO '64MB'")
+        slow = instrumentation.snapshot()["slow_queries"]
+        assert "Buffers" in slow[0]["plan"] or "actual" in slow[0]["plan"]
+        # Only SELECTs are explained
+        assert slow[1]["plan"] is None
@@ -0,0 +1,111 @@
+import pytest
+
+from lib_utils.file_funcs import delete_paths
+
+from ..parallel_load import split_tsv
+
+
+@pytest.fixture
+def tsv_path():
+    """Writes a TSV with a header and 1000 rows for the test table"""
+
+    path = "/tmp/test_parallel_load.tsv"
+    with open(path, "w") as f:
+        f.write("col1\tcol2\n")
+        for i in range(2, 1002):
+            f.write(f"{i}\t{i}\n")
+    yield path
+    delete_paths(path)
+
+
+@pytest.mark.parallel_load
+class TestParallelLoad:
+    """Tests loading chunks of data in worker processes"""
+
+    @pytest.mark.parametrize("chunk_bytes", [1, 100, 10 ** 6])
+    def test_split_tsv(self, tsv_path, chunk_bytes):
+        """Tests that ranges are contiguous lines, without the header"""
+
+        ranges = split_tsv(tsv_path, chunk_bytes)
+        with open(tsv_path, "rb") as f:
+            data = f.read()
+        assert ranges[0][1] == len(b"col1\tcol2\n")
+        assert ranges[-1][2] == len(data)
+        for (_, start, end), (_, next_start, _) in zip(ranges, ranges[1:]):
+            assert end == next_start
+        for _, start, end in ranges:
+            assert data[end - 1:end] == b"\n"
+
+    def test_split_tsv_load(self, test_table, tsv_path):
+        """Tests that a split TSV is loaded across workers"""
+
+        results = test_table.parallel_bulk_insert(tsv_path,
+                                                  workers=2,
+                                                  chunk_bytes=1000)
+        assert len(results) > 2
+        assert not any(x.error for x in results)
+        assert sum(x.rows for x in results) == 1000
+        assert test_table.get_count() == len(test_table.default_rows) + 1000
+
+    def test_row_chunks(self, test_table):
+        """Tests loading an iterator of row chunks"""
+
+        chunks = ([{"col1": i, "col2": i}] * 10 for i in range(2, 7))
+        results = test_table.parallel_bulk_insert(chunks, workers=2)
+        assert [x.rows for x in results] == [10] * 5
+        assert test_table.get_count() == len(test_table.default_rows) + 50
+
+    def test_failed_chunk_retry(self, test_table, tsv_path):
+        """Tests that failures are per chunk and can be retried"""
+
+        test_table.execute(f"ALTER TABLE {test_table.name} "
+                           "ADD CONSTRAINT col1_small CHECK (col1 < 500)")
+        results = test_table.parallel_bulk_insert(tsv_path,
+                                                  workers=2,
+                                                  chunk_bytes=1000)
+        failed = [x for x in results if x.error]
+        assert failed and len(failed) < len(results)
+        test_table.execute(f"ALTER TABLE {test_table.name} "
+                           "DROP CONSTRAINT col1_small")
+        retried = test_table.parallel_bulk_insert([x.source for x in failed])
+        assert not any(x.error for x in retried)
+        assert test_table.get_count() == len(test_table.default_rows) + 1000
+
+    def test_failed_row_chunk_retry(self, test_table):
+        """Tests that failed chunks of rows keep their rows to retry"""
+
+        test_table.execute(f"ALTER TABLE {test_table.name} "
+                           "ADD CONSTRAINT col1_small CHECK (col1 < 5)")
+        chunks = ([{"col1": i, "col2": i}] * 10 for i in range(2, 7))
+        results = test_table.parallel_bulk_insert(chunks, workers=2)
+        failed = [x for x in results if x.error]
+        assert [x.chunk for x in failed] == [3, 4]
+        assert [x.source for x in failed] == [[{"col1": i, "col2": i}] * 10
+                                              for i in (5, 6)]
+        assert not any(x.source for x in results if not x.error)
+        test_table.execute(f"ALTER TABLE {test_table.name} "
+                           "DROP CONSTRAINT col1_small")
+        retried = test_table.parallel_bulk_insert([x.source for x in failed])
+        assert not any(x.error for x in retried)
+        assert test_table.get_count() == len(test_table.default_rows) + 50
+
+    def test_drop_indexes(self, test_table, tsv_path):
+        """Tests that indexes are dropped and then recreated"""
+
+        test_table.execute(f"CREATE INDEX test_col1 ON {test_table.name} "
+                           "(col1)")
+        test_table.execute("""CREATE FUNCTION test_noop() RETURNS trigger
+                              AS 'BEGIN RETURN NEW; END' LANGUAGE plpgsql""")
+        test_table.execute(f"""CREATE TRIGGER test_noop
+                               BEFORE INSERT ON {test_table.name}
+                               FOR EACH ROW EXECUTE PROCEDURE test_noop()""")
+        test_table.parallel_bulk_insert(tsv_path,
+                                        workers=2,
+                                        drop_indexes=True,
+                                        disable_triggers=True)
+        sql = "SELECT COUNT(*) FROM pg_indexes WHERE indexname = %s"
+        assert test_table.get_count(sql, ["test_col1"]) == 1
+        # Triggers are enabled again after the load
+        sql = "SELECT tgenabled FROM pg_trigger WHERE tgname = %s"
+        assert [x["tgenabled"] for x in test_table.execute(
+            sql, ["test_noop"])] == ["O"]
@@ -0,0 +1,174 @@
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+
+from ..generic_table import GenericTable
+from ..partitioning import Partitioning, partition_clause, partition_for
+
+
+class RangeTable(GenericTable):
+    name = "test_range"
+    id_col = None
+    partitioning = Partitioning("range", "day", interval="month")
+
+    def create_table(self):
+        self.execute(f"""CREATE TABLE IF NOT EXISTS {self.name}(
+                         day DATE, col1 INTEGER) {self.partition_by};""")
+
+
+class ListTable(GenericTable):
+    name = "test_list"
+    id_col = None
+    partitioning = Partitioning("list", "kind")
+
+    def create_table(self):
+        self.execute(f"""CREATE TABLE IF NOT EXISTS {self.name}(
+                         kind TEXT, col1 INTEGER) {self.partition_by};""")
+
+
+class HashTable(GenericTable):
+    name = "test_hash"
+    id_col = None
+    partitioning = Partitioning("hash", "col1", modulus=4)
+
+    def create_table(self):
+        self.execute(f"""CREATE TABLE IF NOT EXISTS {self.name}(
+                         col1 INTEGER) {self.partition_by};""")
+
+
+@pytest.fixture(params=[RangeTable, ListTable, HashTable])
+def partitioned_table(request, database_clone):
+    table = request.param(clear=True)
+    yield table
+    table.close()
+
+
+def _counts(table) -> dict:
+    """Returns {partition: rows}"""
+
+    return {x.name: table.get_count(f"SELECT COUNT(*) FROM {x.name}")
+            for x in table.partitions()}
+
+
+@pytest.mark.partitioning
+class TestPartitioning:
+    """Tests partitioned tables"""
+
+    def test_partition_for(self):
+        """Tests working out which partition a value belongs in"""
+
+        months = Partitioning("range", "day", interval="month")
+        assert partition_for("t", months, date(2024, 12, 31)) == (
+            "t_p20241201", "FROM (%s) TO (%s)",
+            [date(2024, 12, 1), date(2025, 1, 1)])
+        weeks = Partitioning("range", "day", interval="week")
+        assert partition_for("t", weeks, datetime(2024, 5, 1, 12))[2] == [
+            datetime(2024, 4, 29), datetime(2024, 5, 6)]
+        numbers = Partitioning("range", "col1", interval=100)
+        assert partition_for("t", numbers, -5)[::2] == ("t_pm100", [-100, 0])
+        kinds = Partitioning("list", "kind")
+        assert partition_for("t", kinds, "a")[0] == "t_pa"
+        assert partition_for("t", kinds, None)[:2] == ("t_pnull", "IN (NULL)")
+        # Sanitized names don't collide
+        assert (partition_for("t", kinds, "a-b")[0]
+                != partition_for("t", kinds, "a_b")[0])
+        assert partition_clause(kinds) == "PARTITION BY LIST (kind)"
+
+    def test_hash_created_with_table(self, database_clone):
+        """Tests that every hash partition exists from the start"""
+
+        with HashTable(clear=True) as table:
+            assert [x.name for x in table.partitions()] == [
+                f"test_hash_p{i}" for i in range(4)]
+
+    def test_on_demand(self, partitioned_table):
+        """Tests that partitions are made as rows need them"""
+
+        table = partitioned_table
+        rows = [self._row(table, i) for i in range(40)]
+        table.insert(dict(rows[0]))
+        table.insert_many([dict(x) for x in rows[1:10]])
+        table.bulk_insert(rows[10:20])
+        table.bulk_insert_stream(rows[20:])
+        assert table.get_count() == 40
+        counts = _counts(table)
+        assert sum(counts.values()) == 40
+        assert len(counts) == 4
+
+    def test_on_demand_binary(self, partitioned_table):
+        """Tests that binary COPYs make the partitions they need"""
+
+        table = partitioned_table
+        rows = [self._row(table, i) for i in range(40)]
+        table.bulk_insert_binary(rows[:20])
+        columns = {k: np.array([x[k] for x in rows[20:]],
+                               dtype="datetime64[D]" if k == "day"
+                               else None)
+                   for k in rows[0]}
+        table.bulk_insert_columns(columns)
+        counts = _counts(table)
+        assert sum(counts.values()) == table.get_count() == 40
+        assert len(counts) == 4
+
+    def test_overlapping_partition(self, database_clone):
+        """Tests rows that fall in a partition made by hand"""
+
+        with RangeTable(clear=True) as table:
+            table.execute("""CREATE TABLE test_range_manual
+                             PARTITION OF test_range FOR VALUES
+                             FROM ('2024-01-15') TO ('2024-02-15')""")
+            rows = [[date(2024, 1, 20), 1], [date(2024, 3, 5), 2]]
+            table.copy_partitioned(iter(rows), ["day", "col1"])
+            table.insert({"day": date(2024, 1, 21), "col1": 3})
+            assert _counts(table) == {"test_range_manual": 2,
+                                      "test_range_p20240301": 1}
+
+    def test_routing(self, database_clone):
+        """Tests that COPYs go into each partition, in route_size batches"""
+
+        with RangeTable(clear=True) as table:
+            rows = ([date(2024, 1 + i % 3, 1 + i % 28), i]
+                    for i in range(300))
+            table.copy_partitioned(rows, ["day", "col1"], route_size=7)
+            assert _counts(table) == {"test_range_p20240101": 100,
+                                      "test_range_p20240201": 100,
+                                      "test_range_p20240301": 100}
+
+    def test_retention(self, database_clone):
+        """Tests dropping, detaching and truncating old partitions"""
+
+        with RangeTable(clear=True) as table:
+            table.bulk_insert([{"day": date(2024, i, 1), "col1": i}
+                               for i in range(1, 7)])
+            old = table.old_partitions(date(2024, 4, 1))
+            assert old == ["test_range_p20240101", "test_range_p20240201",
+                           "test_range_p20240301"]
+            table.drop_partitions(old[:1])
+            table.detach_partitions(old[1:2])
+            table.truncate_partitions(old[2:])
+            assert table.get_count() == 3
+            assert len(table.partitions()) == 4
+            # Inserting into a dropped month makes it again
+            table.insert({"day": date(2024, 1, 5), "col1": 0})
+            assert len(table.partitions()) == 5
+
+    def test_maintain(self, partitioned_table):
+        """Tests running maintenance on every partition"""
+
+        table = partitioned_table
+        table.bulk_insert([self._row(table, i) for i in range(40)])
+        table.maintain_partitions(workers=2)
+        sql = """SELECT COUNT(*) FROM pg_stat_user_tables
+              WHERE relname LIKE %s AND last_analyze IS NOT NULL"""
+        assert table.get_count(sql, [f"{table.name}_p%"]) == 4
+
+    @staticmethod
+    def _row(table, i: int) -> dict:
+        """Returns a row that lands in one of 4 partitions"""
+
+        if isinstance(table, RangeTable):
+            return {"day": date(2024, 1 + i % 4, 1 + i % 28), "col1": i}
+        elif isinstance(table, ListTable):
+            return {"kind": ["a", "b", "c", None][i % 4], "col1": i}
+        return {"col1": i}
@@ -0,0 +1,103 @@
+from threading import Event, Thread
+
+import pytest
+from psycopg2.pool import PoolError
+
+from ..database import Database
+from ..pool import ConnectionPool, get_pool
+from ..postgres import DEFAULT_CONF_SECTION, Postgres
+
+
+@pytest.mark.pool
+class TestPool:
+    """Tests the connection pool and pooled databases"""
+
+    @pytest.fixture
+    def pool(self):
+        """Returns a small pool that is closed afterwards"""
+
+        creds = Postgres()._get_db_creds(DEFAULT_CONF_SECTION)
+        pool = ConnectionPool(creds, minconn=0, maxconn=2, timeout=.5)
+        yield pool
+        pool.closeall()
+
+    def test_get_pool(self):
+        """Tests that there is one pool per conf section"""
+
+        assert get_pool() is get_pool(DEFAULT_CONF_SECTION)
+
+    def test_pooled_database(self, test_table):
+        """Tests that connections are reused and not closed"""
+
+        with Database(pooled=True) as db:
+            conn = db._conn
+            test_table.match_default_rows(
+                db.execute(f"SELECT * FROM {test_table.name}"))
+        with Database(pooled=True) as db:
+            assert db._conn is conn
+        assert not conn.closed
+
+    def test_checkout_timeout(self, pool):
+        """Tests that checkouts wait, then error, when all are in use"""
+
+        conns = [pool.getconn(), pool.getconn()]
+        with pytest.raises(PoolError):
+            pool.getconn(timeout=.1)
+        assert pool.stats["timeouts"] == 1
+        for conn in conns:
+            pool.putconn(conn)
+
+    def test_checkout_waits(self, pool, monkeypatch):
+        """Tests that a waiting checkout gets a returned connection"""
+
+        conns = [pool.getconn(), pool.getconn()]
+        waiting = Event()
+        wait = pool._cond.wait
+
+        def signal_wait(timeout=None):
+            # Set with the lock held, so putconn can't run until we wait
+            waiting.set()
+            return wait(timeout)
+
+        def put_back():
+            waiting.wait(5)
+            pool.putconn(conns.pop())
+
+        monkeypatch.setattr(pool._cond, "wait", signal_wait)
+        thread = Thread(target=put_back)
+        thread.start()
+        conns.append(pool.getconn(timeout=5))
+        thread.join()
+        assert pool.stats["waits"] == 1
+        assert pool.stats["in_use"] == 2
+
+    def test_broken_conn_replaced(self, pool):
+        """Tests that closed connections are not handed out"""
+
+        conn = pool.getconn()
+        pool.putconn(conn)
+        conn.close()
+        new_conn = pool.getconn()
+        assert not new_conn.closed
+        assert pool.stats["failed_checks"] == 1
+
+    def test_transaction_rolled_back(self, pool):
+        """Tests that open transactions are rolled back on return"""
+
+        conn = pool.getconn()
+        conn.autocommit = False
+        conn.cursor().execute("SELECT 1")
+        pool.putconn(conn)
+        conn = pool.getconn()
+        assert conn.autocommit
+        assert conn.get_transaction_status() == 0
+
+    def test_idle_eviction(self, pool):
+        """Tests that idle connections over minconn are closed"""
+
+        pool.max_idle = -1
+        conns = [pool.getconn(), pool.getconn()]
+        for conn in conns:
+            pool.putconn(conn)
+        assert pool.stats["size"] == 0
+        assert all(conn.closed for conn in conns)
@@ -0,0 +1,75 @@
+import logging
+
+import psycopg2
+import pytest
+
+from ..postgres import Postgres
+from ..postgres import postgres_admin
+
+
+@pytest.mark.postgres_admin
+class TestPostgresAdmin:
+    """Tests running SQL in one superuser session"""
+
+    def test_structured_results(self):
+        """Tests that rows come back per statement"""
+
+        results = Postgres().run_sql_session(["SELECT 1 AS x;",
+                                              "SET work_mem TO '64MB';",
+                                              "SELECT 2 AS x;"])
+        assert results == [[{"x": 1}], [], [{"x": 2}]]
+
+    def test_non_transactional(self):
+        """Tests statements that can't run inside a transaction"""
+
+        db = "lib_database_admin_test"
+        results = Postgres().run_sql_session([
+            f"DROP DATABASE IF EXISTS {db};",
+            f"CREATE DATABASE {db};",
+            f"SELECT datname FROM pg_database WHERE datname = '{db}';",
+            f"DROP DATABASE {db};"])
+        assert results[2] == [{"datname": db}]
+
+    def test_error_raised(self):
+        """Tests that a failing statement raises"""
+
+        with pytest.raises(psycopg2.Error):
+            Postgres().run_sql_session(["SELECT * FROM not_a_table;"])
+
+    def test_fallback(self, monkeypatch):
+        """Tests falling back to psql when there's no superuser conn"""
+
+        def fail(*args, **kwargs):
+            raise psycopg2.OperationalError("no superuser")
+
+        ran = []
+        monkeypatch.setattr(Postgres, "_admin_connect", fail)
+        monkeypatch.setattr(Postgres,
+                            "run_sql_cmds",
+                            lambda self, sqls, database=None: ran.extend(sqls))
+        assert Postgres().run_sql_session(["SELECT 1;"]) is None
+        assert ran == ["SELECT 1;"]
+
+    def test_fallback_warns_once(self, monkeypatch, caplog):
+        """Tests that a process warns once about having no superuser conn"""
+
+        def fail(*args, **kwargs):
+            raise psycopg2.OperationalError("no superuser")
+
+        monkeypatch.setattr(postgres_admin, "_warned_pids", set())
+        monkeypatch.setattr(Postgres, "_admin_connect", fail)
+        monkeypatch.setattr(Postgres,
+                            "run_sql_cmds",
+                            lambda self, sqls, database=None: None)
+        with caplog.at_level(logging.DEBUG):
+            for _ in range(3):
+                Postgres().run_sql_session(["SELECT 1;"])
+        levels = [x.levelno for x in caplog.records
+                  if "No superuser connection" in x.getMessage()]
+        assert levels == [logging.WARNING, logging.DEBUG, logging.DEBUG]
+
+    def test_semicolon_required(self):
+        """Tests that statements need a ; with or without psql"""
+
+        with pytest.raises(AssertionError):
+            Postgres().run_sql_session(["SELECT 1"])
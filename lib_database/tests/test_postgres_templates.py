@@ -0,0 +1,103 @@
+from subprocess import CalledProcessError
+
+import pytest
+
+from lib_config import Config
+
+from ..database import Database
+from ..postgres import Postgres
+
+
+def _setup(conf_section):
+    with Database(conf_section) as db:
+        db.execute("CREATE TABLE provisioned (x INT)")
+        db.execute("INSERT INTO provisioned VALUES (1)")
+
+
+@pytest.fixture(scope="module")
+def provisioned_template():
+    template = "lib_database_test_provisioned"
+    Postgres().create_template(template, setup=_setup)
+    yield template
+    Postgres().drop_template(template)
+
+
+@pytest.mark.postgres_templates
+class TestPostgresTemplates:
+    """Tests cloning databases from templates"""
+
+    def test_clone_has_template_data(self, provisioned_template):
+        """Tests that clones start with what setup made"""
+
+        postgres = Postgres()
+        clones = [postgres.clone_database(provisioned_template)
+                  for _ in range(2)]
+        try:
+            with Database(clones[0]) as db:
+                db.execute("INSERT INTO provisioned VALUES (2)")
+            counts = []
+            for clone in clones:
+                with Database(clone) as db:
+                    counts.append(db.execute(
+                        "SELECT COUNT(*) FROM provisioned")[0]["count"])
+            # Clones are independent of each other
+            assert counts == [2, 1]
+        finally:
+            for clone in clones:
+                postgres.drop_clone(clone)
+
+    def test_drop_clone(self, provisioned_template):
+        """Tests that only the clone's connections are closed"""
+
+        postgres = Postgres()
+        clone = postgres.clone_database(provisioned_template, "test_dropped")
+        with Database() as other:
+            clone_db = Database(clone)
+            postgres.drop_clone(clone)
+            assert other.execute("SELECT 1 AS x") == [{"x": 1}]
+            with pytest.raises(Exception):
+                clone_db.execute("SELECT 1")
+        with Config(write=False) as conf_dict:
+            assert clone not in conf_dict
+        sql = "SELECT COUNT(*) FROM pg_database WHERE datname = %s"
+        with Database() as db:
+            assert db.execute(sql, [clone])[0]["count"] == 0
+
+    def test_drop_without_force(self, provisioned_template, monkeypatch):
+        """Tests dropping when WITH (FORCE) fails, such as through psql"""
+
+        postgres = Postgres()
+        clone = postgres.clone_database(provisioned_template)
+        run_sql_session = Postgres.run_sql_session
+
+        def no_force(self, sqls, *args, **kwargs):
+            if any("FORCE" in x for x in sqls):
+                raise CalledProcessError(1, "psql")
+            return run_sql_session(self, sqls, *args, **kwargs)
+
+        monkeypatch.setattr(Postgres, "run_sql_session", no_force)
+        clone_db = Database(clone)
+        postgres.drop_clone(clone)
+        with pytest.raises(Exception):
+            clone_db.execute("SELECT 1")
+        sql = "SELECT COUNT(*) FROM pg_database WHERE datname = %s"
+        with Database() as db:
+            assert db.execute(sql, [clone])[0]["count"] == 0
+
+    def test_drop_missing_template(self):
+        """Tests that dropping a template that doesn't exist does nothing"""
+
+        postgres = Postgres()
+        postgres.drop_template("lib_database_test_missing")
+        sql = "SELECT COUNT(*) FROM pg_database WHERE datname = %s"
+        with Database() as db:
+            assert db.execute(sql, ["lib_database_test_missing"])[0][
+                "count"] == 0
+
+    def test_default_conf_section(self, database_clone):
+        """Tests that Database looks the default section up when made"""
+
+        with Database() as db:
+            assert db._database == database_clone
+            assert db.execute("SELECT current_database()")[0][
+                "current_database"] == database_clone
@@ -0,0 +1,118 @@
+import pytest
+
+from ..postgres import Postgres, TUNING_PROFILES
+from ..postgres.postgres_tuning import setting_changed
+
+
+def _row(setting, unit=None, vartype="integer"):
+    return {"setting": setting, "unit": unit, "vartype": vartype}
+
+
+@pytest.mark.postgres_tuning
+class TestPostgresTuning:
+    """Tests workload profiles and diffing them against pg_settings"""
+
+    def test_setting_changed_units(self):
+        """Tests comparing values in other units than pg_settings"""
+
+        # shared_buffers is in 8kB pages
+        assert not setting_changed("1GB", _row("131072", "8kB"))
+        assert setting_changed("2GB", _row("131072", "8kB"))
+        assert not setting_changed("4096kB", _row("4096", "kB"))
+        assert not setting_changed("10min", _row("600", "s"))
+        assert not setting_changed(4, _row("4"))
+        assert not setting_changed(.9, _row("0.9", vartype="real"))
+        assert setting_changed(5, _row("4"))
+        assert setting_changed(.05, _row("0.2", vartype="real"))
+        assert setting_changed(.02, _row("0.1", vartype="real"))
+        assert setting_changed(.9, _row("0.5", vartype="real"))
+        assert not setting_changed("2.5ms", _row("2.5", "ms", "real"))
+        assert not setting_changed("off", _row("false", vartype="bool"))
+        assert setting_changed("on", _row("off", vartype="bool"))
+        assert not setting_changed("Minimal", _row("minimal",
+                                                   vartype="enum"))
+
+    @pytest.mark.parametrize("profile", list(TUNING_PROFILES))
+    def test_dry_run(self, profile, monkeypatch):
+        """Tests that every profile diffs without changing anything"""
+
+        def fail(*args, **kwargs):
+            raise AssertionError("Dry runs must not change settings")
+
+        sqls = []
+        run_sql_session = Postgres.run_sql_session
+
+        def record(self, cmds, *args, **kwargs):
+            sqls.extend(cmds)
+            return run_sql_session(self, cmds, *args, **kwargs)
+
+        monkeypatch.setattr(Postgres, "restart_postgres", fail)
+        monkeypatch.setattr(Postgres, "run_sql_session", record)
+        changes = Postgres()._modify_db(ram=4000,
+                                        cpus=2,
+                                        profile=profile,
+                                        dry_run=True)
+        for change in changes:
+            assert set(change) == {"name", "current", "new", "restart"}
+        assert not [x for x in sqls if "ALTER" in x.upper()
+                    or "pg_reload_conf" in x]
+
+    def test_dry_run_only_diffs(self, monkeypatch):
+        """Tests that a dry run returns only the settings that differ"""
+
+        postgres = Postgres()
+        current = postgres.run_sql_session(["SHOW work_mem;"])[0][0]
+        max_connections = postgres.run_sql_session(
+            ["SHOW max_connections;"])[0][0]["max_connections"]
+        settings = {"work_mem": current["work_mem"],
+                    "max_connections": int(max_connections) + 1}
+
+        def profile(self, ram, cpus, ssd):
+            return settings
+
+        changes = postgres._modify_db(profile=profile, dry_run=True)
+        assert [x["name"] for x in changes] == ["max_connections"]
+        assert changes[0]["new"] == int(max_connections) + 1
+        # Nothing was changed, so the same diff comes back
+        assert postgres._modify_db(profile=profile, dry_run=True) == changes
+
+    def test_reload_without_restart(self, monkeypatch):
+        """Tests that settings that don't need a restart are reloaded"""
+
+        restarts = []
+        monkeypatch.setattr(Postgres,
+                            "restart_postgres",
+                            staticmethod(lambda: restarts.append(True)))
+        postgres = Postgres()
+        try:
+            changes = postgres._modify_db(
+                profile=lambda self, ram, cpus, ssd: {"work_mem": "77MB"})
+            assert [x["name"] for x in changes] == ["work_mem"]
+            assert not restarts
+            sql = "SELECT setting FROM pg_settings WHERE name = 'work_mem';"
+            assert postgres.run_sql_session([sql])[0] == [{"setting": "78848"}]
+            # Nothing is left to change
+            assert postgres._modify_db(
+                profile=lambda self, ram, cpus, ssd: {"work_mem": "77MB"}
+            ) == []
+        finally:
+            postgres.run_sql_session(["ALTER SYSTEM RESET work_mem;",
+                                      "SELECT pg_reload_conf();"])
+
+    def test_restart_when_needed(self, monkeypatch):
+        """Tests that postmaster settings restart postgres"""
+
+        restarts = []
+        monkeypatch.setattr(Postgres,
+                            "restart_postgres",
+                            staticmethod(lambda: restarts.append(True)))
+        postgres = Postgres()
+        try:
+            current = postgres.run_sql_session(["SHOW max_connections;"])
+            new = int(current[0][0]["max_connections"]) + 1
+            changes = postgres._modify_db(
+                profile=lambda self, ram, cpus, ssd: {"max_connections": new})
+            assert changes[0]["restart"]
+            assert restarts == [True]
+        finally:
+            postgres.run_sql_session(["ALTER SYSTEM RESET max_connections;"])
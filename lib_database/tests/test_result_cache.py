@@ -0,0 +1,126 @@
+import time
+
+import pytest
+
+from ..database import Database
+from ..result_cache import ResultCache, tables_read, tables_written
+from ..rows import RowCursor
+
+
+@pytest.fixture
+def cache():
+    return ResultCache(capacity=4, ttl=60)
+
+
+@pytest.mark.result_cache
+class TestResultCache:
+    """Tests caching SELECT results"""
+
+    def test_tables(self):
+        """Tests finding the tables queries read and write"""
+
+        assert tables_read("SELECT * FROM a JOIN b ON a.x = b.x, "
+                           "public.c AS c1, d WHERE a.x = 1") == [
+            "a", "b", "c", "d"]
+        assert tables_written("SELECT * FROM a") == []
+        assert tables_written("INSERT INTO a VALUES (1)") == ["a"]
+        assert tables_written("TRUNCATE TABLE a, b") == ["a", "b"]
+        assert tables_written("DROP TABLE IF EXISTS a CASCADE") == ["a"]
+        assert tables_written("WITH x AS (DELETE FROM a RETURNING *) "
+                              "SELECT * FROM x") == ["a"]
+        assert tables_written("SELECT * INTO b FROM a") == ["b"]
+        assert tables_written("DO $$ BEGIN END $$") is None
+
+    def test_hits(self, test_table, cache):
+        """Tests that identical queries are answered from the cache"""
+
+        with Database(result_cache=cache) as db:
+            sql = f"SELECT * FROM {test_table.name} WHERE col1 = %s"
+            first = db.execute(sql, [1])
+            # Whitespace doesn't matter, params do
+            assert db.execute(sql.replace(" ", "  "), [1]) == first
+            db.execute(sql, [0])
+            assert cache.stats["hits"] == 1
+            assert cache.stats["misses"] == 2
+            # Rows are copies, so changing them doesn't change the cache
+            first[0]["col2"] = 100
+            assert db.execute(sql, [1])[0]["col2"] == 1
+
+    def test_uncacheable(self, test_table, cache):
+        """Tests that volatile and locking queries aren't cached"""
+
+        with Database(result_cache=cache) as db:
+            for _ in range(2):
+                db.execute("SELECT now()")
+                db.execute(f"SELECT * FROM {test_table.name} FOR UPDATE")
+                with db.transaction():
+                    db.execute(f"SELECT * FROM {test_table.name}")
+        assert cache.stats["hits"] == cache.stats["size"] == 0
+
+    def test_write_invalidation(self, test_table, cache):
+        """Tests that writes through the library drop a table's entries"""
+
+        sql = f"SELECT COUNT(*) FROM {test_table.name}"
+        test_table.result_cache = cache
+        writes = [lambda: test_table.insert({"col1": 5, "col2": 5}),
+                  lambda: test_table.insert_many([{"col1": 6, "col2": 6}]),
+                  lambda: test_table.bulk_insert([{"col1": 7, "col2": 7}]),
+                  lambda: test_table.bulk_insert_stream([{"col1": 8}]),
+                  lambda: test_table.bulk_insert_binary([{"col1": 9}])]
+        for i, write in enumerate(writes):
+            assert test_table.get_count(sql) == 2 + i
+            assert test_table.get_count(sql) == 2 + i
+            write()
+        assert test_table.get_count(sql) == 2 + len(writes)
+        assert cache.stats["hits"] == len(writes)
+        test_table.clear_table()
+        assert cache.stats["size"] == 0
+
+    def test_other_connection_writes(self, test_table, cache):
+        """Tests that writes on other Databases invalidate the cache"""
+
+        sql = f"SELECT COUNT(*) FROM {test_table.name}"
+        with Database(result_cache=cache) as db:
+            assert db.execute(sql)[0]["count"] == 2
+            test_table.execute(f"DELETE FROM {test_table.name}")
+            assert db.execute(sql)[0]["count"] == 0
+
+    def test_view_invalidation(self, test_table, cache):
+        """Tests that writes to a view's tables drop the view's entries"""
+
+        test_table.execute(f"""CREATE VIEW test_view AS
+                               SELECT * FROM {test_table.name}""")
+        test_table.execute("CREATE VIEW test_view_view AS "
+                           "SELECT * FROM test_view")
+        with Database(result_cache=cache) as db:
+            for view in ["test_view", "test_view_view"]:
+                sql = f"SELECT COUNT(*) FROM {view}"
+                count = db.execute(sql)[0]["count"]
+                assert db.execute(sql)[0]["count"] == count
+                db.execute(f"INSERT INTO {test_table.name} VALUES (5, 5)")
+                assert db.execute(sql)[0]["count"] == count + 1
+
+    def test_transaction_invalidation(self, test_table, cache):
+        """Tests that rows cached in a transaction are dropped at the end"""
+
+        sql = f"SELECT COUNT(*) FROM {test_table.name}"
+        with Database(result_cache=cache) as db:
+            with test_table.transaction():
+                test_table.bulk_insert_stream([{"col1": 5, "col2": 5}])
+                # Another connection can't see the row until the commit
+                assert db.execute(sql)[0]["count"] == 2
+            assert db.execute(sql)[0]["count"] == 3
+
+    def test_lru_and_ttl(self, test_table):
+        """Tests eviction of the least recently used and expired entries"""
+
+        cache = ResultCache(capacity=2, ttl=.05)
+        with Database(result_cache=cache, cursor_factory=RowCursor) as db:
+            for i in range(3):
+                db.execute("SELECT %s AS x", [i])
+            assert cache.stats["evictions"] == 1
+            assert cache.stats["size"] == 2
+            time.sleep(.1)
+            assert db.execute("SELECT %s AS x", [2])[0].x == 2
+            assert cache.stats["expirations"] == 1
+            assert cache.stats["hits"] == 0
@@ -0,0 +1,105 @@
+import pytest
+
+from lib_utils.file_funcs import delete_paths
+
+from ..database import Database
+from ..resumable_load import PROGRESS_TABLE
+
+
+@pytest.fixture
+def tsv_path():
+    """Writes a TSV with a header and 1000 rows for the test table"""
+
+    path = "/tmp/test_resumable_load.tsv"
+    with open(path, "w") as f:
+        f.write("col1\tcol2\n")
+        for i in range(2, 1002):
+            f.write(f"{i}\t{i}\n")
+    yield path
+    delete_paths(path)
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.mark.resumable_load
+class TestResumableLoad:
+    """Tests loads that pick up where they failed"""
+
+    def test_load(self, test_table, tsv_path):
+        """Tests that every chunk is loaded and recorded"""
+
+        progress = []
+        result = test_table.resumable_bulk_insert_tsv(
+            tsv_path, chunk_bytes=1000, progress=progress.append)
+        assert result["rows"] == result["total_rows"] == 1000
+        assert result["skipped"] == 0
+        assert test_table.get_count() == 1002
+        assert test_table.get_count(
+            f"SELECT COUNT(*) FROM {PROGRESS_TABLE}") == result["chunks"]
+        assert progress[-1].chunks_done == result["chunks"]
+        assert progress[-1].bytes_done == progress[-1].num_bytes
+        assert progress[-1].eta_seconds == 0
+
+    def test_resume(self, test_table, tsv_path):
+        """Tests that a rerun skips the chunks that were committed"""
+
+        def crash(progress):
+            if progress.chunks_done == 3:
+                raise Crash()
+
+        with pytest.raises(Crash):
+            test_table.resumable_bulk_insert_tsv(
+                tsv_path, chunk_bytes=1000, progress=crash)
+        assert test_table.get_count() > 2
+        result = test_table.resumable_bulk_insert_tsv(tsv_path,
+                                                      chunk_bytes=1000)
+        assert result["skipped"] == 3
+        assert result["total_rows"] == 1000
+        assert test_table.get_count() == 1002
+        # Once finished, running it again loads nothing
+        again = test_table.resumable_bulk_insert_tsv(tsv_path,
+                                                     chunk_bytes=1000)
+        assert again["rows"] == 0
+        test_table.forget_load(result["load_id"])
+        assert test_table.resumable_bulk_insert_tsv(
+            tsv_path, chunk_bytes=1000)["rows"] == 1000
+
+    def test_two_tables(self, test_table, tsv_path):
+        """Tests that loading a file into another table loads every row"""
+
+        class OtherTable(type(test_table)):
+            name = "test_other"
+
+        test_table.resumable_bulk_insert_tsv(tsv_path, chunk_bytes=1000)
+        with OtherTable(clear=True) as other_table:
+            result = other_table.resumable_bulk_insert_tsv(tsv_path,
+                                                           chunk_bytes=1000)
+            assert result["skipped"] == 0
+            assert result["rows"] == 1000
+            assert other_table.get_count() == 1000
+        assert test_table.get_count() == 1002
+
+    def test_dropped_connection(self, test_table, tsv_path):
+        """Tests that a dropped connection is reconnected and retried"""
+
+        pid = test_table._conn.get_backend_pid()
+
+        def terminate(progress):
+            if progress.chunks_done == 2:
+                with Database() as db:
+                    db.execute("SELECT pg_terminate_backend(%s)", [pid])
+
+        result = test_table.resumable_bulk_insert_tsv(
+            tsv_path, chunk_bytes=1000, progress=terminate)
+        assert test_table._conn.get_backend_pid() != pid
+        assert result["total_rows"] == 1000
+        assert test_table.get_count() == 1002
+
+    def test_not_in_transaction(self, test_table, tsv_path):
+        """Tests that chunks can't be held back by a caller's transaction"""
+
+        with test_table.transaction():
+            with pytest.raises(AssertionError):
+                test_table.resumable_bulk_insert_tsv(tsv_path)
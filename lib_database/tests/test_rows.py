@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import numpy as np
+from psycopg2.extensions import cursor as TupleCursor
+import pytest
+
+from ..database import Database
+from ..rows import Row, RowCursor, row_class
+
+
+@pytest.mark.rows
+class TestRows:
+    """Tests compact rows and columnar results"""
+
+    def test_row_access(self):
+        """Tests reading a Row by index, name and attr"""
+
+        row = row_class(("a", "b", "a"))((1, 2, 3))
+        assert row[0] == 1 and row["b"] == 2 and row.b == 2
+        # The first duplicate wins
+        assert row["a"] == 1
+        assert dict(row) == {"a": 1, "b": 2}
+        assert row == (1, 2, 3)
+        assert row_class(("a", "b", "a")) is type(row)
+
+    def test_row_cursor(self, test_table):
+        """Tests that execute and execute_iter return Rows"""
+
+        with Database(cursor_factory=RowCursor) as db:
+            sql = f"SELECT * FROM {test_table.name} ORDER BY col1"
+            rows = db.execute(sql)
+            assert all(isinstance(x, Row) for x in rows)
+            assert [x.to_dict() for x in rows] == test_table.default_rows
+            assert [dict(x) for x in db.execute_iter(sql)] == [
+                dict(x) for x in rows]
+            assert type(rows[0]) is type(rows[1])
+
+    @pytest.mark.parametrize("cursor_factory", [RowCursor, TupleCursor])
+    def test_generic_table_helpers(self, test_table, cursor_factory):
+        """Tests GenericTable helpers with compact rows"""
+
+        class Table(type(test_table)):
+            name = "test_rows"
+            id_col = "id"
+
+            def create_table(self):
+                self.execute(f"""CREATE TABLE IF NOT EXISTS {self.name}(
+                                id SERIAL PRIMARY KEY, col1 INTEGER);""")
+
+        with Table(clear=True, cursor_factory=cursor_factory) as table:
+            assert table.insert({"col1": 1}) == 1
+            assert table.insert_many([{"col1": 2}, {"col1": 3}]) == [2, 3]
+            assert table.get_count() == 3
+            assert table.columns == ["id", "col1"]
+            assert table.column_types == {"id": "int4", "col1": "int4"}
+            table.clear_table()
+
+    def test_execute_columns(self):
+        """Tests numpy arrays per column, with NULLs masked"""
+
+        sql = """SELECT x::int AS i, x * 1.5::float8 AS f,
+                        NULLIF(x, 2)::bigint AS n, x::text AS t,
+                        '2020-01-01'::timestamp + x * interval '1s' AS ts
+                 FROM generate_series(1, 3) x"""
+        with Database() as db:
+            columns = db.execute_columns(sql)
+        assert columns["i"].dtype == np.int32
+        assert columns["f"].tolist() == [1.5, 3.0, 4.5]
+        assert columns["n"].mask.tolist() == [False, True, False]
+        assert columns["n"].compressed().tolist() == [1, 3]
+        assert columns["t"].tolist() == ["1", "2", "3"]
+        assert columns["ts"][0] == np.datetime64(datetime(2020, 1, 1, 0, 0, 1))
@@ -0,0 +1,104 @@
+import pytest
+
+from ..database import Database
+from ..generic_table import GenericTable
+from ..schema_cache import invalidate_schemas, is_cached
+
+
+class SchemaTable(GenericTable):
+    name = "test_schema"
+    id_col = "id"
+    creates = 0
+
+    def create_table(self):
+        SchemaTable.creates += 1
+        self.execute(f"""CREATE TABLE IF NOT EXISTS {self.name} (
+                        id SERIAL PRIMARY KEY,
+                        val DOUBLE PRECISION NOT NULL,
+                        tags TEXT[]);
+                        CREATE INDEX IF NOT EXISTS test_schema_val
+                            ON {self.name} (val);""")
+
+
+@pytest.fixture
+def schema_table(database_clone):
+    table = SchemaTable(clear=True)
+    yield table
+    table.close()
+
+
+@pytest.mark.schema_cache
+class TestSchemaCache:
+    """Tests the per process cache of table schemas"""
+
+    def test_schema(self, schema_table):
+        """Tests the columns, types, nullability and indexes"""
+
+        schema = schema_table.schema
+        assert schema.columns == ["id", "val", "tags"]
+        assert schema.types == {"id": "int4", "val": "float8",
+                                "tags": "_text"}
+        assert schema.nullable == {"id": False, "val": False, "tags": True}
+        assert schema.primary_key == ["id"]
+        index = [x for x in schema.indexes if x.name == "test_schema_val"][0]
+        assert index.columns == ["val"] and not index.unique
+        assert schema_table.columns == schema.columns
+
+    def test_domain_base_type(self, schema_table):
+        """Tests that domain columns have their base type"""
+
+        schema_table.execute("CREATE DOMAIN positive AS INT "
+                             "CHECK (VALUE > 0)")
+        schema_table.execute(f"ALTER TABLE {schema_table.name} "
+                             "ADD COLUMN n positive")
+        assert schema_table.schema.types["n"] == "int4"
+        schema_table.bulk_insert_binary([{"val": 1.5, "n": 3}])
+        assert schema_table.execute(
+            f"SELECT n FROM {schema_table.name}") == [{"n": 3}]
+
+    def test_other_schema_ignored(self, schema_table):
+        """Tests that a same named table earlier in search_path is ignored"""
+
+        schema_table.execute(f"""CREATE SCHEMA other;
+                                 CREATE TABLE other.{schema_table.name}
+                                     (x INT);
+                                 SET search_path TO other, public;""")
+        schema_table.refresh_schema()
+        assert schema_table.schema.columns == ["id", "val", "tags"]
+
+    def test_create_table_skipped(self, schema_table):
+        """Tests that a cached table isn't created again"""
+
+        creates = SchemaTable.creates
+        with SchemaTable() as table:
+            assert table.insert({"val": 1.0}) == 1
+        assert SchemaTable.creates == creates
+
+    def test_clear_table_invalidates(self, schema_table):
+        """Tests that clear_table drops the cached schema"""
+
+        schema_table.clear_table()
+        assert not is_cached(schema_table, schema_table.name)
+        assert schema_table.schema is None
+        assert schema_table.columns == []
+
+    def test_ddl_invalidates(self, schema_table, test_table):
+        """Tests that DDL through execute drops only that table"""
+
+        test_table.schema
+        with Database() as db:
+            db.execute(f"ALTER TABLE {schema_table.name} ADD COLUMN x INT")
+        assert not is_cached(schema_table, schema_table.name)
+        assert is_cached(test_table, test_table.name)
+        assert schema_table.column_types["x"] == "int4"
+
+    def test_external_ddl_needs_refresh(self, schema_table):
+        """Tests refresh_schema after DDL outside of the library"""
+
+        schema_table.schema
+        schema_table._cursor.execute(
+            f"ALTER TABLE {schema_table.name} ADD COLUMN y INT")
+        assert "y" not in schema_table.columns
+        assert "y" in schema_table.refresh_schema().columns
+        invalidate_schemas()
+        assert not is_cached(schema_table, schema_table.name)
@@ -0,0 +1,113 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+from ..database import Database
+from ..statement_cache import normalize, param_types, to_numbered_params
+
+
+@pytest.mark.statement_cache
+class TestStatementCache:
+    """Tests the prepared statement cache"""
+
+    def test_normalize(self):
+        """Tests that whitespace is collapsed except in quotes/comments"""
+
+        sql = """SELECT  '  a '  FROM x -- comment
+                 WHERE  y = %s;"""
+        assert normalize(sql) == ("SELECT '  a ' FROM x -- comment\n"
+                                  " WHERE y = %s")
+
+    def test_to_numbered_params(self):
+        """Tests that params are numbered and %% unescaped"""
+
+        sql = "SELECT * FROM x WHERE a = %s AND b LIKE 'a%%' AND c = %s"
+        assert to_numbered_params(sql) == (
+            "SELECT * FROM x WHERE a = $1 AND b LIKE 'a%' AND c = $2", 2)
+
+    @pytest.mark.parametrize("sql", ["SELECT %(name)s",
+                                     "SELECT 1; SELECT 2"])
+    def test_unpreparable(self, sql):
+        """Tests named params and multiple statements aren't prepared"""
+
+        assert to_numbered_params(sql) == (None, 0)
+
+    def test_hits_and_misses(self, test_table):
+        """Tests that repeated queries hit the cache and are correct"""
+
+        with Database(prepared_statements=10) as db:
+            sql = f"SELECT * FROM {test_table.name} WHERE col1 = %s"
+            for row in test_table.default_rows * 2:
+                assert db.execute(sql, [row["col1"]]) == [row]
+            assert db.statement_cache.stats["misses"] == 1
+            assert db.statement_cache.stats["hits"] == 3
+
+    @pytest.mark.parametrize("value", [1, 2 ** 40, 2 ** 70, 1.5,
+                                       float("inf"), Decimal("1.5"), True,
+                                       "abc", "1", None, date(2024, 1, 1),
+                                       datetime(2024, 1, 1),
+                                       datetime(2024, 1, 1,
+                                                tzinfo=timezone.utc)])
+    def test_param_types(self, test_table, value):
+        """Tests that prepared results match unprepared ones"""
+
+        sqls = ["SELECT %s AS value, pg_typeof(%s)::text AS type",
+                f"SELECT * FROM {test_table.name} "
+                "WHERE col1::text = %s::text"]
+        if type(value) in (int, float, Decimal):
+            sqls.append(f"SELECT * FROM {test_table.name} WHERE col2 < %s")
+        with Database() as db, Database(prepared_statements=10) as prepared:
+            for sql in sqls:
+                data = [value] * sql.count("%s")
+                for _ in range(2):
+                    assert prepared.execute(sql, data) == db.execute(sql,
+                                                                     data)
+            assert prepared.statement_cache.stats["hits"] > 0
+
+    def test_float_not_cast_to_int(self, test_table):
+        """Tests that 1.5 doesn't match an int column when prepared"""
+
+        with Database(prepared_statements=10) as db:
+            sql = f"SELECT * FROM {test_table.name} WHERE col1 = %s"
+            assert db.execute(sql, [1]) == [{"col1": 1, "col2": 1}]
+            assert db.execute(sql, [1.5]) == []
+            assert db.execute(sql, ["1"]) == [{"col1": 1, "col2": 1}]
+
+    def test_unclear_types_not_prepared(self, test_table):
+        """Tests that params without a clear type run as normal"""
+
+        assert param_types([1, [1, 2]]) is None
+        with Database(prepared_statements=10) as db:
+            sql = f"SELECT * FROM {test_table.name} WHERE col1 = ANY(%s)"
+            assert len(db.execute(sql, [[0, 1]])) == 2
+            assert db.statement_cache.stats["misses"] == 0
+
+    def test_eviction(self, test_table):
+        """Tests that least recently used statements are deallocated"""
+
+        with Database(prepared_statements=1) as db:
+            db.execute("SELECT 1")
+            db.execute("SELECT 2")
+            assert db.statement_cache.stats["evictions"] == 1
+            count = db.execute("SELECT COUNT(*) FROM pg_prepared_statements")
+            assert count[0]["count"] == 1
+
+    def test_ddl_clears_cache(self, test_table):
+        """Tests that a changed table doesn't break prepared SELECT *"""
+
+        with Database(prepared_statements=10) as db:
+            sql = f"SELECT * FROM {test_table.name}"
+            db.execute(sql)
+            db.execute(f"ALTER TABLE {test_table.name} ADD COLUMN col3 INT")
+            assert db.statement_cache.stats["size"] == 0
+            assert "col3" in db.execute(sql)[0]
+
+    def test_insert_uses_cache(self, test_table):
+        """Tests that inserts with the same columns are prepared once"""
+
+        with test_table.__class__(prepared_statements=10) as db:
+            db.fill_table()
+            db.fill_table()
+            assert db.statement_cache.stats["misses"] == 1
+            assert db.get_count() == 3 * len(db.default_rows)
@@ -0,0 +1,98 @@
+import pytest
+
+from ..database import Database
+
+
+@pytest.mark.transaction
+class TestTransaction:
+    """Tests explicit transactions and bulk sessions"""
+
+    def test_commit(self, test_table):
+        """Tests that work is only visible once the block ends"""
+
+        name = test_table.name
+        with Database() as db:
+            with db.transaction():
+                db.execute(f"INSERT INTO {name} VALUES (2, 2)")
+                assert not db._conn.autocommit
+                assert test_table.get_count() == 2
+            assert db._conn.autocommit
+        assert test_table.get_count() == 3
+
+    def test_rollback(self, test_table):
+        """Tests that an error rolls the transaction back"""
+
+        name = test_table.name
+        with Database() as db:
+            with pytest.raises(ValueError):
+                with db.transaction():
+                    db.execute(f"INSERT INTO {name} VALUES (2, 2)")
+                    raise ValueError()
+            assert db._conn.autocommit
+        assert test_table.get_count() == 2
+
+    def test_nested_savepoint(self, test_table):
+        """Tests that a failed nested transaction only undoes its work"""
+
+        name = test_table.name
+        with Database() as db:
+            with db.transaction():
+                db.execute(f"INSERT INTO {name} VALUES (2, 2)")
+                with pytest.raises(Exception):
+                    with db.transaction():
+                        db.execute(f"INSERT INTO {name} VALUES (3, 3)")
+                        db.execute("SELECT * FROM not_a_table")
+                with db.transaction():
+                    db.execute(f"INSERT INTO {name} VALUES (4, 4)")
+        rows = test_table.execute(f"SELECT col1 FROM {name} ORDER BY col1")
+        assert [x["col1"] for x in rows] == [0, 1, 2, 4]
+
+    def test_with_iterator(self, test_table):
+        """Tests iterating inside of a transaction"""
+
+        name = test_table.name
+        with Database() as db:
+            with db.transaction():
+                db.execute(f"INSERT INTO {name} VALUES (2, 2)")
+                assert len(list(db.execute_iter(f"SELECT * FROM {name}"))) == 3
+                assert not db._conn.autocommit
+            assert db._conn.autocommit
+        assert test_table.get_count() == 3
+
+    def test_bulk_session(self, test_table):
+        """Tests that settings are local to the session's transaction"""
+
+        name = test_table.name
+        with Database() as db:
+            # bulk_load tuning turns it off for the cluster
+            synchronous_commit = db.execute("SHOW synchronous_commit")[0][
+                "synchronous_commit"]
+            with db.bulk_session(work_mem="123MB",
+                                 maintenance_work_mem="234MB",
+                                 unlogged=[name]):
+                assert db.execute("SHOW synchronous_commit")[0][
+                    "synchronous_commit"] == "off"
+                assert db.execute("SHOW work_mem")[0]["work_mem"] == "123MB"
+                assert db.execute("SHOW maintenance_work_mem")[0][
+                    "maintenance_work_mem"] == "234MB"
+                assert self._persistence(db, name) == "u"
+                db.execute(f"INSERT INTO {name} VALUES (2, 2)")
+            assert db.execute("SHOW synchronous_commit")[0][
+                "synchronous_commit"] == synchronous_commit
+            assert db.execute("SHOW work_mem")[0]["work_mem"] != "123MB"
+            assert self._persistence(db, name) == "p"
+        assert test_table.get_count() == 3
+
+    def test_table_bulk_session(self, test_table):
+        """Tests that a table can be unlogged during its own load"""
+
+        with test_table.bulk_session(unlogged=True):
+            assert self._persistence(test_table, test_table.name) == "u"
+            test_table.bulk_insert([{"col1": 2, "col2": 2}])
+        assert self._persistence(test_table, test_table.name) == "p"
+        assert test_table.get_count() == 3
+
+    @staticmethod
+    def _persistence(db, name: str) -> str:
+        return db.execute("SELECT relpersistence FROM pg_class "
+                          "WHERE relname = %s", [name])[0]["relpersistence"]
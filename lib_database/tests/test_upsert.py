@@ -0,0 +1,80 @@
+import psycopg2
+import pytest
+
+from ..generic_table import GenericTable
+
+
+class UpsertTable(GenericTable):
+    name = "test_upsert"
+    id_col = None
+
+    def create_table(self):
+        self.execute(f"""CREATE TABLE IF NOT EXISTS {self.name} (
+                        key1 INTEGER,
+                        key2 TEXT,
+                        val DOUBLE PRECISION,
+                        note TEXT,
+                        PRIMARY KEY (key1, key2));""")
+
+
+@pytest.fixture
+def upsert_table(database_clone):
+    table = UpsertTable(clear=True)
+    table.bulk_insert_stream([{"key1": i, "key2": "a", "val": 0.0,
+                               "note": "old"} for i in range(5)])
+    yield table
+    table.close()
+
+
+@pytest.mark.upsert
+class TestUpsert:
+    """Tests bulk upserts through a staging table"""
+
+    def test_insert_and_update(self, upsert_table):
+        """Tests counts and values of inserted and updated rows"""
+
+        rows = [{"key1": i, "key2": "a", "val": float(i), "note": "new"}
+                for i in range(3, 8)]
+        counts = upsert_table.bulk_upsert(rows, ["key1", "key2"])
+        assert counts == {"inserted": 3, "updated": 2, "skipped": 0}
+        values = {x["key1"]: (x["val"], x["note"])
+                  for x in upsert_table.get_all()}
+        assert values[0] == (0.0, "old")
+        assert values[4] == (4.0, "new")
+        assert values[7] == (7.0, "new")
+        # The staging table is gone and the connection is in autocommit
+        assert upsert_table._conn.autocommit
+        assert not upsert_table.execute(
+            "SELECT 1 FROM pg_class WHERE relname LIKE 'test_upsert_stage%%'")
+
+    def test_update_cols(self, upsert_table):
+        """Tests only updating some columns"""
+
+        rows = [{"key1": 0, "key2": "a", "val": 9.0, "note": "new"}]
+        upsert_table.bulk_upsert(rows, ["key1", "key2"], update_cols=["val"])
+        row = upsert_table.execute(
+            f"SELECT * FROM {upsert_table.name} WHERE key1 = 0")[0]
+        assert (row["val"], row["note"]) == (9.0, "old")
+
+    def test_do_nothing_and_duplicates(self, upsert_table):
+        """Tests skipping conflicts, and that the last duplicate wins"""
+
+        rows = [(0, "a", 1.0), (10, "a", 1.0), (10, "a", 2.0)]
+        counts = upsert_table.bulk_upsert(rows,
+                                          ["key1", "key2"],
+                                          update_cols=[],
+                                          columns=["key1", "key2", "val"])
+        assert counts == {"inserted": 1, "updated": 0, "skipped": 1}
+        assert upsert_table.get_count(
+            f"SELECT COUNT(*) FROM {upsert_table.name} WHERE val = 2") == 1
+
+    def test_rolls_back(self, upsert_table):
+        """Tests that a failed upsert changes nothing"""
+
+        rows = [{"key1": 0, "key2": "a", "val": 5.0},
+                {"key1": None, "key2": "b", "val": 5.0}]
+        with pytest.raises(psycopg2.Error):
+            upsert_table.bulk_upsert(rows, ["key1", "key2"])
+        assert upsert_table.get_count(
+            f"SELECT COUNT(*) FROM {upsert_table.name} WHERE val = 5") == 0
+        assert upsert_table._conn.autocommit
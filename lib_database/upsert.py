@@ -0,0 +1,102 @@
+from itertools import count
+import logging
+
+from .binary_copy import TYPES, BinaryCopyEncoder
+from .copy_buffer import CopyBuffer, encode_text_rows, peek_columns
+from .rows import row_value
+
+
+_stage_ids = count()
+# Order of rows in the staging table, so the last duplicate wins
+_ROW_COL = "lib_database_row"
+
+
+def bulk_upsert(self,
+                rows,
+                conflict_cols: list,
+                update_cols: list = None,
+                columns: list = None,
+                batch_size: int = 1000) -> dict:
+    """Inserts rows, updating those that conflict, in one statement
+
+    rows are dicts, or sequences ordered like columns. They are COPYed
+    into a temp staging table (temp tables skip the WAL), then applied
+    with one INSERT ... SELECT ... ON CONFLICT (conflict_cols) DO UPDATE.
+    conflict_cols must have a unique index or constraint.
+
+    update_cols are set from the new rows on conflict. By default that
+    is every column not in conflict_cols. If it is empty, conflicting
+    rows are left alone (DO NOTHING). If rows repeat conflict_cols,
+    the last one wins.
+
+    Runs in one transaction (or the current one). Returns
+    {"inserted": n, "updated": n, "skipped": n}
+    """
+
+    assert conflict_cols, "Need the columns of a unique index"
+    rows, columns = peek_columns(rows, columns)
+    if not columns:
+        return {"inserted": 0, "updated": 0, "skipped": 0}
+    missing = set(conflict_cols) - set(columns)
+    assert not missing, f"Rows are missing conflict columns {missing}"
+    if update_cols is None:
+        update_cols = [x for x in columns if x not in conflict_cols]
+    assert set(update_cols) <= set(columns), "Can only update loaded cols"
+
+    stage = f"{self.name}_stage_{next(_stage_ids)}"
+    cols = ",".join(columns)
+    conflict = ",".join(conflict_cols)
+    if update_cols:
+        action = "UPDATE SET " + ", ".join(f"{x} = EXCLUDED.{x}"
+                                           for x in update_cols)
+    else:
+        action = "NOTHING"
+    upsert_sql = f"""WITH staged AS (
+                    SELECT DISTINCT ON ({conflict}) {cols} FROM {stage}
+                        ORDER BY {conflict}, {_ROW_COL} DESC),
+                 upserted AS (
+                    INSERT INTO {self.name} ({cols})
+                    SELECT {cols} FROM staged
+                    ON CONFLICT ({conflict}) DO {action}
+                    -- xmax is 0 for rows that didn't exist before
+                    RETURNING (xmax = 0) AS inserted)
+                 SELECT COUNT(*) FILTER (WHERE inserted) AS inserted,
+                        COUNT(*) FILTER (WHERE NOT inserted) AS updated,
+                        (SELECT COUNT(*) FROM staged) AS staged
+                 FROM upserted;"""
+
+    with self.transaction():
+        # The same types as the table, without its constraints
+        self.execute(f"""CREATE TEMP TABLE {stage} AS
+                         SELECT {cols} FROM {self.name} WITH NO DATA;
+                         ALTER TABLE {stage}
+                             ADD COLUMN {_ROW_COL} BIGSERIAL;""")
+        _copy_to_stage(self, stage, rows, columns, batch_size)
+        result = self.execute(upsert_sql)[0]
+        self.execute(f"DROP TABLE {stage}")
+
+    inserted = row_value(result, "inserted", 0)
+    updated = row_value(result, "updated", 1)
+    # Duplicates in rows are not counted as skipped
+    counts = {"inserted": inserted,
+              "updated": updated,
+              "skipped": row_value(result, "staged", 2) - inserted - updated}
+    logging.debug(f"Upserted into {self.name}: {counts}")
+    return counts
+
+
+def _copy_to_stage(self, stage: str, rows, columns: list, batch_size):
+    """COPYs rows into the staging table
+
+    Binary COPY is used when every column type supports it"""
+
+    types = self.column_types
+    udt_names = [types[x] for x in columns]
+    sql = f"COPY {stage} ({','.join(columns)}) FROM STDIN"
+    if all(x.lstrip("_") in TYPES for x in udt_names):
+        encoder = BinaryCopyEncoder(columns, udt_names)
+        buf = CopyBuffer(encoder.encode_rows(rows, batch_size))
+        sql += " WITH (FORMAT binary)"
+    else:
+        buf = CopyBuffer(encode_text_rows(rows, columns, batch_size))
+    self._cursor.copy_expert(sql, buf)
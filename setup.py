@@ -27,6 +27,9 @@ setup(
         'psycopg2-binary',
         'pytest',
     ],
+    extras_require={
+        'async': ['psycopg[binary]', 'psycopg_pool'],
+    },
     classifiers=[
         'Environment :: Console',
         'Environment :: Web Environment',